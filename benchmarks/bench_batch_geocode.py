@@ -0,0 +1,48 @@
+'''Throughput of Geocoder.geocode_many/isochrone_many against the local stub server,
+compared with one Geocoder per address called serially.
+
+Run from the repo root: python -m benchmarks.bench_batch_geocode --addresses 500 --latency 0.05
+'''
+import argparse
+import os
+import time
+
+from benchmarks.stub_server import StubServer
+from models import Geocoder
+from models.cache import LRUCache
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=200)
+    parser.add_argument('--duplicates', type=float, default=0.2, help='Share of repeated addresses')
+    parser.add_argument('--latency', type=float, default=0.05, help='Simulated server latency in seconds')
+    parser.add_argument('--rate-limit', type=float, default=0.02, help='Share of requests answered with 429')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32])
+    args = parser.parse_args()
+
+    unique = int(args.addresses * (1 - args.duplicates))
+    addresses = [f'{i} High Street, Town {i % 97}' for i in range(unique)]
+    addresses += addresses[:args.addresses - unique]
+
+    with StubServer(latency=args.latency, rate_limit=args.rate_limit) as server:
+        os.environ['MAPBOX_API_URL'] = server.url
+
+        start = time.perf_counter()
+        serial_cache = LRUCache()
+        for address in addresses:
+            Geocoder(address, cache=serial_cache).geocode_address()
+        serial = time.perf_counter() - start
+        print(f'serial geocode:      {serial:.2f}s ({len(addresses) / serial:,.0f}/s)')
+
+        for workers in args.workers:
+            calls = len(server.calls)
+            start = time.perf_counter()
+            result = Geocoder.isochrone_many(addresses, mode='driving', minutes=20,
+                                             max_workers=workers, cache=LRUCache())
+            elapsed = time.perf_counter() - start
+            failed = result['error'].notna().sum()
+            print(f'isochrone_many x{workers:<3} {elapsed:.2f}s ({len(addresses) / elapsed:,.0f}/s, '
+                  f'{len(server.calls) - calls} requests, {failed} failed)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''Search time with and without precomputed catchment tiles.
+
+Precomputes a handful of origins against the stub endpoints and a synthetic ward and
+hex layer, then times Mapper.overlay and a PortfolioAnalysis run on the live path and
+from the store. tests/test_catchments.py checks both give the same rows.
+
+Run from the repo root: python -m benchmarks.bench_catchments --origins 10 --minutes 30 60
+'''
+import argparse
+import os
+import time
+
+from benchmarks.bench_h3 import synthetic_sales
+from benchmarks.stub_server import StubServer
+from benchmarks.suite import Workspace, synthetic_ward_features
+from models import Mapper, PortfolioAnalysis
+from models.catchments import catchment_store, CATCHMENT_GENERALIZE
+from models.geocoding import Geocoder
+from models.hexbin import HexBinner
+from models.spatial_index import LayerIndex
+from models.wards import ward_store
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--origins', type=int, default=10)
+    parser.add_argument('--mode', default='driving')
+    parser.add_argument('--minutes', type=int, nargs='+', default=[30, 60])
+    parser.add_argument('--sales', type=int, default=500000)
+    args = parser.parse_args()
+
+    with StubServer(wards=synthetic_ward_features()) as server, Workspace():
+        os.environ['MAPBOX_API_URL'] = server.url
+        os.environ['WARDS_SOURCE'] = server.wards_url
+        os.environ.pop('GEOCODER_CACHE_PATH', None)
+        wards = ward_store().index()
+        hexes = LayerIndex(HexBinner(resolutions=7, count_cutoff=0).bin_frame(synthetic_sales(args.sales))[7])
+        baselines = {'median_price': 250000, 'mean_price': 300000,
+                     'weighted_median_price': 250000, 'weighted_mean_price': 300000}
+        addresses = [f'{i} Common Origin Street' for i in range(args.origins)]
+        sites = [(a, args.mode, m) for a in addresses for m in args.minutes]
+        print(f'{len(wards.layer):,} wards, {len(hexes.layer):,} hexes')
+        for label in ('live', 'precomputed'):
+            if label == 'precomputed':
+                # The store starts empty, so the first pass took the live path
+                origins = Geocoder.geocode_many(addresses)
+                _, build_time = timed(catchment_store().build, origins, wards, hexes,
+                                      modes=[args.mode], minutes=args.minutes)
+                print(f'precomputed {len(sites)} catchments in {build_time:.2f}s')
+            _, overlay_time = timed(lambda: [Mapper(a).overlay(mode, m, 1, CATCHMENT_GENERALIZE) for a, mode, m in sites])
+            portfolio = PortfolioAnalysis(wards=wards.layer, prices=hexes.layer, baselines=baselines, weighted=True)
+            _, portfolio_time = timed(portfolio.run, sites)
+            print(f'{label:<12} overlay {overlay_time / len(sites) * 1000:>7.1f}ms/search, '
+                  f'portfolio {portfolio_time:.2f}s for {len(sites)} sites')
+
+if __name__ == '__main__':
+    main()
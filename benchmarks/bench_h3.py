@@ -0,0 +1,50 @@
+'''Compare the apply-based PricesPaid.to_h3 path with the batched HexBinner.
+
+Run from the repo root: python -m benchmarks.bench_h3 --rows 1000000
+'''
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from models import PricesPaid
+from models.hexbin import HexBinner
+
+def synthetic_sales(rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'latitude': rng.uniform(50.0, 55.5, rows),
+                         'longitude': rng.uniform(-5.5, 1.7, rows),
+                         'AMOUNT': rng.lognormal(12.5, 0.6, rows).round()})
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--skip-apply', action='store_true')
+    args = parser.parse_args()
+
+    prices = PricesPaid(df=synthetic_sales(args.rows))
+    vectorized, vectorized_time = timed(prices.to_h3)
+    print(f'vectorized to_h3: {vectorized_time:.3f}s for {args.rows:,} rows ({len(vectorized):,} cells)')
+
+    _, cached_time = timed(prices.to_h3)
+    print(f'cached to_h3:     {cached_time:.3f}s')
+
+    _, multi_time = timed(HexBinner(resolutions=[5, 6, 7, 8]).bin_frame, prices.gdf)
+    print(f'resolutions 5-8:  {multi_time:.3f}s')
+
+    if not args.skip_apply:
+        legacy, legacy_time = timed(prices.to_h3_apply)
+        print(f'apply to_h3:      {legacy_time:.3f}s ({legacy_time / vectorized_time:.1f}x slower)')
+        merged = legacy.merge(vectorized, on='H3_cell', suffixes=('_apply', ''))
+        assert len(merged) == len(legacy) == len(vectorized)
+        for column in ['mean_price', 'median_price', 'total_paid', 'count']:
+            assert np.allclose(merged[f'{column}_apply'], merged[column])
+        print('outputs match')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''Catchment price metrics by H3 id join against the geometric overlay, plus point,
+k-ring and roll-up lookup times.
+
+Builds the hex layer from synthetic sales, then for each synthetic isochrone times
+LayerIndex.overlay and HexIndex.overlay and compares the aggregated prices. Roll-ups
+are checked against binning the sales at the coarser resolution directly.
+Run from the repo root: python -m benchmarks.bench_hexindex --resolution 7
+'''
+import argparse
+import time
+import numpy as np
+
+from models import LayerIndex, HexIndex
+from models.baselines import aggregate_prices
+from models.hexbin import HexBinner
+from benchmarks.bench_h3 import synthetic_sales
+from benchmarks.bench_overlay import synthetic_isochrone, timed, ORIGIN
+
+def per_call(func, *args, calls: int = 1000):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func(*args)
+    return (time.perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sales', type=int, default=500000)
+    parser.add_argument('--resolution', type=int, default=7)
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 30, 60])
+    parser.add_argument('--modes', nargs='+', default=['walking', 'driving'])
+    args = parser.parse_args()
+
+    coarser = args.resolution - 2
+    levels = HexBinner(resolutions=[coarser, args.resolution], count_cutoff=0).bin_frame(synthetic_sales(args.sales))
+    layer = levels[args.resolution]
+    layer_index, layer_time = timed(LayerIndex, layer, repeat=1)
+    hex_index, hex_time = timed(HexIndex, layer, repeat=1)
+    print(f'{len(layer):,} hexes at resolution {args.resolution}: '
+          f'LayerIndex {layer_time * 1000:.0f}ms, HexIndex {hex_time * 1000:.0f}ms to build')
+
+    rollup = hex_index.rollup(coarser).set_index('H3_cell')
+    binned = levels[coarser].set_index('H3_cell').join(rollup, rsuffix='_rollup')
+    assert len(rollup) == len(levels[coarser])
+    for column in ('count', 'total_paid', 'mean_price'):
+        assert np.allclose(binned[column], binned[f'{column}_rollup']), column
+    lon, lat = ORIGIN
+    print(f'point {per_call(hex_index.point, lat, lon) * 1e6:.0f}us, '
+          f'point at {coarser} {per_call(hex_index.point, lat, lon, coarser) * 1e6:.0f}us, '
+          f'2-ring {per_call(hex_index.ring, lat, lon, 2) * 1e6:.0f}us, '
+          f'roll-up to {coarser} {per_call(hex_index.rollup, coarser, calls=3) * 1000:.0f}ms '
+          f'(counts, totals and means match binning at {coarser})')
+
+    print(f'{"mode":<8} {"mins":>4} {"weighted":>8} {"hexes":>11} {"overlay":>9} {"h3":>9} {"median":>7} {"mean":>7}')
+    for mode in args.modes:
+        for minutes in args.minutes:
+            area = synthetic_isochrone(mode, minutes)
+            for weighted in (False, True):
+                expected, overlay_time = timed(layer_index.overlay, area, fractions=weighted)
+                result, h3_time = timed(hex_index.overlay, area, fractions=weighted)
+                old, new = (aggregate_prices(r, weighted=weighted) for r in (expected, result))
+                difference = (new / old - 1) * 100
+                print(f'{mode:<8} {minutes:>4} {str(weighted):>8} {len(expected):>5}/{len(result):<5} '
+                      f'{overlay_time * 1000:>7.1f}ms {h3_time * 1000:>7.1f}ms '
+                      f'{difference["median_price"]:>6.2f}% {difference["mean_price"]:>6.2f}%')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''Local isochrone engine: isochrones per second on a synthetic road grid, residential
+streets with a primary road every fifth line. tests/test_routing.py checks travel times
+and polygons on a small OSM extract of the same grid. Run from the repo root:
+python -m benchmarks.bench_isochrones --size 300
+'''
+import argparse
+import time
+import numpy as np
+
+from models.isochrones import LocalIsochrones
+from models.routing import RoadGraph, HIGHWAY_CLASSES
+from benchmarks.bench_overlay import ORIGIN
+
+SPACING_METRES = 100
+
+def grid_coordinates(size: int, spacing: float = SPACING_METRES, origin=ORIGIN):
+    '''lon, lat of a size x size grid of nodes spacing metres apart, node i*size + j at row i.'''
+    lon0, lat0 = origin
+    dlat = spacing / 111195
+    dlon = dlat / np.cos(np.radians(lat0))
+    rows, cols = np.divmod(np.arange(size * size), size)
+    return lon0 + (cols - size // 2) * dlon, lat0 + (rows - size // 2) * dlat
+
+def grid_lines(size: int, primary_every: int = 5):
+    '''(nodes, highway) for every grid row and column, in OSM way order.'''
+    lines = []
+    for k in range(size):
+        highway = 'primary' if k % primary_every == 0 else 'residential'
+        lines.append((list(range(k * size, (k + 1) * size)), highway))
+        lines.append((list(range(k, size * size, size)), highway))
+    return lines
+
+def synthetic_graph(size: int):
+    '''The grid built straight from arrays, for sizes too big to write as XML.'''
+    lon, lat = grid_coordinates(size)
+    u, v, highway = [], [], []
+    for nodes, name in grid_lines(size):
+        u.extend(nodes[:-1])
+        v.extend(nodes[1:])
+        highway.extend([HIGHWAY_CLASSES.index(name)] * (len(nodes) - 1))
+    return RoadGraph(lon, lat, u, v, highway)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=300, help='grid side in nodes, 100m apart')
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', default=['driving', 'cycling', 'walking'])
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 30])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = synthetic_graph(args.size)
+    print(f'{graph.nodes:,} nodes, {graph.edges:,} edges built in {time.perf_counter() - start:.2f}s')
+    provider = LocalIsochrones(graph=graph)
+    rng = np.random.default_rng(0)
+    inner = rng.choice(graph.nodes, args.searches)
+    print(f'{"mode":<9} {"minutes":>7} {"route":>9} {"polygon":>9} {"isochrones/s":>13}')
+    for mode in args.modes:
+        start = time.perf_counter()
+        mode_graph = graph.mode(mode)
+        setup = time.perf_counter() - start
+        for minutes in args.minutes:
+            start = time.perf_counter()
+            for node in inner:
+                mode_graph.travel_times(mode_graph.sources(graph.x[node], graph.y[node]), minutes * 60)
+            route = (time.perf_counter() - start) / args.searches
+            start = time.perf_counter()
+            for node in inner:
+                provider.isochrone_json(graph.lon[node], graph.lat[node], mode, minutes)
+            total = (time.perf_counter() - start) / args.searches
+            print(f'{mode:<9} {minutes:>7} {route * 1000:>7.1f}ms {(total - route) * 1000:>7.1f}ms {1 / total:>13.1f}')
+        print(f'{"":<9} CSR graph built in {setup * 1000:.0f}ms')
+
+if __name__ == '__main__':
+    main()
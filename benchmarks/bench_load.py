@@ -0,0 +1,86 @@
+'''Cold-start time and resident memory of the old and compact data load paths.
+
+Each case runs in a fresh interpreter. Sales cases use a synthetic CSV of --rows sales.
+Run from the repo root: python -m benchmarks.bench_load --rows 2000000
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+from benchmarks.bench_h3 import synthetic_sales
+
+# (imports, load) per case; imports are timed separately from the load itself
+CASES = {
+    'hex geojson (json.load loop)': ('import json, pandas as pd', '''
+        with open('data/prices-paid-hex.geojson') as f:
+            data = json.load(f)
+        d = pd.DataFrame(data['features'])
+        mean, median, total, count = [], [], [], []
+        for x in d['properties']:
+            mean.append(x[0]['mean_price']); median.append(x[1]['median_price'])
+            total.append(x[2]['total_paid']); count.append(x[3]['count'])
+        '''),
+    'hex csv + wkt (read_csv)': ('import pandas as pd, geopandas as gpd', '''
+        df = pd.read_csv('data/prices-paid-hex.csv')
+        gpd.GeoSeries.from_wkt(df['geometry'])
+        '''),
+    'hex layer (parquet)': ('from models.datastore import load_hex_layer', '''
+        load_hex_layer()
+        '''),
+    'hex stats only (parquet)': ('from models.datastore import load_hex_table', '''
+        load_hex_table(columns=['H3_cell', 'median_price', 'mean_price'])
+        '''),
+    'sales csv + points GeoDataFrame': ('import pandas as pd, geopandas as gpd', '''
+        df = pd.read_csv(os.environ['BENCH_SALES_CSV'])
+        gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.longitude, df.latitude)).reset_index()
+        '''),
+    'sales (typed parquet)': ('import models.datastore as ds', '''
+        ds.SALES_PATH = os.environ['BENCH_SALES_PARQUET']
+        ds.load_sales()
+        '''),
+}
+
+RUNNER = '''
+import os, resource, time
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+base = rss()
+{code}
+elapsed = time.perf_counter() - imported
+print(imported - start, elapsed, rss() - base)
+'''
+
+def run_case(imports: str, code: str, env: dict):
+    script = RUNNER.format(imports=imports, code=textwrap.dedent(code))
+    output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+    import_time, elapsed, resident = output.stdout.split()
+    return float(import_time), float(elapsed), float(resident)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    from models.datastore import prepare, write_sales
+    prepare()
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'sales.csv')
+        parquet_path = os.path.join(tmp, 'sales.parquet')
+        synthetic_sales(args.rows).to_csv(csv_path, index=False)
+        write_sales(csv_path, parquet_path)
+        env = dict(os.environ, BENCH_SALES_CSV=csv_path, BENCH_SALES_PARQUET=parquet_path,
+                   PYTHONWARNINGS='ignore')
+        print(f'{"case":<34} {"imports":>8} {"load":>8} {"resident":>10}')
+        for name, (imports, code) in CASES.items():
+            import_time, elapsed, resident = run_case(imports, code, env)
+            print(f'{name:<34} {import_time:>7.3f}s {elapsed:>7.3f}s {resident:>8.1f}MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''Per-search overlay time: gpd.overlay against every feature vs the LayerIndex.
+
+Uses the cached ward layer when data/wards/wards.parquet exists, otherwise a
+synthetic ward grid. Run from the repo root: python -m benchmarks.bench_overlay
+'''
+import argparse
+import os
+import time
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Point, box
+
+from models import LayerIndex
+from models.wards import WARD_STORE_PATH
+from benchmarks.bench_h3 import synthetic_sales
+from models.hexbin import HexBinner
+
+# Rough straight-line speeds in km/h, enough to size synthetic isochrones
+MODE_SPEEDS = {'driving': 40, 'cycling': 15, 'walking': 5}
+ORIGIN = (-0.1419, 51.5014)
+
+def synthetic_wards(step: float = 0.03):
+    xs = np.arange(-5.5, 1.7, step)
+    ys = np.arange(50.0, 55.5, step)
+    cells = [box(x, y, x + step, y + step) for x in xs for y in ys]
+    wards = gpd.GeoDataFrame({'Ward Code': [f'W{i:06d}' for i in range(len(cells))],
+                              'total_population': np.random.default_rng(0).integers(2000, 20000, len(cells))},
+                             geometry=cells, crs=4326)
+    return wards
+
+def load_wards():
+    if os.path.exists(WARD_STORE_PATH):
+        return gpd.read_parquet(WARD_STORE_PATH)
+    return synthetic_wards()
+
+def synthetic_isochrone(mode: str, minutes: int):
+    radius_km = MODE_SPEEDS[mode] * minutes / 60
+    circle = Point(ORIGIN).buffer(radius_km / 111, resolution=32)
+    # Squash longitude so the shape is roughly circular on the ground at UK latitudes
+    circle = gpd.GeoSeries([circle], crs=4326).scale(xfact=1.6, yfact=1, origin=ORIGIN)
+    return gpd.GeoDataFrame({'contour': [minutes], 'metric': ['time']}, geometry=circle, crs=4326)
+
+def timed(func, *args, repeat: int = 3, **kwargs):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 20, 30, 45, 60])
+    parser.add_argument('--modes', nargs='+', default=['walking', 'driving'])
+    args = parser.parse_args()
+
+    layers = {'wards': load_wards(),
+              'hexes': HexBinner(count_cutoff=0).bin_frame(synthetic_sales(500000))[5]}
+    for name, layer in layers.items():
+        (index, build_time) = timed(LayerIndex, layer, repeat=1)
+        print(f'{name}: {len(layer):,} features, index built in {build_time:.3f}s')
+        print(f'{"mode":<8} {"mins":>4} {"rows":>6} {"overlay":>9} {"indexed":>9} {"no clip":>9}')
+        for mode in args.modes:
+            for minutes in args.minutes:
+                area = synthetic_isochrone(mode, minutes)
+                expected, overlay_time = timed(gpd.overlay, area, layer, how='intersection')
+                result, index_time = timed(index.overlay, area)
+                _, member_time = timed(index.overlay, area, clip=False)
+                assert len(result) == len(expected)
+                assert list(result.columns) == list(expected.columns)
+                print(f'{mode:<8} {minutes:>4} {len(result):>6} {overlay_time:>8.3f}s {index_time:>8.3f}s {member_time:>8.3f}s')
+
+if __name__ == '__main__':
+    main()
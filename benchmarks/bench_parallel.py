@@ -0,0 +1,63 @@
+'''Overlay scaling with the number of clipping processes.
+
+Clips a batch of large catchments against a fine synthetic ward grid with
+LayerIndex, then with ParallelLayerIndex at each worker count, and checks every
+run returns the same rows and geometry as the serial one.
+
+Run from the repo root: python -m benchmarks.bench_parallel --workers 1 2 4 8
+'''
+import argparse
+import os
+import time
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon
+
+from models import LayerIndex, ParallelLayerIndex
+from benchmarks.bench_overlay import synthetic_wards, MODE_SPEEDS
+
+def synthetic_catchments(sites: int, mode: str, minutes: int, seed: int = 0):
+    '''Catchments with a ragged 720-vertex edge, so each clip costs what a real isochrone would.'''
+    rng = np.random.default_rng(seed)
+    radius = MODE_SPEEDS[mode] * minutes / 60 / 111
+    angles = np.linspace(0, 2 * np.pi, 720, endpoint=False)
+    shapes = []
+    for lon, lat in zip(rng.uniform(-2.5, 0.0, sites), rng.uniform(51.0, 53.5, sites)):
+        r = radius * rng.uniform(0.85, 1.0, len(angles))
+        shapes.append(Polygon(np.column_stack((lon + 1.6 * r * np.cos(angles), lat + r * np.sin(angles)))))
+    return gpd.GeoDataFrame({'site_id': range(sites)}, geometry=shapes, crs=4326)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--sites', type=int, default=20)
+    parser.add_argument('--mode', default='driving')
+    parser.add_argument('--minutes', type=int, default=60)
+    parser.add_argument('--step', type=float, default=0.01, help='Ward grid spacing in degrees')
+    args = parser.parse_args()
+
+    wards = synthetic_wards(step=args.step)
+    areas = synthetic_catchments(args.sites, args.mode, args.minutes)
+    print(f'{len(wards):,} wards, {args.sites} {args.minutes} min {args.mode} catchments, {os.cpu_count()} CPUs')
+
+    expected, serial_time = timed(LayerIndex(wards).overlay, areas, fractions=True)
+    print(f'{"workers":>7} {"rows":>8} {"overlay":>9} {"speedup":>8}')
+    print(f'{"serial":>7} {len(expected):>8,} {serial_time:>8.3f}s {1:>7.2f}x')
+    for workers in args.workers:
+        index = ParallelLayerIndex(wards, max_workers=workers)
+        # The first call forks the pool; time the second
+        index.overlay(areas.iloc[:1])
+        result, parallel_time = timed(index.overlay, areas, fractions=True)
+        index.close()
+        assert list(result.columns) == list(expected.columns)
+        assert result.drop(columns='geometry').equals(expected.drop(columns='geometry'))
+        assert result.geometry.geom_equals_exact(expected.geometry, tolerance=0).all()
+        print(f'{workers:>7} {len(result):>8,} {parallel_time:>8.3f}s {serial_time / parallel_time:>7.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Map payload size and encode time: the old json.loads(gdf.to_json()) path against the
+simplified, quantised geojson_text writer at several zoom levels.
+
+Uses the cached ward layer when data/wards/wards.parquet exists, otherwise a synthetic
+grid with detailed, wiggly boundaries that neighbouring wards share, like BFE wards.
+Run from the repo root: python -m benchmarks.bench_payload --zooms 8 10 12 14
+'''
+import argparse
+import json
+import os
+import time
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from models import LayerIndex
+from models.payload import geojson_text, zoom_decimals, zoom_tolerance
+from models.wards import WARD_STORE_PATH
+from benchmarks.bench_overlay import synthetic_wards, synthetic_isochrone
+
+def detailed_wards(step: float = 0.03, vertices: int = 80):
+    '''Grid wards densified to vertices per edge and bent by a smooth displacement field.
+    The field depends only on position, so shared edges stay identical.'''
+    wards = synthetic_wards(step)
+    geometry = shapely.segmentize(np.asarray(wards.geometry.values), step / vertices)
+
+    def bend(coords):
+        x, y = coords[:, 0], coords[:, 1]
+        # Slopes stay under 1 so no edge folds back on itself
+        dx = 0.002 * np.sin(y * 150) + 0.0003 * np.sin(y * 900 + x * 40)
+        dy = 0.002 * np.sin(x * 140) + 0.0003 * np.sin(x * 950 + y * 30)
+        return np.column_stack((x + dx, y + dy))
+    return wards.set_geometry(shapely.transform(geometry, bend))
+
+def load_wards():
+    if os.path.exists(WARD_STORE_PATH):
+        return gpd.read_parquet(WARD_STORE_PATH)
+    return detailed_wards()
+
+def timed(func, *args, repeat: int = 3, **kwargs):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def legacy_payload(area):
+    return json.dumps(json.loads(area.to_json()))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zooms', type=float, nargs='+', default=[8, 10, 12, 14])
+    parser.add_argument('--mode', default='driving')
+    parser.add_argument('--minutes', type=int, default=45)
+    args = parser.parse_args()
+
+    area = LayerIndex(load_wards()).overlay(synthetic_isochrone(args.mode, args.minutes))
+    vertices = shapely.get_num_coordinates(np.asarray(area.geometry.values)).sum()
+    print(f'{len(area):,} ward pieces, {vertices:,} vertices in a {args.minutes} min {args.mode} catchment')
+
+    legacy, legacy_time = timed(legacy_payload, area)
+    print(f'{"payload":<16} {"vertices":>9} {"KB":>9} {"encode":>9}')
+    print(f'{"to_json":<16} {vertices:>9,} {len(legacy) / 1024:>9,.0f} {legacy_time * 1000:>7.1f}ms')
+    full, full_time = timed(geojson_text, area, properties=['Ward Code'])
+    print(f'{"writer":<16} {vertices:>9,} {len(full) / 1024:>9,.0f} {full_time * 1000:>7.1f}ms')
+    for zoom in args.zooms:
+        text, text_time = timed(geojson_text, area, properties=['Ward Code'], zoom=zoom)
+        kept = sum(len(f['geometry']['coordinates'][0]) if f['geometry']['type'] == 'Polygon'
+                   else sum(len(p[0]) for p in f['geometry']['coordinates'])
+                   for f in json.loads(text)['features'])
+        label = f'zoom {zoom:g} ({zoom_decimals(zoom)} dp)'
+        print(f'{label:<16} {kept:>9,} {len(text) / 1024:>9,.0f} {text_time * 1000:>7.1f}ms'
+              f'  {len(legacy) / len(text):.1f}x smaller, tolerance {zoom_tolerance(zoom) * 111000:.0f}m')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''Payload size and build time of the price choropleth: the single-resolution
+to_geojson path against zoom-aware pyramid serving.
+
+Run from the repo root: python -m benchmarks.bench_pyramid --rows 1000000
+'''
+import argparse
+import json
+import time
+
+from benchmarks.bench_h3 import synthetic_sales
+from models import PricesPaid
+from models.payload import dumps
+
+# (label, zoom, bbox)
+VIEWS = [('national', 5, None),
+         ('region', 8, (-1.0, 51.2, 0.6, 51.8)),
+         ('city', 11, (-0.25, 51.45, 0.0, 51.56)),
+         ('street', 13, (-0.16, 51.50, -0.12, 51.52))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    prices = PricesPaid(df=synthetic_sales(args.rows))
+
+    prices.to_h3()
+    start = time.perf_counter()
+    legacy = json.dumps(prices.to_geojson())
+    print(f'{"to_geojson (res 5)":<22} {len(prices.to_h3()):>7,} cells {len(legacy) / 1e6:>7.2f}MB '
+          f'{time.perf_counter() - start:>7.3f}s')
+
+    start = time.perf_counter()
+    pyramid = prices.to_pyramid()
+    print(f'pyramid built in {time.perf_counter() - start:.2f}s')
+    for label, zoom, bbox in VIEWS:
+        start = time.perf_counter()
+        cells, geojson = pyramid.geojson(zoom=zoom, bbox=bbox)
+        payload = dumps(geojson)
+        resolution = int(cells['resolution'].iloc[0]) if len(cells) else None
+        print(f'{label + " (res " + str(resolution) + ")":<22} {len(cells):>7,} cells {len(payload) / 1e6:>7.2f}MB '
+              f'{time.perf_counter() - start:>7.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''Server startup time and per-session memory with the shared dataset registry.
+
+Warms the registry in a scratch data directory (synthetic sales, stub ward and
+Mapbox endpoints), then replays the per-rerun work of the old dashboard and of
+the registry version. Finally it holds the results of many simulated sessions
+to measure how much memory each one adds.
+
+Run from the repo root: python -m benchmarks.bench_sessions --sessions 20
+'''
+import argparse
+import copy
+import os
+import time
+
+from benchmarks.bench_h3 import synthetic_sales
+from benchmarks.stub_server import StubServer
+from benchmarks.suite import Workspace, synthetic_ward_features, write_sales_parquet
+from models import Mapper
+from models.baselines import aggregate_prices
+from models.datastore import SALES_PATH
+from models.registry import DatasetRegistry, resident_bytes
+from models.wards import load_ward_population
+
+def timed(func, repeat: int = 10):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sales', type=int, default=500000)
+    parser.add_argument('--sessions', type=int, default=20)
+    args = parser.parse_args()
+
+    with StubServer(wards=synthetic_ward_features()) as server, Workspace():
+        os.environ['MAPBOX_API_URL'] = server.url
+        os.environ['WARDS_SOURCE'] = server.wards_url
+        os.environ.pop('GEOCODER_CACHE_PATH', None)
+        write_sales_parquet(synthetic_sales(args.sales), SALES_PATH)
+
+        data = DatasetRegistry()
+        report = data.warm()
+        for name, stats in report['datasets'].items():
+            print(f'{name:<16} {stats["seconds"]:>7.3f}s {stats["rss_mb"] or 0:>7.1f} MB')
+        print(f'startup          {report["startup_seconds"]:>7.3f}s, RSS {report["rss_mb"] or 0:.1f} MB')
+
+        def legacy_rerun():
+            # Ward CSV read at module level, st.cache hashing and copying the cached values
+            load_ward_population()
+            copy.deepcopy(data.baselines())
+            data.prices().copy()
+
+        def registry_rerun():
+            data.warm()
+            data.baselines()
+            data.prices_index()
+
+        print(f'rerun overhead: legacy {timed(legacy_rerun):.1f}ms, registry {timed(registry_rerun):.3f}ms')
+
+        sessions = []
+        before = resident_bytes()
+        for i in range(args.sessions):
+            # What a session keeps after one search: the figure, ward table and price overlay
+            fig, area_stats, area = Mapper(f'{i} Session Street').build_map(mode='driving', minutes=20)
+            prices = data.prices_index().overlay(area)
+            sessions.append((fig, area_stats, area, prices, aggregate_prices(prices)))
+        if before is not None:
+            growth = (resident_bytes() - before) / 2 ** 20
+            print(f'{args.sessions} sessions: +{growth:.1f} MB RSS, {growth / args.sessions:.2f} MB per session')
+
+if __name__ == '__main__':
+    main()
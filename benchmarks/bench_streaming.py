@@ -0,0 +1,55 @@
+'''Peak memory and time of in-memory PricesPaid binning vs streaming ingestion,
+on a synthetic price-paid CSV. Each case runs in a fresh interpreter.
+
+Run from the repo root: python -m benchmarks.bench_streaming --rows 5000000
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_h3 import synthetic_sales
+
+CASES = {
+    'in-memory PricesPaid.to_h3': '''
+import pandas as pd
+from models import PricesPaid
+PricesPaid(df=pd.read_csv(path)).to_h3()
+''',
+    'streaming, two pass': '''
+from models.streaming import stream_h3
+stream_h3(path, chunksize=chunksize)
+''',
+    'streaming, single pass': '''
+from models.streaming import stream_h3
+stream_h3(path, chunksize=chunksize, two_pass=False)
+''',
+}
+
+RUNNER = '''
+import os, resource, time
+path, chunksize = os.environ['BENCH_SALES_CSV'], int(os.environ['BENCH_CHUNKSIZE'])
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--chunksize', type=int, default=250000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sales.csv')
+        synthetic_sales(args.rows).to_csv(path, index=False)
+        env = dict(os.environ, BENCH_SALES_CSV=path, BENCH_CHUNKSIZE=str(args.chunksize), PYTHONWARNINGS='ignore')
+        print(f'{args.rows:,} sales, chunks of {args.chunksize:,}')
+        for name, code in CASES.items():
+            output = subprocess.run([sys.executable, '-c', RUNNER.format(code=code)],
+                                    env=env, capture_output=True, text=True, check=True)
+            elapsed, maxrss = output.stdout.split()
+            print(f'{name:<28} {float(elapsed):>7.2f}s {int(maxrss) / 1024:>8.0f}MB peak')
+
+if __name__ == '__main__':
+    main()
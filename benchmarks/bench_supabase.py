@@ -0,0 +1,58 @@
+'''Request-path latency of login checks and search logging against a local PostgREST stub:
+the old full-table scan and synchronous insert vs the filtered, cached, queued client.
+
+Run from the repo root: python -m benchmarks.bench_supabase --users 5000 --latency 0.03
+'''
+import argparse
+import os
+import time
+
+import pandas as pd
+import requests
+
+from benchmarks.stub_server import StubServer, PostgrestHandler
+from models import Supabase
+
+def legacy_check_user(db: Supabase, email: str):
+    users = requests.get(f'{db.url}/users', headers=db.headers).json()
+    user_list = pd.DataFrame(users)['email'].tolist()
+    if email in user_list:
+        for i in users:
+            if i['email'] == email:
+                return i
+    return False
+
+def timed(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    users = [{'email': f'user{i}@example.com', 'password': f'pw{i}', 'name': f'User {i}'} for i in range(args.users)]
+    email = users[-1]['email']
+    row = dict(user=email, address='3 Old Burlington Street', mode='driving', range=20,
+               map_style='carto-positron', map_colours='oranges')
+    with StubServer(latency=args.latency, handler=PostgrestHandler, tables={'users': users}) as server:
+        os.environ['SUPABASE_URL'] = server.url
+        db = Supabase()
+        print(f'{args.users:,} users, {args.latency * 1000:.0f}ms server latency (per call averages)')
+        print(f'login, full table scan:   {timed(lambda: legacy_check_user(db, email), args.repeat):8.2f}ms')
+        print(f'login, filtered uncached: {timed(lambda: (db.user_cache.clear(), db.check_user(email)), args.repeat):8.2f}ms')
+        print(f'login, cached:            {timed(lambda: db.check_user(email), args.repeat):8.2f}ms')
+        print(f'log search, synchronous:  {timed(lambda: db.add_row("searches", **row), args.repeat):8.2f}ms')
+        print(f'log search, queued:       {timed(lambda: db.queue_row("searches", **row), args.repeat):8.2f}ms')
+        inserts = len([c for c in server.calls if c == '/searches'])
+        db.flush()
+        batched = len([c for c in server.calls if c == '/searches']) - inserts
+        print(f'{args.repeat} queued rows written in {batched} request(s); '
+              f'{len(server.tables["searches"])} rows stored')
+
+if __name__ == '__main__':
+    main()
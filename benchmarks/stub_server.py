@@ -0,0 +1,159 @@
+'''Local stand-ins for the Mapbox geocoding/isochrone endpoints, the ArcGIS ward
+boundary query and the Supabase PostgREST tables.
+
+Responses are deterministic for a given address/origin, so runs are
+reproducible without network access or an API token.'''
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+def address_point(address: str):
+    seed = zlib.crc32(address.strip().lower().encode())
+    rng = random.Random(seed)
+    return rng.uniform(-3.0, 0.5), rng.uniform(50.8, 53.5)
+
+def circle(lon: float, lat: float, radius_deg: float, points: int = 64):
+    ring = [[lon + 1.6 * radius_deg * math.cos(2 * math.pi * i / points),
+             lat + radius_deg * math.sin(2 * math.pi * i / points)] for i in range(points)]
+    return ring + [ring[0]]
+
+def geocode_response(address: str):
+    lon, lat = address_point(address)
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature',
+                          'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                          'properties': {'place_name': address}}]}
+
+def isochrone_response(lon: float, lat: float, mode: str, minutes: int):
+    speed = {'driving': 40, 'cycling': 15, 'walking': 5}.get(mode, 40)
+    radius = speed * minutes / 60 / 111
+    return {'type': 'FeatureCollection',
+            'features': [{'type': 'Feature',
+                          'geometry': {'type': 'Polygon', 'coordinates': [circle(lon, lat, radius)]},
+                          'properties': {'contour': minutes, 'metric': 'time', 'fill': '#bf4040',
+                                         'fillOpacity': 0.33, 'fillColor': '#bf4040',
+                                         'color': '#bf4040', 'opacity': 0.33}}]}
+
+# Ward boundaries are served here when the server is given a FeatureCollection
+WARDS_PATH = '/arcgis/rest/services/Wards/FeatureServer/0/query'
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this keep-alive clients hit delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body, status: int = 200, headers: dict = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.calls.append(self.path)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.rate_limit and server.rng.random() < server.rate_limit:
+            return self.send_json({'message': 'Too Many Requests'}, status=429, headers={'Retry-After': '0.01'})
+        if server.error_status:
+            return self.send_json({'message': 'Stub error'}, status=server.error_status)
+        path = urlparse(self.path)
+        if path.path.startswith('/geocoding/v5/mapbox.places/'):
+            address = unquote(path.path.split('/')[-1][:-len('.json')])
+            if server.no_match:
+                return self.send_json({'type': 'FeatureCollection', 'features': []})
+            return self.send_json(geocode_response(address))
+        if path.path.startswith('/isochrone/v1/mapbox/'):
+            _, mode, coords = path.path.rsplit('/', 2)
+            lon, lat = (float(x) for x in coords.split(','))
+            minutes = int(parse_qs(path.query)['contours_minutes'][0])
+            return self.send_json(isochrone_response(lon, lat, mode, minutes))
+        if path.path == WARDS_PATH and server.wards is not None:
+            return self.send_json(server.wards)
+        self.send_json({'message': 'Not Found'}, status=404)
+
+class PostgrestHandler(StubHandler):
+    '''Minimal PostgREST: eq. filters, select= projection and limit on GET, bulk POST.'''
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.calls.append(self.path)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_status:
+            return self.send_json({'message': 'Stub error', 'code': 'PGRST000'}, status=server.error_status)
+        path = urlparse(self.path)
+        rows = server.tables.get(path.path.strip('/'), [])
+        query = parse_qs(path.query)
+        for field, values in query.items():
+            if field not in ('select', 'limit') and values[0].startswith('eq.'):
+                rows = [r for r in rows if str(r.get(field)) == values[0][3:]]
+        if 'select' in query and query['select'][0] != '*':
+            fields = query['select'][0].split(',')
+            rows = [{f: r.get(f) for f in fields} for r in rows]
+        if 'limit' in query:
+            rows = rows[:int(query['limit'][0])]
+        self.send_json(rows)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        rows = body if isinstance(body, list) else [body]
+        with server.lock:
+            server.calls.append(self.path)
+            server.tables.setdefault(urlparse(self.path).path.strip('/'), []).extend(rows)
+        if server.latency:
+            time.sleep(server.latency)
+        if self.headers.get('Prefer') == 'return=minimal':
+            self.send_response(201)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_json(rows, status=201)
+
+class StubServer(ThreadingHTTPServer):
+    '''Set error_status to answer every GET with that status instead, and no_match to
+    geocode every address to an empty FeatureCollection.'''
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0, rate_limit: float = 0, handler=StubHandler, tables: dict = None,
+                 wards: dict = None):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(0)
+        self.calls = []
+        self.lock = threading.Lock()
+        self.tables = tables if tables is not None else {}
+        self.wards = wards
+        self.error_status = None
+        self.no_match = False
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    @property
+    def wards_url(self):
+        return f'{self.url}{WARDS_PATH}?outFields=*&where=1%3D1&f=geojson'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
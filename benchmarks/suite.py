@@ -0,0 +1,288 @@
+'''Offline benchmark suite for the main code paths, run at scaled synthetic sizes.
+
+The Mapbox and ArcGIS endpoints are replaced by the local stub server, and the
+sales and ward layers are synthetic. Every stage runs in a scratch copy of the
+data directory, so nothing under data/ is read or overwritten. Wall time and
+peak memory are recorded per stage and scale. Results are saved as JSON
+named after the current commit, so two commits can be compared:
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --compare benchmarks/results/<commit>.json
+
+Scales multiply --sales and --isochrones (1x, 10x and 100x by default).
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely.geometry import box, mapping
+
+from benchmarks.bench_h3 import synthetic_sales
+from benchmarks.stub_server import StubServer
+from models import Mapper, PricesPaid, import_hex_geojson
+from models import datastore
+from models.datastore import SALES_DTYPES
+from models.registry import resident_bytes
+from models.wards import WardStore, ward_store, load_ward_population, WARD_POP_PATH
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+def synthetic_ward_features(step: float = 0.07):
+    '''ArcGIS-shaped FeatureCollection of grid cells carrying the real ward codes,
+    so the merge with the population file behaves as it does on live data.'''
+    codes = load_ward_population(os.path.join(REPO_ROOT, WARD_POP_PATH))['wd20cd'].tolist()
+    xs = np.arange(-5.5, 1.7, step)
+    ys = np.arange(50.0, 55.5, step)
+    cells = [box(x, y, x + step, y + step) for y in ys for x in xs]
+    features = [{'type': 'Feature',
+                 'geometry': mapping(cell),
+                 'properties': {'FID': i, 'WD20CD': code, 'WD20NM': f'Ward {i}'}}
+                for i, (cell, code) in enumerate(zip(cells, codes))]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def write_sales_parquet(sales, path: str):
+    table = pa.Table.from_pandas(sales.astype(SALES_DTYPES)[list(SALES_DTYPES)], preserve_index=False)
+    pq.write_table(table, path)
+
+class PeakRss():
+    '''Samples RSS from a background thread and keeps the growth over the starting value.
+    Covers native allocations (GEOS, Arrow) that tracemalloc doesn't see.'''
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.growth = None
+
+    def __enter__(self):
+        self.start = resident_bytes()
+        self.peak = self.start
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        if self.start is not None:
+            self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, resident_bytes())
+
+    def __exit__(self, *args):
+        self.done.set()
+        if self.start is not None:
+            self.thread.join()
+            self.peak = max(self.peak, resident_bytes())
+            self.growth = self.peak - self.start
+
+def measure(setup, run, repeat: int = 1, memory: bool = True):
+    '''Best wall time over repeat runs, then one traced run for peak memory.
+    setup() is called before every run and is not timed.
+
+    peak_mb is the tracemalloc peak (Python and NumPy allocations); rss_mb is
+    the RSS growth during the first timed run.'''
+    best = None
+    rss = None
+    for i in range(repeat):
+        state = setup()
+        with PeakRss() as sampler:
+            start = time.perf_counter()
+            rows = run(state)
+            elapsed = time.perf_counter() - start
+        if i == 0 and sampler.growth is not None:
+            rss = sampler.growth / 2 ** 20
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'rows': rows, 'seconds': best, 'peak_mb': None if peak is None else peak / 2 ** 20, 'rss_mb': rss}
+
+class Workspace():
+    '''Scratch working directory with the layout the models expect under data/.'''
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='geocoder-bench-')
+        self.cwd = os.getcwd()
+
+    def __enter__(self):
+        os.makedirs(os.path.join(self.root, 'data', 'wards'))
+        shutil.copy(os.path.join(REPO_ROOT, WARD_POP_PATH), os.path.join(self.root, WARD_POP_PATH))
+        os.chdir(self.root)
+        return self
+
+    def __exit__(self, *args):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def sales_stages(sales):
+    def fresh_prices():
+        return PricesPaid(df=sales)
+
+    def binned_prices():
+        prices = PricesPaid(df=sales)
+        prices.to_h3()
+        return prices
+
+    def cold_hex_layer():
+        for path in (datastore.HEX_PATH, datastore.SALES_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+        write_sales_parquet(sales, datastore.SALES_PATH)
+
+    def warm_hex_layer():
+        if not os.path.exists(datastore.HEX_PATH):
+            cold_hex_layer()
+            datastore.prepare()
+
+    yield 'to_h3', fresh_prices, lambda prices: len(prices.to_h3())
+    yield 'to_geojson', binned_prices, lambda prices: len(prices.to_geojson()['features'])
+    yield 'import_hex_geojson_cold', cold_hex_layer, lambda _: len(import_hex_geojson())
+    yield 'import_hex_geojson', warm_hex_layer, lambda _: len(import_hex_geojson())
+
+def ward_stages():
+    yield 'wards_download', lambda: ward_store().invalidate(), lambda _: len(Mapper(None).wards())
+    yield 'wards', WardStore, lambda store: len(store.load())
+
+def search_stages(count: int, mode: str, minutes: int):
+    # A new set of addresses per run so geocodes and isochrones always miss the cache
+    runs = itertools.count()
+
+    def addresses():
+        ward_store().index()
+        run = next(runs)
+        return [f'{i} Benchmark Road, Run {run}, Scale {count}' for i in range(count)]
+
+    def overlay(batch):
+        return sum(len(Mapper(address).overlay(mode, minutes, 1, 50)[0]) for address in batch)
+
+    def build_map(batch):
+        return sum(len(Mapper(address).build_map(mode=mode, minutes=minutes)[1]) for address in batch)
+
+    def analysed():
+        return [Mapper(address).analyse(mode, minutes) for address in addresses()]
+
+    def restyle(analyses):
+        return sum(len(Mapper.render_map(a, map_style='carto-darkmatter', color_scheme='blues').data[0].z)
+                   for a in analyses)
+
+    yield 'overlay', addresses, overlay
+    yield 'build_map', addresses, build_map
+    yield 'restyle', analysed, restyle
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD', '--', 'models', 'benchmarks', 'dashboard.py'],
+                               cwd=REPO_ROOT).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+def run_suite(scales, sales: int, isochrones: int, mode: str, minutes: int,
+              repeat: int = 1, memory: bool = True, stages=None):
+    results = []
+    wards = synthetic_ward_features()
+    with StubServer(wards=wards) as server, Workspace():
+        os.environ['MAPBOX_API_URL'] = server.url
+        os.environ['WARDS_SOURCE'] = server.wards_url
+        os.environ.pop('GEOCODER_CACHE_PATH', None)
+        for scale in scales:
+            groups = [sales_stages(synthetic_sales(sales * scale))]
+            if scale == scales[0]:
+                groups.append(ward_stages())
+            groups.append(search_stages(isochrones * scale, mode, minutes))
+            for name, setup, run in itertools.chain(*groups):
+                if stages and name not in stages:
+                    continue
+                result = dict(stage=name, scale=scale, **measure(setup, run, repeat=repeat, memory=memory))
+                results.append(result)
+                print(format_row(result), flush=True)
+    return results
+
+def format_row(result: dict, baseline: dict = None):
+    peak = '' if result['peak_mb'] is None else f'{result["peak_mb"]:.1f}'
+    rss = '' if result.get('rss_mb') is None else f'{result["rss_mb"]:.1f}'
+    line = (f'{result["stage"]:<24} {result["scale"]:>5}x {result["rows"]:>9,} '
+            f'{result["seconds"]:>9.3f}s {peak:>9} {rss:>8}')
+    if baseline is not None:
+        line += f' {result["seconds"] / baseline["seconds"]:>7.2f}x'
+        if result['peak_mb'] is not None and baseline.get('peak_mb'):
+            line += f' {result["peak_mb"] / baseline["peak_mb"]:>7.2f}x'
+    return line
+
+def compare(results, baseline_path: str, tolerance: float):
+    '''Print time and memory ratios against a saved run. Returns the regressed stages.'''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['stage'], r['scale']): r for r in baseline['results']}
+    print(f'\nAgainst {baseline["commit"]} ({baseline["created"]}):')
+    print(f'{"stage":<24} {"scale":>6} {"rows":>9} {"time":>10} {"peak MB":>9} {"RSS MB":>8} {"time":>8} {"memory":>8}')
+    regressions = []
+    for result in results:
+        base = previous.get((result['stage'], result['scale']))
+        if base is None:
+            continue
+        print(format_row(result, base))
+        if result['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append(f'{result["stage"]} {result["scale"]}x time')
+        if result['peak_mb'] and base.get('peak_mb') and result['peak_mb'] > base['peak_mb'] * (1 + tolerance):
+            regressions.append(f'{result["stage"]} {result["scale"]}x memory')
+    return regressions
+
+def save(results, args, path: str = None):
+    commit = git_revision()
+    path = path or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    report = {'commit': commit,
+              'created': datetime.now().isoformat(timespec='seconds'),
+              'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+              'results': results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks at scaled synthetic sizes.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--sales', type=int, default=10000, help='Sales at 1x')
+    parser.add_argument('--isochrones', type=int, default=2, help='Searches at 1x')
+    parser.add_argument('--mode', default='driving')
+    parser.add_argument('--minutes', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per stage, best is kept')
+    parser.add_argument('--stages', nargs='+', help='Only run these stages')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run for peak memory')
+    parser.add_argument('--output', help='Results file, defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before failing --compare')
+    args = parser.parse_args()
+
+    print(f'{"stage":<24} {"scale":>6} {"rows":>9} {"time":>10} {"peak MB":>9} {"RSS MB":>8}')
+    results = run_suite(sorted(args.scales), args.sales, args.isochrones, args.mode, args.minutes,
+                        repeat=args.repeat, memory=not args.no_memory, stages=args.stages)
+    print(f'Saved {save(results, args, args.output)}')
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f'Regressed beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
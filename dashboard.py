@@ -2,6 +2,11 @@ import streamlit as st
 import pandas as pd
 import geopandas as gpd
 from models import Mapper, Supabase, PricesPaid
+from models.registry import registry
+from models.isochrones import isochrone_provider
+from models.catchments import CATCHMENT_GENERALIZE
+from models.baselines import national_prices, aggregate_wards, aggregate_prices, diff_to_national
+from models.tracing import tracer, span
 from models.state_management import set_state, write_state, clear_state
 import plotly.express as px
 import json
@@ -13,7 +18,7 @@ load_dotenv()
 
 # Static
 app_password = os.environ.get('APP_PASSWORD')
-db = Supabase()
+debug_panel = os.environ.get('DEBUG_PANEL') == '1'
 favicon = 'static/fiera-favicon.jpeg'
 logo = 'static/fiera-logo-2.png'
 
@@ -31,28 +36,36 @@ pd.options.display.float_format = '{:,}'.format
 st.image(logo, width=200)
 st.header("**England and Wales Travel Time Analysis**")
 
-# Instantiate the Prices Paid data as H3 GeoDataFrame
-@st.cache
-def import_prices_df():
-    prices_df = pd.read_csv('data/prices-paid-hex.csv')
-    return prices_df
-
-@st.cache
-def import_hex():
-    prices_geo = PricesPaid().to_h3()
-    return prices_geo
-
-prices_df = import_prices_df()
-prices_geo = import_hex()
-all_wards_pop = Mapper.wards_pop().rename(columns={'wd20cd':'Ward Code','wd20nm':'Ward Name'})
-avg_ward_pop = all_wards_pop.total_population.mean()
+@st.experimental_singleton
+def import_db():
+    # One client per server so the auth cache and logging queue are shared across sessions
+    return Supabase()
+
+@st.experimental_singleton
+def start_metrics_server():
+    # Prometheus text endpoint, once per server process
+    port = os.environ.get('METRICS_PORT')
+    return tracer.serve_metrics(int(port)) if port else None
+
+# Datasets are loaded once per server process and shared read-only by every session
+data = registry()
+data.warm()
+db = import_db()
+start_metrics_server()
+baselines = data.baselines()
+# Price hexes are joined on H3 ids unless PRICE_LOOKUP=overlay
+prices_index = data.price_index()
+avg_ward_pop = baselines['avg_ward_pop']
 
 # Set up sidebar
 email_input = st.sidebar.text_input('Email')
 password_input = st.sidebar.text_input('Password', type='password')
 address_input = st.sidebar.text_input('Input address here',value='3 Old Burlington Street, London, W1S 3AE')
 travel_mode = st.sidebar.selectbox('Travel mode',options=['driving','walking','cycling'])
-travel_time = st.sidebar.slider('Travel time (m)', min_value=10, max_value=60, value=20, step=5)
+# Mapbox caps isochrones at an hour; the local road graph doesn't
+max_travel_time = 60 if isochrone_provider().name == 'mapbox' else 120
+travel_time = st.sidebar.slider('Travel time (m)', min_value=10, max_value=max_travel_time, value=20, step=5)
+area_weighted = st.sidebar.checkbox('Weight by area inside catchment', value=False)
 search_button = st.sidebar.button('Search')
 
 # Styling Options
@@ -65,11 +78,15 @@ with st.expander('Style Options'):
     map_colours = st.selectbox('Data colors',options=map_colour_options, index=0)
     map_zoom = st.selectbox('Starting map zoom', options=[8, 9, 10, 11, 12, 13, 14], index=2)
     map_opacity = st.slider('Area opacity', min_value=0.2, max_value=1.0, step=0.1, value=0.5)
-    area_specificity = st.slider('Specificity of drive-time area',min_value=10, max_value=200, step=10, value=20)
+    area_specificity = st.slider('Specificity of drive-time area',min_value=10, max_value=200, step=10, value=CATCHMENT_GENERALIZE)
     style_update_button = st.button('Update styles')
 
 def confirm_user():
-    user = db.check_user(email=email_input)
+    try:
+        user = db.check_user(email=email_input)
+    except Exception:
+        st.error('**Could not check your access just now.** Please try again in a moment.')
+        st.stop()
     if not user:
         return False
     elif user['password'] != password_input:
@@ -77,45 +94,45 @@ def confirm_user():
     else:
         return True
 
-def payload():
+def analysis():
+    # Cached by search inputs, so a restyle reuses the previous result
     mapper = Mapper(address=address_input)
-    drivetime_map, area_stats, drivetime_area = mapper.build_map(mode=travel_mode,
-                                                             minutes=travel_time,
-                                                             generalize=area_specificity, 
-                                                             zoom_level=map_zoom,
-                                                             opacity=map_opacity,
-                                                             map_style=map_styling,
-                                                             color_scheme=map_colours)
-
-    return drivetime_map, area_stats, drivetime_area
+    return mapper.analyse(mode=travel_mode,
+                          minutes=travel_time,
+                          generalize=area_specificity,
+                          weighted=area_weighted,
+                          prices_index=prices_index)
 
-def overlay_drivetime_with_prices(drivetime_area):
-    overlay = gpd.overlay(drivetime_area, prices_geo)
-    return overlay
+def payload(result):
+    return Mapper.render_map(result,
+                             zoom_level=map_zoom,
+                             opacity=map_opacity,
+                             map_style=map_styling,
+                             color_scheme=map_colours)
 
-def build_metrics(area_stats, price_data, national_prices):
-    def diff_to_national(area, national):
-        diff = area - national
-        return ( diff / national ) * 100
+def build_metrics(area_stats, price_data, baselines):
+    national_median, national_mean = national_prices(baselines, weighted=area_weighted)
+    prices = aggregate_prices(price_data, weighted=area_weighted)
 
-    median_price = price_data['median_price'].mean()
-    median_price_to_national = diff_to_national(median_price, national_prices['median_price'].mean())
+    median_price = prices['median_price']
+    median_price_to_national = diff_to_national(median_price, national_median)
 
-    mean_price = price_data['mean_price'].mean()
-    mean_price_to_national = diff_to_national(mean_price, national_prices['mean_price'].mean())
+    mean_price = prices['mean_price']
+    mean_price_to_national = diff_to_national(mean_price, national_mean)
 
     total_paid_millions = price_data['total_paid'].sum() / 1000000
 
-    area_median_age = area_stats.median_age.median()
-    diff_area_age_to_uk = (area_median_age / 40.5)
+    population = aggregate_wards(area_stats, weighted=area_weighted)
+    area_median_age = population['median_age']
+    diff_area_age_to_uk = (area_median_age / baselines['median_age'])
 
     st.markdown(f'##### Within **{travel_time}** mins **{travel_mode}** of **{address_input}**:\n')
 
     st.markdown('###### Population details within area')
     pop_col1, pop_col2, pop_col3 = st.columns(3)
-    pop_col1.metric('Approx. Population',f'{area_stats.total_population.sum():,.0f}', None)
+    pop_col1.metric('Approx. Population',f'{population["population"]:,.0f}', None)
     pop_col2.metric('Median Age', f'{area_median_age:,.0f}')
-    pop_col3.metric('UK National median age', '40.5', None)
+    pop_col3.metric('UK National median age', f'{baselines["median_age"]}', None)
 
     st.markdown('###### House Prices paid (2019)')
     col1, col2 = st.columns(2)
@@ -146,31 +163,43 @@ def data_download(area_stats: pd.DataFrame):
                         mime='text/csv')
     st.dataframe(df)
 
+def show_timings(trace):
+    with st.expander('Stage timings'):
+        timings = pd.DataFrame(trace.to_records())
+        st.dataframe(timings)
+        report = data.report()
+        st.write(f'Shared datasets loaded in **{report["startup_seconds"]:.2f}s**, '
+                 f'server RSS **{report["rss_mb"] or 0:,.0f} MB**')
+        st.dataframe(pd.DataFrame(report['datasets']).T)
+
 def execute_visuals(spinner_text: str = 'Building your analysis'):
-    with st.spinner(f'**{spinner_text}...**'):
+    with st.spinner(f'**{spinner_text}...**'), \
+         tracer.trace('search', mode=travel_mode, minutes=travel_time) as trace:
         start_time = datetime.now()
-        drivetime_map, area_stats, drivetime_area = payload()
-        price_data = overlay_drivetime_with_prices(drivetime_area)
-
-        build_metrics(area_stats, price_data, prices_df)
-        build_map(drivetime_map)
+        with span('pipeline'):
+            result = analysis()
+        drivetime_map = payload(result)
+
+        with span('metrics'):
+            build_metrics(result.stats, result.prices, baselines)
+        with span('render'):
+            build_map(drivetime_map)
         total_run_time = datetime.now() - start_time
         st.write(f'Results in: **{total_run_time.total_seconds():.3f}s**')
-        return area_stats
+    if debug_panel:
+        show_timings(trace)
+    return result.stats
 
 if search_button:
     if confirm_user():
         set_state(email_input, password_input)
-        try:
-            db.add_row(table_name='searches',
-                   user=email_input,
-                   address=address_input,
-                   mode=travel_mode,
-                   range=travel_time,
-                   map_style=map_styling,
-                   map_colours=map_colours)
-        except:
-            pass
+        db.queue_row(table_name='searches',
+                     user=email_input,
+                     address=address_input,
+                     mode=travel_mode,
+                     range=travel_time,
+                     map_style=map_styling,
+                     map_colours=map_colours)
         st.balloons()
         area_stats = execute_visuals()
         data_download(area_stats)
@@ -181,16 +210,13 @@ if search_button:
 if style_update_button:
     if confirm_user():
         set_state(email_input, password_input)
-        try:
-            db.add_row(table_name='searches',
-                   user=email_input,
-                   address=address_input,
-                   mode=travel_mode,
-                   range=travel_time,
-                   map_style=map_styling,
-                   map_colours=map_colours)
-        except:
-            pass
+        db.queue_row(table_name='searches',
+                     user=email_input,
+                     address=address_input,
+                     mode=travel_mode,
+                     range=travel_time,
+                     map_style=map_styling,
+                     map_colours=map_colours)
         st.balloons()
         area_stats = execute_visuals(spinner_text='Styling your visuals')
         data_download(area_stats)
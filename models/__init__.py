@@ -1,3 +1,7 @@
-from .mapping import Mapper
+from .mapping import Mapper, CatchmentAnalysis
 from .geocoding import Geocoder, PricesPaid
-from .db import Supabase, import_hex_geojson
\ No newline at end of file
+from .db import Supabase, import_hex_geojson
+from .spatial_index import LayerIndex
+from .hexindex import HexIndex
+from .parallel import ParallelLayerIndex, layer_index
+from .portfolio import PortfolioAnalysis
@@ -0,0 +1,101 @@
+import json
+import os
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from .wards import WARD_POP_PATH, load_ward_population
+from .datastore import HEX_PATH, prepare
+
+BASELINES_PATH = 'data/baselines.json'
+UK_MEDIAN_AGE = 40.5
+
+def compute_baselines(prices: pd.DataFrame, wards_pop: pd.DataFrame):
+    '''National comparison figures, matching what the dashboard used to compute per search.'''
+    weights = prices['count'].to_numpy(dtype=float)
+    return {'median_price': float(prices['median_price'].astype(float).mean()),
+            'mean_price': float(prices['mean_price'].astype(float).mean()),
+            'weighted_median_price': float(np.average(prices['median_price'], weights=weights)),
+            'weighted_mean_price': float(prices['total_paid'].sum() / weights.sum()),
+            'avg_ward_pop': float(wards_pop['total_population'].mean()),
+            'total_population': float(wards_pop['total_population'].sum()),
+            'median_age': UK_MEDIAN_AGE,
+            'hexes': int(len(prices)),
+            'wards': int(len(wards_pop))}
+
+def source_mtimes(*paths):
+    return {path: os.path.getmtime(path) for path in paths}
+
+def build_baselines(path: str = BASELINES_PATH,
+                    prices_path: str = HEX_PATH,
+                    ward_pop_path: str = WARD_POP_PATH):
+    prices = pd.read_parquet(prices_path, columns=['mean_price', 'median_price', 'total_paid', 'count'])
+    baselines = compute_baselines(prices, load_ward_population(ward_pop_path))
+    meta = {'built': datetime.now().isoformat(),
+            'sources': source_mtimes(prices_path, ward_pop_path)}
+    with open(path, 'w') as f:
+        json.dump({'baselines': baselines, 'meta': meta}, f, indent=2)
+    return baselines
+
+def load_baselines(path: str = BASELINES_PATH,
+                   prices_path: str = HEX_PATH,
+                   ward_pop_path: str = WARD_POP_PATH):
+    '''Read the baselines artifact, rebuilding it when missing or older than its sources.'''
+    prepare()
+    if os.path.exists(path):
+        with open(path) as f:
+            stored = json.load(f)
+        if stored['meta']['sources'] == source_mtimes(prices_path, ward_pop_path):
+            return stored['baselines']
+    return build_baselines(path, prices_path, ward_pop_path)
+
+def diff_to_national(area, national):
+    return ((area - national) / national) * 100
+
+def national_prices(baselines: dict, weighted: bool = False):
+    '''National (median, mean) comparators; sales-weighted when catchments are weighted.'''
+    if weighted:
+        return baselines['weighted_median_price'], baselines['weighted_mean_price']
+    return baselines['median_price'], baselines['mean_price']
+
+def aggregate_wards(overlay: pd.DataFrame, by: str = None, weighted: bool = False):
+    '''Population and median age of the wards in a catchment. With weighted, each ward's
+    population is apportioned by overlap_fraction instead of counted in full.'''
+    df = pd.DataFrame({'population': overlay['total_population'].to_numpy(dtype=float),
+                       'median_age': overlay['median_age'].to_numpy(dtype=float)})
+    if weighted:
+        df['population'] *= overlay['overlap_fraction'].to_numpy()
+    df['_group'] = overlay[by].to_numpy() if by else 0
+    result = df.groupby('_group').agg(population=('population', 'sum'),
+                                      median_age=('median_age', 'median'))
+    result.index.name = by
+    if by:
+        return result
+    if len(result):
+        return result.iloc[0]
+    return pd.Series({'population': 0.0, 'median_age': np.nan})
+
+def aggregate_prices(overlay: pd.DataFrame, by: str = None, weighted: bool = False):
+    '''Mean hex median/mean price in a catchment. With weighted, hexes are weighted by the
+    number of sales falling inside the catchment (count * overlap_fraction).'''
+    df = pd.DataFrame({'median_price': overlay['median_price'].to_numpy(dtype=float),
+                       'mean_price': overlay['mean_price'].to_numpy(dtype=float)})
+    df['_weight'] = overlay['count'].to_numpy(dtype=float) * overlay['overlap_fraction'].to_numpy() if weighted else 1.0
+    df['_group'] = overlay[by].to_numpy() if by else 0
+    for column in ('median_price', 'mean_price'):
+        df[column] *= df['_weight']
+    sums = df.groupby('_group')[['median_price', 'mean_price', '_weight']].sum()
+    result = sums[['median_price', 'mean_price']].div(sums['_weight'], axis=0)
+    result.index.name = by
+    if by:
+        return result
+    if len(result):
+        return result.iloc[0]
+    return pd.Series({'median_price': np.nan, 'mean_price': np.nan})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the national baselines artifact.')
+    parser.add_argument('--path', default=BASELINES_PATH)
+    args = parser.parse_args()
+    print(json.dumps(build_baselines(args.path), indent=2))
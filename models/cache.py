@@ -0,0 +1,187 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+GEOCODE_TTL = 30 * 24 * 60 * 60
+ISOCHRONE_TTL = 7 * 24 * 60 * 60
+
+def address_key(address: str):
+    '''Normalise an address so trivial spacing/case/punctuation changes share a cache entry.'''
+    address = re.sub(r'\s+', ' ', address.strip().lower())
+    address = re.sub(r'\s*,\s*', ', ', address)
+    return f'geocode:{address.strip(", ")}'
+
+def isochrone_key(lon: float,
+                  lat: float,
+                  mode: str,
+                  minutes: int,
+                  denoise: float,
+                  generalize: int,
+                  provider: str = 'mapbox'):
+    # ~1m precision, finer than anything Mapbox routes distinguish
+    key = f'isochrone:{lon:.5f},{lat:.5f}:{mode}:{minutes}:{denoise}:{generalize}'
+    # Mapbox keys keep their old form so existing cache entries stay valid
+    return key if provider == 'mapbox' else f'{key}:{provider}'
+
+def analysis_key(address: str,
+                 mode: str,
+                 minutes: int,
+                 denoise: float,
+                 generalize: int,
+                 weighted: bool = False,
+                 prices: bool = False):
+    return f'analysis:{address_key(address)[len("geocode:"):]}:{mode}:{minutes}:{denoise}:{generalize}:{int(weighted)}:{int(prices)}'
+
+class LRUCache():
+    '''In-process cache with per-entry TTL and a maximum number of entries.'''
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        # None never expires; 0 is already stale
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+class SQLiteCache():
+    '''On-disk cache of JSON-serialisable values, shared between processes.'''
+    def __init__(self, path: str, maxsize: int = 100000, ttl: float = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS cache
+                              (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)''')
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                self._conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            if row is not None:
+                self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                               (key, json.dumps(value), expires, now))
+            self._conn.execute('''DELETE FROM cache WHERE key IN
+                                  (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)''',
+                               (self.maxsize,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+class TieredCache():
+    '''LRU in front of an optional SQLite store; disk hits are promoted to memory.'''
+    def __init__(self, memory: LRUCache = None, disk: SQLiteCache = None):
+        self.memory = memory if memory is not None else LRUCache()
+        self.disk = disk
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value, ttl: float = None):
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl=ttl)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+_default_cache = None
+
+def default_cache():
+    '''Process-wide response cache. Set GEOCODER_CACHE_PATH to also persist to SQLite.'''
+    global _default_cache
+    if _default_cache is None:
+        path = os.environ.get('GEOCODER_CACHE_PATH')
+        disk = SQLiteCache(path) if path else None
+        _default_cache = TieredCache(memory=LRUCache(maxsize=int(os.environ.get('GEOCODER_CACHE_SIZE', 1024))),
+                                     disk=disk)
+    return _default_cache
+
+_analysis_cache = None
+
+def analysis_cache():
+    '''Process-wide cache of search results, so restyles and repeat searches skip the pipeline.
+    Holds live objects, so it is memory only; size from ANALYSIS_CACHE_SIZE.'''
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = LRUCache(maxsize=int(os.environ.get('ANALYSIS_CACHE_SIZE', 64)), ttl=ISOCHRONE_TTL)
+    return _analysis_cache
@@ -0,0 +1,308 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+import shapely
+from shapely.geometry import shape
+
+from .geocoding import Geocoder
+from .hexbin import strings_to_cells, cell_centres
+from .isochrones import isochrone_provider
+from .tracing import span, map_in_context
+from .wards import ward_store
+
+CATCHMENT_STORE_PATH = 'data/catchments'
+CATCHMENT_MODES = ('driving', 'walking', 'cycling')
+CATCHMENT_MINUTES = (10, 20, 30, 45, 60)
+# The dashboard's default area specificity, so its default searches find stored tiles
+CATCHMENT_GENERALIZE = 20
+# Layer key column for each membership table
+LAYER_KEYS = {'wards': 'Ward Code', 'hexes': 'H3_cell'}
+METRES_PER_DEGREE = 111320
+
+def grid_origins(bbox, resolution: int):
+    '''Centres of the H3 cells at resolution covering bbox (minx, miny, maxx, maxy).'''
+    minx, miny, maxx, maxy = bbox
+    ring = [[miny, minx], [miny, maxx], [maxy, maxx], [maxy, minx], [miny, minx]]
+    cells = sorted(h3.polyfill({'type': 'Polygon', 'coordinates': [ring]}, resolution))
+    lat, lon = cell_centres(cells)
+    return pd.DataFrame({'lon': lon, 'lat': lat})
+
+def snap_distance(lon, lat, lons, lats):
+    '''Approximate ground distance in metres from one point to many, fine at catchment scale.'''
+    dx = (np.asarray(lons) - lon) * math.cos(math.radians(lat))
+    dy = np.asarray(lats) - lat
+    return np.hypot(dx, dy) * METRES_PER_DEGREE
+
+def layer_codes(index, layer: str):
+    '''Membership keys of an indexed layer, in layer order: ward codes or uint64 H3 ids.'''
+    codes = index.layer[LAYER_KEYS[layer]]
+    return strings_to_cells(codes) if layer == 'hexes' else codes.to_numpy()
+
+def layer_fingerprint(index, layer: str):
+    '''Digest of the sorted layer keys, which changes when features are added or dropped.'''
+    codes = np.sort(layer_codes(index, layer))
+    data = codes.tobytes() if codes.dtype.kind == 'u' else '\n'.join(map(str, codes)).encode()
+    return hashlib.sha1(data).hexdigest()
+
+class CatchmentTile():
+    '''A precomputed catchment: origin, band, the isochrone provider and response, and its
+    row range in each membership table.'''
+    def __init__(self, store, row: pd.Series):
+        self.store = store
+        self.tile_id = int(row['tile_id'])
+        self.lon, self.lat = float(row['lon']), float(row['lat'])
+        self.mode, self.minutes = row['mode'], int(row['minutes'])
+        self.provider = row['provider']
+        self.response = row['isochrone']
+
+    def isochrone(self, crs: int = 4326):
+        '''The stored isochrone as Geocoder.isochrone would have returned it.'''
+        geojson = json.loads(self.response)
+        return gpd.GeoDataFrame.from_features(geojson['features']).set_crs(epsg=crs)
+
+    def members(self, layer: str):
+        '''Layer keys intersecting the catchment and whether each lies wholly inside it.'''
+        return self.store.tile_members(self.tile_id, layer)
+
+class CatchmentStore():
+    '''Precomputed catchment-to-ward and catchment-to-hex membership for common origins.
+
+    Three parquet files under path: origins (one row per origin, mode and minutes band,
+    with the provider that answered and its isochrone response) and one membership table per layer sorted by tile_id,
+    so a tile's members are a contiguous slice found by binary search. Searches near a
+    stored origin reuse its isochrone and skip the tree query and the clipping of
+    members known to lie inside; anything else falls back to the live path. meta.json
+    records the ward layer the tiles were built against, and tiles are ignored once
+    that layer is rebuilt. It also holds a fingerprint of each layer's keys, and a
+    membership table is only used with an index holding the same keys.'''
+    def __init__(self, path: str = None, snap_metres: float = None, wards=None):
+        self.path = path or os.environ.get('CATCHMENT_STORE_PATH', CATCHMENT_STORE_PATH)
+        # The WardStore behind the ward membership, ward_store() by default
+        self.wards = wards
+        # 0 only accepts the stored origin itself (to ~1m, the isochrone cache precision)
+        self.snap_metres = float(snap_metres if snap_metres is not None else os.environ.get('CATCHMENT_SNAP_METRES', 0))
+        self._origins = None
+        self._members = {}
+        self._positions = {}
+        self._fingerprints = {}
+        self._meta = None
+
+    def file(self, name: str):
+        return os.path.join(self.path, f'{name}.parquet')
+
+    def exists(self, layer: str = 'origins'):
+        return os.path.exists(self.file(layer))
+
+    def ward_store(self):
+        return self.wards or ward_store()
+
+    def meta(self):
+        if self._meta is None:
+            path = os.path.join(self.path, 'meta.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._meta = json.load(f)
+        return self._meta
+
+    def is_current(self):
+        '''Whether the tiles were built against the ward layer as it is stored now.'''
+        meta = self.meta()
+        return meta is not None and meta.get('wards') == self.ward_store().layer_id()
+
+    def origins(self):
+        if self._origins is None:
+            self._origins = pd.read_parquet(self.file('origins')) if self.exists() else pd.DataFrame(
+                columns=['tile_id', 'lon', 'lat', 'mode', 'minutes', 'denoise', 'generalize', 'provider', 'isochrone'])
+            if 'provider' not in self._origins:
+                # Stores from before providers were recorded match none, so they get rebuilt
+                self._origins['provider'] = None
+        return self._origins
+
+    def table(self, layer: str):
+        if layer not in self._members:
+            df = pd.read_parquet(self.file(layer), memory_map=True)
+            self._members[layer] = (df['tile_id'].to_numpy(), df['code'].to_numpy(), df['inside'].to_numpy())
+        return self._members[layer]
+
+    def tile_members(self, tile_id: int, layer: str):
+        tile_ids, codes, inside = self.table(layer)
+        start, end = np.searchsorted(tile_ids, [tile_id, tile_id + 1])
+        return codes[start:end], inside[start:end]
+
+    def lookup(self,
+               lon: float,
+               lat: float,
+               mode: str,
+               minutes: int,
+               denoise: float = 1,
+               generalize: int = CATCHMENT_GENERALIZE,
+               provider: str = None):
+        '''Nearest stored tile for the band within snap_metres of the origin, or None.
+        Only tiles from the named isochrone provider match, ISOCHRONE_PROVIDER's by default.'''
+        if not self.exists() or not self.is_current():
+            return None
+        provider = provider or isochrone_provider().name
+        with span('catchment_lookup') as s:
+            origins = self.origins()
+            band = origins[(origins['mode'] == mode) & (origins['minutes'] == minutes) &
+                           (origins['denoise'] == denoise) & (origins['generalize'] == generalize) &
+                           (origins['provider'] == provider)]
+            if not len(band):
+                s.add(hit=False)
+                return None
+            distance = snap_distance(lon, lat, band['lon'], band['lat'])
+            nearest = int(np.argmin(distance))
+            hit = distance[nearest] <= max(self.snap_metres, 1)
+            s.add(hit=bool(hit), metres=round(float(distance[nearest]), 1))
+        return CatchmentTile(self, band.iloc[nearest]) if hit else None
+
+    def positions(self, index, layer: str):
+        '''Hash lookup from layer key to position in the indexed layer, built once per index.'''
+        key = (id(index), layer)
+        if key not in self._positions:
+            self._positions[key] = pd.Index(layer_codes(index, layer))
+        return self._positions[key]
+
+    def fingerprint(self, index, layer: str):
+        key = (id(index), layer)
+        if key not in self._fingerprints:
+            self._fingerprints[key] = layer_fingerprint(index, layer)
+        return self._fingerprints[key]
+
+    def matches(self, index, layer: str):
+        '''Whether the stored membership for layer was built from the features index holds,
+        so a rebuilt price layer isn't served members it no longer has.'''
+        meta = self.meta() or {}
+        return self.exists(layer) and meta.get('layers', {}).get(layer) == self.fingerprint(index, layer)
+
+    def members(self, area: gpd.GeoDataFrame, tiles, index, layer: str):
+        '''(area_pos, layer_pos, inside) for LayerIndex.overlay. Rows with a tile use the
+        stored membership when it matches index; other rows are queried against the tree
+        as usual.'''
+        lookup = self.positions(index, layer)
+        stored = self.matches(index, layer)
+        left, right, inside = [], [], []
+        for i, (tile, geometry) in enumerate(zip(tiles, area.geometry)):
+            if tile is not None and stored:
+                codes, flags = tile.members(layer)
+                positions = lookup.get_indexer(codes)
+                known = positions >= 0
+                order = np.argsort(positions[known], kind='stable')
+                positions, flags = positions[known][order], flags[known][order]
+            elif geometry is not None and not geometry.is_empty:
+                positions = index.candidates(geometry)
+                flags = np.zeros(len(positions), dtype=bool)
+            else:
+                continue
+            left.append(np.full(len(positions), i))
+            right.append(positions)
+            inside.append(flags)
+        if not left:
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=bool)
+        return np.concatenate(left), np.concatenate(right), np.concatenate(inside)
+
+    def build(self,
+              origins: pd.DataFrame,
+              ward_index,
+              price_index=None,
+              modes=CATCHMENT_MODES,
+              minutes=CATCHMENT_MINUTES,
+              denoise: float = 1,
+              generalize: int = CATCHMENT_GENERALIZE,
+              max_workers: int = 8,
+              cache=None,
+              provider=None):
+        '''Fetch isochrones for every origin (lon, lat columns) and band from provider
+        (isochrone_provider() by default), then write their membership tables. Replaces
+        whatever the store held. ward_index should be built from the store's WardStore,
+        whose layer is recorded in meta.json.'''
+        provider = provider or isochrone_provider()
+        bands = [(float(lon), float(lat), mode, int(m))
+                 for lon, lat in origins[['lon', 'lat']].itertuples(index=False)
+                 for mode in modes for m in minutes]
+
+        def fetch(band):
+            lon, lat, mode, m = band
+            geojson = Geocoder(None, cache=cache, provider=provider).isochrone_json(lon, lat, mode, m, denoise, generalize)
+            return json.dumps(geojson, separators=(',', ':'))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            responses = map_in_context(pool, fetch, bands)
+
+        table = pd.DataFrame(bands, columns=['lon', 'lat', 'mode', 'minutes'])
+        table.insert(0, 'tile_id', np.arange(len(table), dtype=np.int32))
+        table['denoise'] = float(denoise)
+        table['generalize'] = generalize
+        table['provider'] = provider.name
+        table['isochrone'] = responses
+        areas = gpd.GeoDataFrame(geometry=[shape(json.loads(r)['features'][0]['geometry'])
+                                           for r in responses], crs=4326)
+
+        os.makedirs(self.path, exist_ok=True)
+        counts, fingerprints = {}, {}
+        for layer, index in (('wards', ward_index), ('hexes', price_index)):
+            if index is None:
+                continue
+            fingerprints[layer] = layer_fingerprint(index, layer)
+            left, right = index.members(areas)
+            inside = shapely.contains_properly(np.asarray(areas.geometry.values)[left],
+                                               np.asarray(index.layer.geometry.values)[right])
+            members = pd.DataFrame({'tile_id': table['tile_id'].to_numpy()[left],
+                                    'code': layer_codes(index, layer)[right],
+                                    'inside': inside})
+            members.to_parquet(self.file(layer), index=False)
+            counts[layer] = len(members)
+        table.to_parquet(self.file('origins'), index=False)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'built': datetime.now().isoformat(), 'tiles': len(table), 'members': counts,
+                       'wards': self.ward_store().layer_id(), 'layers': fingerprints}, f)
+        self._origins = None
+        self._members = {}
+        self._meta = None
+        return table
+
+_default_store = None
+
+def catchment_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = CatchmentStore()
+    return _default_store
+
+if __name__ == '__main__':
+    from .parallel import layer_index
+    from .datastore import prepare, load_hex_layer
+
+    parser = argparse.ArgumentParser(description='Precompute catchment membership for common origins.')
+    parser.add_argument('--origins', help='CSV with lon/lat columns, or an address column to geocode')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                        help='Use an H3 grid of origins over this box instead')
+    parser.add_argument('--resolution', type=int, default=7, help='H3 resolution of the origin grid')
+    parser.add_argument('--modes', nargs='+', default=list(CATCHMENT_MODES))
+    parser.add_argument('--minutes', type=int, nargs='+', default=list(CATCHMENT_MINUTES))
+    parser.add_argument('--generalize', type=int, default=CATCHMENT_GENERALIZE)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--path', default=None)
+    args = parser.parse_args()
+
+    if args.bbox:
+        origins = grid_origins(args.bbox, args.resolution)
+    else:
+        origins = pd.read_csv(args.origins)
+        if 'lon' not in origins:
+            origins = Geocoder.geocode_many(origins['address'], max_workers=args.workers)
+            origins = origins[origins['error'].isna()]
+    prepare()
+    store = CatchmentStore(path=args.path)
+    tiles = store.build(origins, ward_store().index(), layer_index(load_hex_layer()),
+                        modes=args.modes, minutes=args.minutes, generalize=args.generalize,
+                        max_workers=args.workers)
+    print(f'Wrote {len(tiles):,} catchments for {len(origins):,} origins to {store.path}')
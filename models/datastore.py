@@ -0,0 +1,92 @@
+import argparse
+import os
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .hexbin import HexBinner, cells_to_strings, strings_to_cells, within_three_sigma
+
+SALES_CSV_PATH = 'data/prices_paid_2019.csv'
+HEX_CSV_PATH = 'data/prices-paid-hex.csv'
+SALES_PATH = 'data/prices-paid.parquet'
+HEX_PATH = 'data/prices-hex.parquet'
+
+SALES_DTYPES = {'latitude': 'float32', 'longitude': 'float32', 'AMOUNT': 'uint32'}
+HEX_DTYPES = {'mean_price': 'float32', 'median_price': 'float32', 'total_paid': 'int64', 'count': 'int32'}
+
+def compact_hex_frame(h3_df: pd.DataFrame):
+    '''Typed copy of a to_h3 frame: uint64 H3 ids, float32 prices, int32 counts.'''
+    df = pd.DataFrame({'H3_cell': strings_to_cells(h3_df['H3_cell'])})
+    for column, dtype in HEX_DTYPES.items():
+        df[column] = h3_df[column].to_numpy().astype(dtype)
+    geometry = h3_df['geometry']
+    if len(geometry) and isinstance(geometry.iloc[0], str):
+        geometry = gpd.GeoSeries.from_wkt(geometry)
+    return gpd.GeoDataFrame(df, geometry=list(geometry), crs=4326)
+
+def write_hex_layer(h3_df: pd.DataFrame, path: str = HEX_PATH):
+    compact_hex_frame(h3_df).to_parquet(path, index=False)
+    return path
+
+def write_sales(csv_path: str = SALES_CSV_PATH, path: str = SALES_PATH, chunksize: int = 1000000):
+    '''Convert the raw price-paid CSV to a typed parquet file, one row group per chunk.'''
+    writer = None
+    rows = 0
+    try:
+        for chunk in pd.read_csv(csv_path, usecols=list(SALES_DTYPES), dtype=SALES_DTYPES, chunksize=chunksize):
+            table = pa.Table.from_pandas(chunk[list(SALES_DTYPES)], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def load_hex_table(columns=None, memory_map: bool = True, as_strings: bool = True):
+    '''Hex statistics without geometry; reads only the requested columns.'''
+    df = pd.read_parquet(HEX_PATH, columns=columns, memory_map=memory_map)
+    if as_strings and 'H3_cell' in df:
+        df['H3_cell'] = cells_to_strings(df['H3_cell'].to_numpy())
+    return df
+
+def load_hex_layer(columns=None, memory_map: bool = True, as_strings: bool = True):
+    '''Hex layer as a GeoDataFrame with the same columns as PricesPaid.to_h3.'''
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    gdf = gpd.read_parquet(HEX_PATH, columns=columns, memory_map=memory_map)
+    if as_strings and 'H3_cell' in gdf:
+        gdf['H3_cell'] = cells_to_strings(gdf['H3_cell'].to_numpy())
+    return gdf
+
+def load_sales(columns=None, memory_map: bool = True):
+    '''Raw sales from the prepared parquet file, or the CSV when it hasn't been prepared.'''
+    columns = columns or list(SALES_DTYPES)
+    if os.path.exists(SALES_PATH):
+        return pd.read_parquet(SALES_PATH, columns=columns, memory_map=memory_map)
+    return pd.read_csv(SALES_CSV_PATH, usecols=columns, dtype={c: SALES_DTYPES[c] for c in columns if c in SALES_DTYPES})
+
+def prepare(force: bool = False):
+    '''Build the compact files from whichever sources are present.'''
+    written = []
+    if os.path.exists(SALES_CSV_PATH) and (force or not os.path.exists(SALES_PATH)):
+        rows = write_sales()
+        written.append(f'{SALES_PATH} ({rows:,} sales)')
+    if force or not os.path.exists(HEX_PATH):
+        if os.path.exists(SALES_PATH):
+            sales = load_sales()
+            h3_df = HexBinner().bin_frame(sales[within_three_sigma(sales['AMOUNT'])])[5]
+        else:
+            h3_df = pd.read_csv(HEX_CSV_PATH, usecols=['H3_cell', *HEX_DTYPES, 'geometry'])
+        write_hex_layer(h3_df)
+        written.append(f'{HEX_PATH} ({len(h3_df):,} hexes)')
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert price-paid sources to compact columnar files.')
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+    for line in prepare(force=args.force) or ['Nothing to do']:
+        print(line)
@@ -1,22 +1,82 @@
-import pandas as pd
-import json
-import geopandas as gpd
-import requests
 import os
+import queue
+import threading
+import time
+import atexit
 from dotenv import load_dotenv, find_dotenv
+
+from .datastore import prepare, load_hex_layer
+from .http import http_session, http_timeout
+from .cache import LRUCache
 env_loc = find_dotenv('.env')
 load_dotenv(env_loc)
 
+class BatchWriter():
+    '''Background queue that inserts rows in bulk, so logging stays off the request path.'''
+    def __init__(self, client, table_name: str, batch_size: int = 50, flush_interval: float = 2.0):
+        self.client = client
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.failed = 0
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, row: dict):
+        self.queue.put(row)
+
+    def collect(self, first):
+        '''Gather rows until the batch is full or flush_interval has passed since the first.'''
+        rows = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(rows) < self.batch_size and rows[-1] is not self:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return rows
+
+    def write(self, rows):
+        rows = [r for r in rows if r is not self]
+        if not rows:
+            return
+        try:
+            self.client.add_rows(self.table_name, rows, returning=False).raise_for_status()
+        except Exception:
+            self.failed += len(rows)
+
+    def run(self):
+        while True:
+            rows = self.collect(self.queue.get())
+            self.write(rows)
+            if rows[-1] is self:
+                return
+
+    def close(self, timeout: float = 5):
+        if self._thread.is_alive():
+            # The writer itself is the stop sentinel
+            self.queue.put(self)
+            self._thread.join(timeout)
+
 class Supabase():
-    def __init__(self):
+    def __init__(self, auth_ttl: float = 60):
         self.url = os.environ.get('SUPABASE_URL')
         self.api_key = os.environ.get('SUPABASE_KEY')
         self.headers = {'apikey':f'{self.api_key}',
                         'Authorization':f'Bearer {self.api_key}'}
+        self.session = http_session()
+        self.user_cache = LRUCache(maxsize=1024, ttl=auth_ttl)
+        self._writers = {}
+        self._writers_lock = threading.Lock()
 
     def get_table(self, table_name: str, **kwargs):
         url = f'{self.url}/{table_name}'
-        response = requests.get(url=url, headers=self.headers, params=kwargs)
+        response = self.session.get(url=url, headers=self.headers, params=kwargs, timeout=http_timeout())
         return response.json()
 
     def get_users(self, **kwargs):
@@ -25,45 +85,51 @@ class Supabase():
     def get_searches(self, **kwargs):
         return self.get_table('searches', **kwargs)
 
-    def check_user(self, email: str):
-        users = self.get_users()
-        user_list = pd.DataFrame(users)['email'].tolist()
-        if email in user_list:
-            for i in users:
-                if i['email'] == email:
-                    return i
-        return False
+    def check_user(self, email: str, select: str = 'email,password'):
+        '''User row for the email, or False. Filtered server-side and cached for auth_ttl seconds.
+        Raises ValueError when the lookup fails, which is not cached, so a backend error
+        doesn't lock the user out.'''
+        cached = self.user_cache.get(email)
+        if cached is not None:
+            return cached
+        users = self.get_users(email=f'eq.{email}', select=select, limit=1)
+        if not isinstance(users, list):
+            raise ValueError(f'User lookup failed: {users}')
+        user = users[0] if users else False
+        self.user_cache.set(email, user)
+        return user
+
+    def add_rows(self, table_name: str, rows: list, returning: bool = True):
+        url = f'{self.url}/{table_name}'
+        headers = {**self.headers,
+                   'Content-Type': 'application/json',
+                   'Prefer': 'return=representation' if returning else 'return=minimal'}
+        return self.session.post(url=url, headers=headers, json=rows, timeout=http_timeout())
 
     def add_row(self, table_name: str, **kwargs):
         url = f'{self.url}/{table_name}'
-        headers = self.headers
-        headers['Content-Type'] = 'application/json'
-        headers['Prefer'] = 'return=representation'
-        request = requests.post(url=url, headers=headers, json=kwargs)
+        headers = {**self.headers,
+                   'Content-Type': 'application/json',
+                   'Prefer': 'return=representation'}
+        request = self.session.post(url=url, headers=headers, json=kwargs, timeout=http_timeout())
         return request
 
+    def queue_row(self, table_name: str, **kwargs):
+        '''Add a row without waiting for the insert; rows are flushed in batches.'''
+        with self._writers_lock:
+            writer = self._writers.get(table_name)
+            if writer is None:
+                writer = self._writers[table_name] = BatchWriter(self, table_name)
+        writer.put(kwargs)
+
+    def flush(self):
+        for writer in list(self._writers.values()):
+            writer.close()
+        self._writers.clear()
+
 def import_hex_geojson():
-    with open('data/prices-paid-hex.geojson') as json_file:
-        data = json.load(json_file)
-    
-    d = pd.DataFrame(data['features'])
-
-    mean = []
-    median = []
-    total = []
-    count = []
-
-    for x in d['properties']:
-        mean.append(x[0]['mean_price'])
-        median.append(x[1]['median_price'])
-        total.append(x[2]['total_paid'])
-        count.append(x[3]['count'])
-        
-    d['mean_price'] = mean
-    d['median_price'] = median
-    d['total_paid'] = total
-    d['count'] = count
-
-    df = d.drop(columns=['properties','type'])
-
-    return df #gpd.GeoDataFrame(df, geometry='geometry').set_crs(4326)
\ No newline at end of file
+    '''Price hexes with id, geometry, mean_price, median_price, total_paid and count columns,
+    read from the compact hex layer (built from the hex sources on first use).'''
+    prepare()
+    df = load_hex_layer().rename(columns={'H3_cell':'id'})
+    return df[['id','geometry','mean_price','median_price','total_paid','count']]
@@ -1,35 +1,77 @@
 import pandas as pd
 import geopandas as gpd
 import h3
-import requests
-from requests.structures import CaseInsensitiveDict
 from geojson import Feature, Point, FeatureCollection
-from shapely.geometry import Polygon
+from shapely.geometry import Polygon, mapping
 import plotly.express as px
 import os
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .hexbin import HexBinner, DEFAULT_RESOLUTION, within_three_sigma
+from .datastore import load_sales
+from .payload import dumps
+from .pyramid import HexPyramid
+from .cache import default_cache, address_key, isochrone_key, GEOCODE_TTL, ISOCHRONE_TTL
+from .http import get_with_backoff
+from .isochrones import isochrone_provider
+from .tracing import span, map_in_context
 from dotenv import load_dotenv, find_dotenv
 env_loc = find_dotenv('.env')
 load_dotenv(env_loc)
 
 class Geocoder():
-    def __init__(self, address):
-        '''Requires address string for England or Wales.'''
+    def __init__(self, address, cache=None, provider=None):
+        '''Requires address string for England or Wales. Isochrones come from provider,
+        by default the one named by ISOCHRONE_PROVIDER.'''
         self.address = address
         self.token = os.environ.get('MAPBOX_TOKEN')
+        self.api_url = os.environ.get('MAPBOX_API_URL', 'https://api.mapbox.com')
         self.country_code = 'gb'
         self.crs = 4326
+        self.cache = cache if cache is not None else default_cache()
+        self.provider = provider or isochrone_provider()
+
+    def geocode_json(self):
+        key = address_key(self.address)
+        with span('geocode') as s:
+            data = self.cache.get(key)
+            s.add(cached=data is not None)
+            if data is None:
+                url = f'{self.api_url}/geocoding/v5/mapbox.places/{self.address}.json?access_token={self.token}&country={self.country_code}'
+                headers ={'Accept':'application/json'}
+                response = get_with_backoff(url, headers=headers)
+                s.add(bytes=len(response.content))
+                data = response.json()
+                # A miss is asked again next time rather than kept for GEOCODE_TTL
+                if data.get('features'):
+                    self.cache.set(key, data, ttl=GEOCODE_TTL)
+        return data
 
     def geocode_address(self, lat_lon: bool = True):
-        url = f'https://api.mapbox.com/geocoding/v5/mapbox.places/{self.address}.json?access_token={self.token}&country={self.country_code}'
-        headers ={'Accept':'application/json'}
-        response = requests.get(url, headers=headers)
+        data = self.geocode_json()
         if not lat_lon:
-            return response.json()
-        collection = FeatureCollection(response.json())
-        gdf = gpd.GeoDataFrame.from_features(collection['features']).set_crs(epsg=self.crs).iloc[0]
+            return data
+        gdf = gpd.GeoDataFrame.from_features(data['features']).set_crs(epsg=self.crs).iloc[0]
         lon, lat = gdf['geometry'].x, gdf['geometry'].y
         return lon, lat
-        
+
+    def isochrone_json(self,
+                       lon: float,
+                       lat: float,
+                       mode: str,
+                       minutes: int,
+                       denoise: float = 1,
+                       generalize: int = 50):
+        key = isochrone_key(lon, lat, mode, minutes, denoise, generalize, provider=self.provider.name)
+        with span('isochrone', mode=mode, minutes=minutes, provider=self.provider.name) as s:
+            geojson = self.cache.get(key)
+            s.add(cached=geojson is not None)
+            if geojson is None:
+                geojson = self.provider.isochrone_json(lon, lat, mode, minutes, denoise, generalize)
+                self.cache.set(key, geojson, ttl=ISOCHRONE_TTL)
+        return geojson
+
     def isochrone(self,
                   mode: str,
                   minutes: int,
@@ -37,31 +79,116 @@ class Geocoder():
                   generalize: int = 50):
         lon_lat = self.geocode_address(lat_lon=True)
         lon, lat = lon_lat
-        url = f'https://api.mapbox.com/isochrone/v1/mapbox/{mode}/{lon},{lat}'
-        headers = {'Accept':"application/json"}
-        params = {'polygons':'true',
-                  'contours_minutes':minutes,
-                  'denoise':denoise,
-                  'generalize':generalize,
-                  'access_token':self.token}
-        if generalize is None:
-            params.pop('generalize')
-        geojson = requests.get(url, headers=headers, params=params).json()
-        collection = FeatureCollection(geojson)
-        isochrone = gpd.GeoDataFrame.from_features(collection['features']).set_crs(epsg=self.crs)
+        geojson = self.isochrone_json(lon, lat, mode, minutes, denoise, generalize)
+        isochrone = gpd.GeoDataFrame.from_features(geojson['features']).set_crs(epsg=self.crs)
         return isochrone, lon_lat
 
+    @staticmethod
+    def error_message(e: Exception):
+        return re.sub(r'access_token=[^&\s]+', 'access_token=***', f'{type(e).__name__}: {e}')
+
+    @staticmethod
+    def as_list(value, length: int):
+        if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+            if len(value) != length:
+                raise ValueError(f'Expected {length} values, got {len(value)}')
+            return list(value)
+        return [value] * length
+
+    @classmethod
+    def geocode_many(cls,
+                     addresses,
+                     max_workers: int = 8,
+                     cache=None):
+        '''Geocode a list of addresses concurrently. Repeated addresses are fetched once;
+        failures are reported per row in the error column. Rows keep input order.'''
+        addresses = list(addresses)
+        unique = {}
+        for address in addresses:
+            unique.setdefault(address_key(address), address)
+
+        def geocode(address):
+            try:
+                lon, lat = cls(address, cache=cache).geocode_address(lat_lon=True)
+                return lon, lat, None
+            except Exception as e:
+                return np.nan, np.nan, cls.error_message(e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = dict(zip(unique.keys(), map_in_context(pool, geocode, unique.values())))
+
+        rows = [results[address_key(address)] for address in addresses]
+        df = pd.DataFrame(rows, columns=['lon', 'lat', 'error'])
+        df.insert(0, 'address', addresses)
+        geometry = gpd.points_from_xy(df['lon'], df['lat'])
+        gdf = gpd.GeoDataFrame(df, geometry=geometry, crs=4326)
+        gdf.loc[gdf['error'].notna(), 'geometry'] = None
+        return gdf
+
+    @classmethod
+    def isochrone_many(cls,
+                       addresses,
+                       mode='driving',
+                       minutes=30,
+                       denoise: float = 1,
+                       generalize: int = 50,
+                       max_workers: int = 8,
+                       cache=None):
+        '''Isochrones for many addresses. mode and minutes can be scalars or one value per address.
+        Returns one row per input with the catchment polygon, origin and any error.'''
+        addresses = list(addresses)
+        modes = cls.as_list(mode, len(addresses))
+        minutes = cls.as_list(minutes, len(addresses))
+        origins = cls.geocode_many(addresses, max_workers=max_workers, cache=cache)
+
+        requests_by_key = {}
+        for (lon, lat, error), m, t in zip(origins[['lon', 'lat', 'error']].itertuples(index=False), modes, minutes):
+            if pd.isna(error):
+                requests_by_key.setdefault(isochrone_key(lon, lat, m, t, denoise, generalize), (lon, lat, m, t))
+
+        def fetch(args):
+            lon, lat, m, t = args
+            try:
+                geojson = cls(None, cache=cache).isochrone_json(lon, lat, m, t, denoise, generalize)
+                return gpd.GeoDataFrame.from_features(geojson['features']).geometry.iloc[0], None
+            except Exception as e:
+                return None, cls.error_message(e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = dict(zip(requests_by_key.keys(), map_in_context(pool, fetch, requests_by_key.values())))
+
+        geometries, errors = [], []
+        for (lon, lat, error), m, t in zip(origins[['lon', 'lat', 'error']].itertuples(index=False), modes, minutes):
+            if not pd.isna(error):
+                geometries.append(None)
+                errors.append(error)
+                continue
+            geometry, error = results[isochrone_key(lon, lat, m, t, denoise, generalize)]
+            geometries.append(geometry)
+            errors.append(error)
+
+        df = pd.DataFrame({'address': addresses,
+                           'mode': modes,
+                           'minutes': minutes,
+                           'lon': origins['lon'],
+                           'lat': origins['lat'],
+                           'error': errors})
+        return gpd.GeoDataFrame(df, geometry=geometries, crs=4326)
+
 class PricesPaid():
-    def __init__(self):
-        df = pd.read_csv('data/prices_paid_2019.csv')
-        data_gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.longitude, 
-                                                                         df.latitude)).reset_index()
-        three_sigma_amount = data_gdf['AMOUNT'].mean() + (3 * data_gdf['AMOUNT'].std() )
-        self.gdf = data_gdf[data_gdf['AMOUNT'] < three_sigma_amount]
+    def __init__(self, df: pd.DataFrame = None):
+        '''Sales with latitude, longitude and AMOUNT; read from the prepared data files by default.
+        Points stay as coordinate columns, binning never needs Shapely points.'''
+        if df is None:
+            df = load_sales()
+        data_df = df.reset_index()
+        self.gdf = data_df[within_three_sigma(data_df['AMOUNT'])]
         self.crs = 4326
+        self._h3_cache = {}
+        self._pyramid = None
 
     @staticmethod
-    def geo_to_h3(row, H3_resolution = 5):
+    def geo_to_h3(row, H3_resolution = DEFAULT_RESOLUTION):
         return h3.geo_to_h3(lat=row.latitude,lng=row.longitude, resolution = H3_resolution)
 
     @staticmethod
@@ -76,22 +203,46 @@ class PricesPaid():
                                       value_fields,
                                       file_output = None):
 
-        list_features = []
-        for i, row in df_hex.iterrows():
-            feature = Feature(geometry = row[geometry_field],
-                            id = row[hex_id_field],
-                            properties = [ {f'{x}':row[x]} for x in value_fields ])
-            list_features.append(feature)
+        geometries = [mapping(g) for g in df_hex[geometry_field]]
+        values = [df_hex[x].tolist() for x in value_fields]
+        list_features = [{'type': 'Feature',
+                          'id': hex_id,
+                          'geometry': geometry,
+                          'properties': [{f'{x}': v} for x, v in zip(value_fields, row_values)]}
+                         for hex_id, geometry, *row_values in zip(df_hex[hex_id_field].tolist(), geometries, *values)]
         feat_collection = FeatureCollection(list_features)
         if file_output is not None:
             with open(file_output, "w") as f:
-                json.dump(feat_collection, f)
+                f.write(dumps(feat_collection))
         else :
             return feat_collection
 
-    def to_h3(self, count_cutoff: int = 10, return_geo_df: bool = True):
-        self.gdf['H3_cell'] = self.gdf.apply(self.geo_to_h3, axis=1)
-        h3_df = self.gdf.groupby('H3_cell').agg({'AMOUNT':['mean','median','sum'],'index':['count']}).reset_index()
+    def to_h3(self,
+              count_cutoff: int = 10,
+              return_geo_df: bool = True,
+              resolution: int = DEFAULT_RESOLUTION):
+        key = (count_cutoff, resolution)
+        if key not in self._h3_cache:
+            binner = HexBinner(resolutions=resolution, count_cutoff=count_cutoff, crs=self.crs)
+            self._h3_cache[key] = binner.bin_frame(self.gdf)[resolution]
+        h3_df = self._h3_cache[key]
+        if return_geo_df:
+            return h3_df.copy()
+        return pd.DataFrame(h3_df)
+
+    def to_h3_multi(self, resolutions, count_cutoff: int = 10):
+        '''Bin at several resolutions in a single indexing pass.'''
+        binner = HexBinner(resolutions=resolutions, count_cutoff=count_cutoff, crs=self.crs)
+        levels = binner.bin_frame(self.gdf)
+        for resolution, h3_df in levels.items():
+            self._h3_cache[(count_cutoff, resolution)] = h3_df
+        return levels
+
+    def to_h3_apply(self, count_cutoff: int = 10, return_geo_df: bool = True):
+        '''Row-by-row binning path, kept as the reference for benchmarks.'''
+        gdf = self.gdf.copy()
+        gdf['H3_cell'] = gdf.apply(self.geo_to_h3, axis=1)
+        h3_df = gdf.groupby('H3_cell').agg({'AMOUNT':['mean','median','sum'],'index':['count']}).reset_index()
         h3_df.columns = ['H3_cell','mean_price','median_price','total_paid','count']
         h3_df['geometry'] = h3_df.apply(self.add_geometry, axis=1)
         h3_df = h3_df.loc[h3_df['count'] > count_cutoff]
@@ -107,19 +258,11 @@ class PricesPaid():
                                                      geometry_field='geometry')
         return geojson
 
-    def plotly_map(self):
-        df = self.to_h3(return_geo_df=False)
-        geojson = self.to_geojson()
-        fig = (px.choropleth_mapbox(df, 
-                                    geojson=geojson, 
-                                    locations='H3_cell', 
-                                    color='mean_price',
-                                    color_continuous_scale="reds",
-                                    range_color=(0, df['mean_price'].max()),
-                                    mapbox_style='carto-positron',
-                                    zoom=5,
-                                    center = {"lat": 51.5014, "lon": -0.1419},
-                                    opacity=0.7,
-                                    labels={'average':'RE prices paid'}))
-        fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-        return fig
\ No newline at end of file
+    def to_pyramid(self):
+        if self._pyramid is None:
+            self._pyramid = HexPyramid.from_sales(self.gdf)
+        return self._pyramid
+
+    def plotly_map(self, zoom: float = 5, center: dict = None, bbox=None):
+        '''Price choropleth at the hex resolution suited to the zoom, limited to bbox if given.'''
+        return self.to_pyramid().plotly_map(zoom=zoom, center=center, bbox=bbox)
@@ -0,0 +1,126 @@
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+from shapely.geometry import Polygon
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from h3.unstable import vect as h3_vect
+
+H3_COLUMNS = ['H3_cell', 'mean_price', 'median_price', 'total_paid', 'count', 'geometry']
+DEFAULT_RESOLUTION = 5
+
+def coords_to_cells(latitude, longitude, resolution: int = DEFAULT_RESOLUTION):
+    '''Index latitude/longitude arrays into uint64 H3 cells in one call.'''
+    lat = np.ascontiguousarray(latitude, dtype=np.float64)
+    lng = np.ascontiguousarray(longitude, dtype=np.float64)
+    return h3_vect.geo_to_h3(lat, lng, resolution)
+
+def cells_to_parent(cells, resolution: int):
+    return h3_vect.h3_to_parent(np.ascontiguousarray(cells, dtype=np.uint64), resolution)
+
+def cells_to_strings(cells):
+    return [format(int(c), 'x') for c in cells]
+
+def strings_to_cells(cells):
+    return np.array([int(c, 16) for c in cells], dtype=np.uint64)
+
+def cell_centres(cells):
+    '''(lat, lng) arrays of cell centres.'''
+    centres = np.array([h3.h3_to_geo(c) for c in cells], dtype=np.float64).reshape(-1, 2)
+    return centres[:, 0], centres[:, 1]
+
+def cell_polygon(cell: str):
+    return Polygon(h3.h3_to_geo_boundary(cell, True))
+
+def cell_polygons(cells):
+    return [cell_polygon(c) for c in cells]
+
+def within_three_sigma(amounts: pd.Series):
+    '''Mask dropping sales above mean + 3 standard deviations.'''
+    return amounts < amounts.mean() + (3 * amounts.std())
+
+def aggregate_cells(cells, amounts):
+    '''Group sale amounts by cell. Returns unique cells with mean, median, sum and count arrays.'''
+    cells = np.asarray(cells, dtype=np.uint64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    order = np.lexsort((amounts, cells))
+    sorted_cells = cells[order]
+    sorted_amounts = amounts[order]
+    if len(sorted_cells) == 0:
+        empty = np.array([], dtype=np.float64)
+        return np.array([], dtype=np.uint64), empty, empty, empty, np.array([], dtype=np.int64)
+
+    boundaries = np.flatnonzero(sorted_cells[1:] != sorted_cells[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    counts = np.diff(np.concatenate((starts, [len(sorted_cells)])))
+    unique_cells = sorted_cells[starts]
+
+    totals = np.add.reduceat(sorted_amounts, starts)
+    means = totals / counts
+    lower = sorted_amounts[starts + (counts - 1) // 2]
+    upper = sorted_amounts[starts + counts // 2]
+    medians = (lower + upper) / 2
+    return unique_cells, means, medians, totals, counts
+
+class HexBinner():
+    '''Batched H3 binning of point sales at one or more resolutions.'''
+    def __init__(self,
+                 resolutions=DEFAULT_RESOLUTION,
+                 count_cutoff=10,
+                 crs: int = 4326,
+                 geometry: bool = True):
+        '''count_cutoff is an int, or a dict of resolution -> cutoff for pyramids.
+        With geometry=False polygons are left for the caller to build on demand.'''
+        if np.isscalar(resolutions):
+            resolutions = [resolutions]
+        self.resolutions = sorted(set(int(r) for r in resolutions))
+        self.count_cutoff = count_cutoff
+        self.crs = crs
+        self.geometry = geometry
+
+    def cutoff(self, resolution: int = None):
+        if isinstance(self.count_cutoff, dict):
+            return self.count_cutoff.get(resolution, 0)
+        return self.count_cutoff
+
+    def frame(self, cells, means, medians, totals, counts, return_geo_df: bool = True, resolution: int = None):
+        keep = counts > self.cutoff(resolution)
+        ids = cells_to_strings(cells[keep])
+        h3_df = pd.DataFrame({'H3_cell': ids,
+                              'mean_price': means[keep],
+                              'median_price': medians[keep],
+                              'total_paid': totals[keep],
+                              'count': counts[keep]})
+        if not self.geometry:
+            return h3_df
+        h3_df['geometry'] = cell_polygons(ids)
+        if return_geo_df:
+            return gpd.GeoDataFrame(h3_df, geometry='geometry', crs=self.crs)
+        return h3_df
+
+    def bin(self, latitude, longitude, amounts, return_geo_df: bool = True):
+        '''Index once at the finest resolution and roll up to coarser ones via parent cells.
+        Returns a dict of resolution -> frame with H3_COLUMNS.'''
+        amounts = np.asarray(amounts, dtype=np.float64)
+        finest = self.resolutions[-1]
+        cells = coords_to_cells(latitude, longitude, finest)
+        results = {}
+        for resolution in self.resolutions:
+            level_cells = cells if resolution == finest else cells_to_parent(cells, resolution)
+            aggregates = aggregate_cells(level_cells, amounts)
+            results[resolution] = self.frame(*aggregates, return_geo_df=return_geo_df, resolution=resolution)
+        return results
+
+    def bin_frame(self,
+                  df: pd.DataFrame,
+                  amount_field: str = 'AMOUNT',
+                  lat_field: str = 'latitude',
+                  lon_field: str = 'longitude',
+                  return_geo_df: bool = True):
+        return self.bin(df[lat_field].to_numpy(),
+                        df[lon_field].to_numpy(),
+                        df[amount_field].to_numpy(),
+                        return_geo_df=return_geo_df)
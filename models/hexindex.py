@@ -0,0 +1,259 @@
+import argparse
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from h3.api import numpy_int as h3_int
+
+from .hexbin import cells_to_parent, cells_to_strings, strings_to_cells
+
+# Child levels below the layer resolution used to measure how much of an edge hex a
+# catchment covers: 2 levels is 49 children a hex, about 2% per child
+CHILD_LEVELS = 2
+# Hex centre to corner distance as a multiple of the mean edge length for the
+# resolution, with room for hexes larger than the mean
+CORNER_MARGIN = 1.5
+MAX_RESOLUTION = 15
+# How catchments are joined to the price layer: H3 ids or geometric overlay
+PRICE_LOOKUPS = ('h3', 'overlay')
+RESOLUTION_OFFSET = 52
+RESOLUTION_MASK = np.uint64(0xF << RESOLUTION_OFFSET)
+
+def price_lookup(name: str = None):
+    '''Validated price lookup, PRICE_LOOKUP (h3 by default) when name isn't given.'''
+    name = name or os.environ.get('PRICE_LOOKUP', 'h3')
+    if name not in PRICE_LOOKUPS:
+        raise ValueError(f'Unknown price lookup {name!r}, expected one of {PRICE_LOOKUPS}')
+    return name
+
+def digit_offset(resolution: int):
+    '''Bit offset of the 3-bit H3 digit for a resolution.'''
+    return (MAX_RESOLUTION - resolution) * 3
+
+def cell_resolutions(cells):
+    return ((np.asarray(cells, dtype=np.uint64) >> np.uint64(RESOLUTION_OFFSET)) & np.uint64(0xF)).astype(np.int8)
+
+@lru_cache(maxsize=None)
+def digit_masks(resolution: int):
+    '''Per parent resolution, masks of every digit below it down to resolution: all set
+    (7) and the largest real digit (6).'''
+    digits = np.zeros(resolution + 1, dtype=np.uint64)
+    sixes = np.zeros(resolution + 1, dtype=np.uint64)
+    for parent in range(resolution + 1):
+        for r in range(parent + 1, resolution + 1):
+            digits[parent] |= np.uint64(7 << digit_offset(r))
+            sixes[parent] |= np.uint64(6 << digit_offset(r))
+    return digits, sixes
+
+def child_bounds(cells, resolution: int):
+    '''Smallest and largest possible descendant ids at resolution for each cell. Same
+    resolution cells sort by their digits, so every descendant of a cell lies between
+    the two and a sorted array holds them as one contiguous run.'''
+    cells = np.asarray(cells, dtype=np.uint64)
+    digits, sixes = digit_masks(resolution)
+    parents = cell_resolutions(cells)
+    low = (cells & ~RESOLUTION_MASK) | np.uint64(resolution << RESOLUTION_OFFSET)
+    low &= ~digits[parents]
+    return low, low | sixes[parents]
+
+def weighted_median(values, weights):
+    if not len(values) or weights.sum() == 0:
+        return np.nan
+    order = np.argsort(values, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+
+class HexIndex():
+    '''The price hex layer keyed by H3 id, for queries without geometry.
+
+    Cells are held as a sorted uint64 array, so a lookup is a binary search. Catchments
+    are polyfilled against the layer's own hex centres and joined on id instead of
+    intersected, so only hexes along the boundary need geometry; coarser query
+    cells roll up the run of their descendants and finer ones look up their parent.
+    Prices are summarised as the layer is: sums of counts and totals, with the median
+    taken over hex medians weighted by sales.'''
+    def __init__(self, layer: pd.DataFrame):
+        cells = layer['H3_cell']
+        cells = strings_to_cells(cells) if cells.dtype.kind in 'OUT' else cells.to_numpy(dtype=np.uint64)
+        if not len(cells):
+            raise ValueError('HexIndex needs a non-empty layer to take its resolution from')
+        resolutions = np.unique(cell_resolutions(cells))
+        if len(resolutions) > 1:
+            raise ValueError(f'HexIndex needs a single-resolution layer, got resolutions {resolutions.tolist()}')
+        self.resolution = int(resolutions[0])
+        self.layer = layer
+        self.rows = np.argsort(cells, kind='stable')
+        self.cells = cells[self.rows]
+        self.counts = layer['count'].to_numpy(dtype=np.float64)[self.rows]
+        self.totals = layer['total_paid'].to_numpy(dtype=np.float64)[self.rows]
+        self.medians = layer['median_price'].to_numpy(dtype=np.float64)[self.rows]
+        self._cumulative_counts = np.concatenate(([0], np.cumsum(self.counts)))
+        self._cumulative_totals = np.concatenate(([0], np.cumsum(self.totals)))
+        centres = np.array([h3_int.h3_to_geo(c) for c in self.cells], dtype=np.float64).reshape(-1, 2)
+        self.lat, self.lng = centres[:, 0], centres[:, 1]
+        self.corner = CORNER_MARGIN * h3_int.edge_length(self.resolution, 'km') / 111.195
+
+    def __len__(self):
+        return len(self.cells)
+
+    def positions(self, cells):
+        '''Sorted positions of cells at the layer resolution, -1 where the layer has none.'''
+        cells = np.asarray(cells, dtype=np.uint64)
+        found = np.minimum(np.searchsorted(self.cells, cells), len(self.cells) - 1)
+        return np.where(self.cells[found] == cells, found, -1)
+
+    def lookup(self, cells):
+        '''Layer rows for the cells present, in query order.'''
+        positions = self.positions(cells)
+        return self.layer.iloc[self.rows[positions[positions >= 0]]]
+
+    def ranges(self, cells):
+        '''(start, end) sorted positions of the layer cells inside each query cell, at any
+        resolution: finer cells map to their parent, coarser ones to their descendants.'''
+        cells = np.asarray(cells, dtype=np.uint64).copy()
+        finer = cell_resolutions(cells) > self.resolution
+        if finer.any():
+            cells[finer] = cells_to_parent(cells[finer], self.resolution)
+        low, high = child_bounds(cells, self.resolution)
+        return np.searchsorted(self.cells, low, 'left'), np.searchsorted(self.cells, high, 'right')
+
+    def summary(self, start, end):
+        count = self._cumulative_counts[end] - self._cumulative_counts[start]
+        total = self._cumulative_totals[end] - self._cumulative_totals[start]
+        return {'hexes': end - start,
+                'count': count,
+                'total_paid': total,
+                'mean_price': np.divide(total, count, out=np.full(len(count), np.nan), where=count > 0),
+                'median_price': np.array([weighted_median(self.medians[s:e], self.counts[s:e])
+                                          for s, e in zip(start, end)])}
+
+    def stats(self, cells):
+        '''Price summary per query cell, indexed by cell id string. Coarser cells are the
+        roll-up of the layer hexes they contain.'''
+        cells = np.asarray(cells, dtype=np.uint64)
+        start, end = self.ranges(cells)
+        return pd.DataFrame(self.summary(start, end), index=pd.Index(cells_to_strings(cells), name='H3_cell'))
+
+    def rollup(self, resolution: int):
+        '''The layer aggregated to a coarser resolution, with the layer's columns.'''
+        parents = np.unique(cells_to_parent(self.cells, resolution))
+        stats = self.stats(parents).reset_index()
+        return stats[['H3_cell', 'mean_price', 'median_price', 'total_paid', 'count', 'hexes']]
+
+    def combine(self, cells):
+        '''One price summary dict over a set of query cells, each layer hex counted once.'''
+        start, end = self.ranges(np.unique(np.asarray(cells, dtype=np.uint64)))
+        positions = np.unique(np.concatenate([np.arange(s, e) for s, e in zip(start, end)] or [np.array([], dtype=int)]))
+        count, total = float(self.counts[positions].sum()), float(self.totals[positions].sum())
+        return {'hexes': len(positions),
+                'count': count,
+                'total_paid': total,
+                'mean_price': total / count if count else np.nan,
+                'median_price': float(weighted_median(self.medians[positions], self.counts[positions]))}
+
+    def point(self, lat: float, lon: float, resolution: int = None):
+        '''Price summary dict for the cell containing a point, at the layer resolution or a
+        coarser one. A plain dict, as building a Series costs more than the lookup.'''
+        cell = h3_int.geo_to_h3(lat, lon, resolution if resolution is not None else self.resolution)
+        start, end = self.ranges([cell])
+        summary = {k: v[0].item() for k, v in self.summary(start, end).items()}
+        return {'H3_cell': format(cell, 'x'), **summary}
+
+    def ring(self, lat: float, lon: float, k: int = 1):
+        '''Prices over the layer cells within k steps of the cell containing a point.'''
+        return self.combine(h3_int.k_ring(h3_int.geo_to_h3(lat, lon, self.resolution), k))
+
+    def child_share(self, cells, geometry):
+        '''Share of each cell's children at CHILD_LEVELS finer with centres in geometry.'''
+        resolution = min(self.resolution + CHILD_LEVELS, MAX_RESOLUTION)
+        children = [h3_int.h3_to_children(c, resolution) for c in cells]
+        owner = np.repeat(np.arange(len(cells)), [len(c) for c in children])
+        children = np.concatenate(children or [np.array([], dtype=np.uint64)])
+        centres = np.array([h3_int.h3_to_geo(c) for c in children], dtype=np.float64).reshape(-1, 2)
+        inside = shapely.contains_xy(geometry, centres[:, 1], centres[:, 0])
+        total = np.bincount(owner, minlength=len(cells))
+        return np.bincount(owner, weights=inside, minlength=len(cells)) / np.maximum(total, 1)
+
+    def coverage(self, geometry, fractions: bool = False):
+        '''(positions, fraction) of the layer hexes a lon/lat polygon covers. Hexes with
+        their centre inside and no corner across the boundary count in full; those within
+        a hex of the boundary are tested against their own polygon, or with fractions
+        measured by the share of their children inside.'''
+        empty = np.array([], dtype=int), np.array([], dtype=float)
+        if geometry is None or geometry.is_empty:
+            return empty
+        minx, miny, maxx, maxy = geometry.bounds
+        # Degrees of longitude are shorter than latitude, so pad by the wider of the two
+        pad = self.corner / np.cos(np.radians(max(abs(miny), abs(maxy))))
+        candidates = np.flatnonzero((self.lng >= minx - pad) & (self.lng <= maxx + pad) &
+                                    (self.lat >= miny - pad) & (self.lat <= maxy + pad))
+        if not len(candidates):
+            return empty
+        x, y = self.lng[candidates], self.lat[candidates]
+        shapely.prepare(geometry)
+        boundary = geometry.boundary
+        shapely.prepare(boundary)
+        near = shapely.dwithin(boundary, shapely.points(x, y), pad)
+        whole = candidates[~near & shapely.contains_xy(geometry, x, y)]
+
+        edge = candidates[near]
+        if fractions:
+            share = self.child_share(self.cells[edge], geometry)
+            if not len(whole) and not share.any():
+                # A catchment smaller than a child cell still lies in the hex under it
+                point = geometry.representative_point()
+                under = self.positions([h3_int.geo_to_h3(point.y, point.x, self.resolution)])
+                edge, share = under[under >= 0], np.full((under >= 0).sum(), 1 / 7 ** CHILD_LEVELS)
+        else:
+            polygons = [shapely.Polygon(h3_int.h3_to_geo_boundary(c, geo_json=True)) for c in self.cells[edge]]
+            # Hexes only touching the boundary aren't members, as in LayerIndex
+            share = (shapely.intersects(geometry, polygons) & ~shapely.touches(geometry, polygons)).astype(np.float64)
+        return (np.concatenate((whole, edge[share > 0])),
+                np.concatenate((np.ones(len(whole)), share[share > 0])))
+
+    def overlay(self, area: gpd.GeoDataFrame, fractions: bool = False, dissolve: bool = False):
+        '''Layer hexes in each area row, shaped like LayerIndex.overlay(clip=False) so the
+        baselines aggregations take either. Hexes are members when they overlap the area;
+        fractions adds overlap_fraction, the share of their children inside. dissolve
+        treats all rows as one area, such as the ward pieces of a catchment, counting each
+        hex once.'''
+        if area.crs is not None and area.crs != 4326:
+            area = area.to_crs(4326)
+        geometries = area.geometry.values
+        if dissolve:
+            geometries = [shapely.union_all(geometries)] if len(geometries) else []
+        left, right, share = [], [], []
+        for i, geometry in enumerate(geometries):
+            positions, fraction = self.coverage(geometry, fractions)
+            left.append(np.full(len(positions), i))
+            right.append(positions)
+            share.append(fraction)
+        left, right, share = (np.concatenate(a) if a else np.array([], dtype=t)
+                              for a, t in ((left, int), (right, int), (share, float)))
+
+        rows = self.layer.iloc[self.rows[right]].reset_index(drop=True)
+        if not dissolve:
+            attributes = area.drop(columns=area.geometry.name).iloc[left].reset_index(drop=True)
+            rows = pd.concat([attributes, rows], axis=1)
+        if fractions:
+            rows['overlap_fraction'] = share
+        if isinstance(self.layer, gpd.GeoDataFrame):
+            return gpd.GeoDataFrame(rows, geometry=self.layer.geometry.name, crs=self.layer.crs)
+        return rows
+
+if __name__ == '__main__':
+    from .datastore import prepare, load_hex_layer
+
+    parser = argparse.ArgumentParser(description='Price stats around a point from the hex layer.')
+    parser.add_argument('lat', type=float)
+    parser.add_argument('lon', type=float)
+    parser.add_argument('-k', type=int, default=1, help='Neighbourhood rings')
+    parser.add_argument('--resolution', type=int, help='Coarser resolution to roll up to')
+    args = parser.parse_args()
+    prepare()
+    index = HexIndex(load_hex_layer())
+    print(pd.Series(index.point(args.lat, args.lon, args.resolution)).to_string())
+    print(f'Within {args.k} rings:')
+    print(pd.Series(index.ring(args.lat, args.lon, args.k)).to_string())
@@ -0,0 +1,54 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def http_session(pool_size: int = None):
+    '''Process-wide requests.Session with a connection pool sized for batch calls.'''
+    pool_size = pool_size or int(os.environ.get('HTTP_POOL_SIZE', 32))
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[pool_size] = session
+        return session
+
+def http_timeout():
+    '''Seconds to wait for a connection or for each read, from HTTP_TIMEOUT.'''
+    return float(os.environ.get('HTTP_TIMEOUT', 10))
+
+def retry_delay(response, attempt: int, backoff: float):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt)
+
+def get_with_backoff(url: str,
+                     session: requests.Session = None,
+                     retries: int = 4,
+                     backoff: float = 0.5,
+                     **kwargs):
+    '''GET that retries rate-limited (429) and transient 5xx responses with exponential backoff,
+    honouring Retry-After when the server sends it. Requests give up after http_timeout()
+    unless a timeout is passed, and a timeout raises like any other failed request.'''
+    session = session or http_session()
+    kwargs.setdefault('timeout', http_timeout())
+    for attempt in range(retries + 1):
+        response = session.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            break
+        time.sleep(retry_delay(response, attempt, backoff))
+    response.raise_for_status()
+    return response
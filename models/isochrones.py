@@ -0,0 +1,99 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from shapely.geometry import mapping
+
+from .http import get_with_backoff
+from .routing import RoadGraph, ROAD_GRAPH_PATH
+from .tracing import span
+
+ISOCHRONE_PROVIDERS = ('mapbox', 'local')
+# Fill styling Mapbox puts on each contour, kept so responses look alike
+CONTOUR_STYLE = {'color': '#bf4040', 'opacity': 0.33, 'fill': '#bf4040', 'fill-opacity': 0.33,
+                 'fillColor': '#bf4040', 'fillOpacity': 0.33}
+
+class IsochroneProvider(ABC):
+    '''Turns an origin, mode and travel time into a Mapbox-style isochrone
+    FeatureCollection with one polygon feature per contour.'''
+    name = None
+
+    @abstractmethod
+    def isochrone_json(self,
+                       lon: float,
+                       lat: float,
+                       mode: str,
+                       minutes: int,
+                       denoise: float = 1,
+                       generalize: int = 50):
+        ...
+
+class MapboxIsochrones(IsochroneProvider):
+    '''The Mapbox Isochrone API: up to 60 minutes, one request per search.'''
+    name = 'mapbox'
+
+    def __init__(self, token: str = None, api_url: str = None):
+        # Unset values are read from the environment per call, like Geocoder does
+        self.token = token
+        self.api_url = api_url
+
+    def isochrone_json(self, lon, lat, mode, minutes, denoise=1, generalize=50):
+        token = self.token or os.environ.get('MAPBOX_TOKEN')
+        api_url = self.api_url or os.environ.get('MAPBOX_API_URL', 'https://api.mapbox.com')
+        with span('mapbox_isochrone') as s:
+            url = f'{api_url}/isochrone/v1/mapbox/{mode}/{lon},{lat}'
+            headers = {'Accept':"application/json"}
+            params = {'polygons':'true',
+                      'contours_minutes':minutes,
+                      'denoise':denoise,
+                      'generalize':generalize,
+                      'access_token':token}
+            if generalize is None:
+                params.pop('generalize')
+            response = get_with_backoff(url, headers=headers, params=params)
+            s.add(bytes=len(response.content))
+            return response.json()
+
+class LocalIsochrones(IsochroneProvider):
+    '''Isochrones routed over a local road graph, with no time limit or network calls.
+    The graph is read on first use from a compact .npz file or an OSM XML extract.'''
+    name = 'local'
+
+    def __init__(self, graph: RoadGraph = None, path: str = None):
+        self.path = path or os.environ.get('ROAD_GRAPH_PATH', ROAD_GRAPH_PATH)
+        self._graph = graph
+        self._lock = threading.Lock()
+
+    @property
+    def graph(self):
+        with self._lock:
+            if self._graph is None:
+                with span('road_graph_load', path=self.path):
+                    self._graph = RoadGraph.load(self.path)
+            return self._graph
+
+    def isochrone_json(self, lon, lat, mode, minutes, denoise=1, generalize=50):
+        graph = self.graph
+        # Per-mode CSR arrays are built once, not by every thread that races to use them
+        with self._lock:
+            graph.mode(mode)
+        with span('local_isochrone', nodes=graph.nodes):
+            area = graph.catchment(lon, lat, mode, minutes, generalize=generalize or 0, denoise=denoise)
+        if area is None:
+            raise ValueError(f'No {mode} roads reachable from {lon:.5f},{lat:.5f}')
+        properties = {'contour': minutes, 'metric': 'time', **CONTOUR_STYLE}
+        return {'type': 'FeatureCollection',
+                'features': [{'type': 'Feature', 'properties': properties, 'geometry': mapping(area)}]}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def isochrone_provider(name: str = None):
+    '''Shared provider named by ISOCHRONE_PROVIDER (mapbox by default), so a local road
+    graph is loaded once per process.'''
+    name = name or os.environ.get('ISOCHRONE_PROVIDER', 'mapbox')
+    if name not in ISOCHRONE_PROVIDERS:
+        raise ValueError(f'Unknown isochrone provider {name!r}, expected one of {ISOCHRONE_PROVIDERS}')
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = MapboxIsochrones() if name == 'mapbox' else LocalIsochrones()
+        return _providers[name]
@@ -1,19 +1,78 @@
 import pandas as pd
-import requests
 import json
 import geopandas as gpd
 import plotly.express as px
+import plotly.graph_objects as go
 from geojson import Feature, FeatureCollection, Point
 from shapely import wkt
 import os
 from dotenv import find_dotenv, load_dotenv
 
 from .geocoding import Geocoder
+from .wards import ward_store, load_ward_population, fetch_ward_boundaries
+from .cache import analysis_cache, analysis_key
+from .catchments import catchment_store
+from .hexindex import HexIndex
+from .payload import geojson_text
+from .tracing import span
 load_dotenv()
 
 mapbox_token = os.environ.get('MAPBOX_TOKEN')
 px.set_mapbox_access_token(mapbox_token)
 
+def price_overlay(prices_index, drivetime_area: gpd.GeoDataFrame, weighted: bool = False):
+    '''Price hexes inside the ward pieces of a catchment. prices_index is a LayerIndex, or
+    a HexIndex to join on H3 ids instead of intersecting geometry.'''
+    with span('hex_overlay', lookup='h3' if isinstance(prices_index, HexIndex) else 'overlay') as s:
+        if isinstance(prices_index, HexIndex):
+            overlay = prices_index.overlay(drivetime_area, fractions=weighted, dissolve=True)
+        elif weighted:
+            # Weight each hex by its share inside the whole catchment, not per ward piece
+            catchment = drivetime_area[['geometry']].dissolve()
+            overlay = prices_index.overlay(catchment, fractions=True)
+        else:
+            overlay = prices_index.overlay(drivetime_area)
+        s.add(rows=len(overlay))
+    return overlay
+
+class CatchmentAnalysis():
+    '''Result of one search: the ward pieces inside the catchment, their stats, the
+    origin and optionally the price hexes. Shared between sessions through the
+    analysis cache, so the frames are handed out as copies that callers can change.'''
+    def __init__(self,
+                 key: str,
+                 area: gpd.GeoDataFrame,
+                 address_coords,
+                 prices: gpd.GeoDataFrame = None):
+        self.key = key
+        self.lon, self.lat = address_coords[0], address_coords[1]
+        self._area = area
+        self._stats = pd.DataFrame(area.drop(columns='geometry'))
+        self._prices = prices
+        self._geojson = {}
+
+    @property
+    def area(self):
+        return self._area.copy()
+
+    @property
+    def stats(self):
+        return self._stats.copy()
+
+    @property
+    def prices(self):
+        return self._prices.copy() if self._prices is not None else None
+
+    def geojson(self, zoom: float):
+        '''Ward pieces simplified and trimmed for zoom, with only the id plotly joins on.
+        Encoded once per zoom level.'''
+        if zoom not in self._geojson:
+            with span('payload', zoom=zoom) as s:
+                text = geojson_text(self._area, properties=['Ward Code'], zoom=zoom)
+                self._geojson[zoom] = json.loads(text)
+                s.add(bytes=len(text), rows=len(self._area))
+        return self._geojson[zoom]
+
 class Mapper(Geocoder):
     def __init__(self, 
                  address: str):
@@ -23,45 +82,91 @@ class Mapper(Geocoder):
  """
     @staticmethod
     def wards_pop():
-        ward_pop = pd.read_csv('data/wards/ward_population_projections_full_2019.csv').iloc[:,1:]
-        return ward_pop.drop(columns=['wd20nm'])
+        return load_ward_population()
 
     def wards_shp(self):
-        # 2020 BFC wards
-        ## data = requests.get('https://services1.arcgis.com/ESMARspQHYMw9BZ9/arcgis/rest/services/Wards_December_2020_UK_BFC_2022/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson')
-        # 2020 BFE wards
-        data = requests.get('https://services1.arcgis.com/ESMARspQHYMw9BZ9/arcgis/rest/services/Wards_December_2020_UK_BFE_V2_2022/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson')
-        # 2020 BSC wards
-        ##data = requests.get('https://services1.arcgis.com/ESMARspQHYMw9BZ9/arcgis/rest/services/Wards_Dec_2020_UK_BSC_V2_2022/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson')
-        
-        collection = FeatureCollection(data.json())
-        ward_shp = gpd.GeoDataFrame.from_features(collection['features']).set_crs(epsg=self.crs)
-        ward_shp.rename(columns={'WD20CD':'wd20cd', 'WD20NM':'wd20nm'}, inplace=True)
-        return ward_shp.iloc[:, :4]
+        return fetch_ward_boundaries(crs=self.crs)
 
     def wards(self):
-        wards_pop = self.wards_pop()
-        wards_shp = self.wards_shp()
-        gdf = wards_shp.merge(wards_pop, on='wd20cd', how='left')
-        gdf = gdf[(gdf.country == 'England') | (gdf.country == 'Wales')]
-        wards_df = gdf.rename(columns={'wd20cd':'Ward Code','wd20nm':'Ward Name'})
-        return wards_df
+        return ward_store().load()
 
     def overlay(self,
                 mode: str,
                 minutes: int,
                 denoise: float,
-                generalize: int):
-        isochrone = self.isochrone(mode=mode,
-                                   minutes=minutes,
-                                   denoise=denoise,
-                                   generalize=generalize)
-        drivetime_area = isochrone[0]
-        address_coords = isochrone[1]
-        wards = self.wards()
-        overlay = gpd.overlay(drivetime_area, wards, how='intersection')
+                generalize: int,
+                clip: bool = True,
+                weighted: bool = False):
+        address_coords = self.geocode_address(lat_lon=True)
+        # Loaded first: a stale ward layer is rebuilt here, which retires the stored tiles
+        wards = ward_store().index()
+        # Origins near a precomputed catchment reuse its isochrone and ward membership
+        store = catchment_store()
+        tile = store.lookup(*address_coords, mode, minutes, denoise, generalize, provider=self.provider.name)
+        if tile is not None:
+            drivetime_area = tile.isochrone(crs=self.crs)
+        else:
+            drivetime_area = self.isochrone(mode=mode,
+                                            minutes=minutes,
+                                            denoise=denoise,
+                                            generalize=generalize)[0]
+        with span('ward_overlay') as s:
+            members = store.members(drivetime_area, [tile], wards, 'wards') if tile is not None else None
+            overlay = wards.overlay(drivetime_area, clip=clip, fractions=weighted, members=members)
+            s.add(rows=len(overlay), precomputed=tile is not None)
         return overlay, address_coords
 
+    def analyse(self,
+                mode: str = 'driving',
+                minutes: int = 30,
+                denoise: float = 1,
+                generalize: int = 50,
+                weighted: bool = False,
+                prices_index=None):
+        '''Run the search once and keep everything the map and metrics need. Results are
+        cached by address, mode, minutes, denoise, generalize and weighting, so restyles
+        and repeat searches only pay for render_map.'''
+        key = analysis_key(self.address, mode, minutes, denoise, generalize, weighted, prices_index is not None)
+        cache = analysis_cache()
+        analysis = cache.get(key)
+        if analysis is None:
+            drivetime_area, address_coords = self.overlay(mode, minutes, denoise, generalize, weighted=weighted)
+            prices = price_overlay(prices_index, drivetime_area, weighted) if prices_index is not None else None
+            analysis = CatchmentAnalysis(key, drivetime_area, address_coords, prices)
+            cache.set(key, analysis)
+        return analysis
+
+    @staticmethod
+    def render_map(analysis,
+                   zoom_level: int = 10,
+                   opacity: float = 0.5,
+                   map_style: str = 'carto-positron',
+                   color_scheme: str = 'oranges'):
+        '''Figure for an analysis. Only applies styling, nothing is fetched or overlaid.'''
+        # graph_objects directly: plotly express re-validates the whole frame and costs ~4x more
+        with span('figure') as s:
+            stats = analysis.stats
+            choropleth = go.Choroplethmapbox(geojson=analysis.geojson(zoom_level),
+                                             locations=stats['Ward Code'],
+                                             z=stats['total_population'],
+                                             featureidkey='properties.Ward Code',
+                                             colorscale=color_scheme,
+                                             marker_opacity=opacity,
+                                             customdata=stats[['Ward Name']],
+                                             hovertemplate=('Ward Code=%{location}<br>total_population=%{z}'
+                                                            '<br>Ward Name=%{customdata[0]}<extra></extra>'),
+                                             colorbar_title_text='total_population')
+            centre_point = go.Scattermapbox(lat=[analysis.lat], lon=[analysis.lon], mode='markers')
+            fig = go.Figure([choropleth, centre_point])
+            fig.update_layout(mapbox_accesstoken=mapbox_token,
+                              mapbox_style=map_style,
+                              mapbox_zoom=zoom_level,
+                              mapbox_center={"lat": analysis.lat, "lon": analysis.lon},
+                              showlegend=False,
+                              margin={"r":0,"t":0,"l":0,"b":0})
+            s.add(rows=len(stats))
+        return fig
+
     def build_map(self, 
                   mode: str = 'driving',
                   minutes: int = 30,
@@ -70,27 +175,12 @@ class Mapper(Geocoder):
                   zoom_level: int = 10,
                   opacity: float = 0.5,
                   map_style: str = 'carto-positron',
-                  color_scheme: str = 'oranges'):
-        drivetime_area, address_coords = self.overlay(mode, minutes, denoise, generalize)
-        lat, lon = address_coords[1], address_coords[0]
-
-        drivetime_data = pd.DataFrame(drivetime_area.drop(columns='geometry', axis=1))
-        drivetime_geojson = json.loads(drivetime_area.to_json())
-
-        fig = px.choropleth_mapbox(drivetime_data, 
-                                   geojson=drivetime_geojson, 
-                                   color="total_population",
-                                   locations="Ward Code",
-                                   featureidkey="properties.Ward Code",
-                                   center={"lat": lat, "lon":lon},
-                                   hover_data=['Ward Name'],
-                                   mapbox_style=map_style,
-                                   zoom=zoom_level,
-                                   opacity=opacity,
-                                   color_continuous_scale=color_scheme)
-
-        centre_point = px.scatter_mapbox(lat=[lat],
-                                         lon=[lon])
-                
-        fig.add_trace(centre_point.data[0]).update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-        return fig, drivetime_data, drivetime_area
\ No newline at end of file
+                  color_scheme: str = 'oranges',
+                  weighted: bool = False):
+        analysis = self.analyse(mode, minutes, denoise, generalize, weighted=weighted)
+        fig = self.render_map(analysis,
+                              zoom_level=zoom_level,
+                              opacity=opacity,
+                              map_style=map_style,
+                              color_scheme=color_scheme)
+        return fig, analysis.stats, analysis.area
@@ -0,0 +1,111 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .hexbin import coords_to_cells
+from .spatial_index import LayerIndex, clip_pairs
+
+# Layer features are partitioned by the H3 cell (~1,800 km² at res 4) holding a point on them
+PARTITION_RESOLUTION = 4
+# Below this many (area, feature) pairs pool overhead outweighs the clipping
+MIN_PARALLEL_PAIRS = 2000
+# Tasks per worker, so one dense partition doesn't leave the other workers idle
+TASKS_PER_WORKER = 4
+
+# Set in each worker process by _init_worker
+_layer_geometry = None
+_layer_crs = None
+
+def overlay_workers():
+    '''Processes used for clipping, from OVERLAY_WORKERS. The default of 1 clips in-process.'''
+    return max(1, int(os.environ.get('OVERLAY_WORKERS', 1)))
+
+def start_method():
+    '''fork while this process has no other threads, so workers share the layer without
+    pickling it. Forking a threaded process, such as the dashboard with its Supabase writer
+    and metrics server, can leave a child stuck on a lock another thread held, so then
+    workers come from a forkserver, or are spawned where there is none.'''
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return 'fork'
+    return 'forkserver' if 'forkserver' in methods else 'spawn'
+
+def _init_worker(geometry, crs):
+    global _layer_geometry, _layer_crs
+    _layer_geometry = geometry
+    _layer_crs = crs
+
+def _clip_task(task):
+    positions, area_geometry, left, right, areas = task
+    geometry, clipped = clip_pairs(_layer_geometry[right], area_geometry[left], _layer_crs, areas=areas)
+    return positions, np.asarray(geometry), clipped
+
+class ParallelLayerIndex(LayerIndex):
+    '''LayerIndex that clips large overlays across a pool of worker processes.
+
+    Candidate pairs still come from the STRtree in this process. They are grouped
+    by the H3 partition of their layer feature and shipped as position arrays plus
+    the few area geometries each task needs. Workers get the layer geometry once, at
+    fork when that is safe (see start_method). Results are written back by pair
+    position, so the output is identical to LayerIndex.overlay whatever the worker count.'''
+    def __init__(self,
+                 layer,
+                 max_workers: int = None,
+                 min_pairs: int = MIN_PARALLEL_PAIRS,
+                 partition_resolution: int = PARTITION_RESOLUTION):
+        super().__init__(layer)
+        self.max_workers = max_workers or overlay_workers()
+        self.min_pairs = min_pairs
+        points = layer.geometry.representative_point()
+        if self.crs is not None and self.crs != 4326:
+            points = points.to_crs(4326)
+        self.partitions = coords_to_cells(points.y.to_numpy(), points.x.to_numpy(), partition_resolution)
+        self._pool = None
+
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context(start_method()),
+                                             initializer=_init_worker,
+                                             initargs=(self.layer.geometry.values, self.crs))
+            atexit.register(self.close)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def tasks(self, area_geometry, left, right, areas: bool = False):
+        '''Split the pairs into contiguous runs of whole partitions of roughly equal size.'''
+        order = np.argsort(self.partitions[right], kind='stable')
+        keys = self.partitions[right][order]
+        bounds = np.append(np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))), len(order))
+        count = self.max_workers * TASKS_PER_WORKER
+        targets = np.arange(1, count) * len(order) / count
+        cuts = np.unique(np.concatenate(([0], bounds[np.searchsorted(bounds, targets)], [len(order)])))
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            positions = order[start:end]
+            used, task_left = np.unique(left[positions], return_inverse=True)
+            yield positions, area_geometry[used], task_left, right[positions], areas
+
+    def intersect(self, area_geometry, left, right, areas: bool = False):
+        if self.max_workers <= 1 or len(right) < self.min_pairs:
+            return super().intersect(area_geometry, left, right, areas=areas)
+        geometry = np.empty(len(right), dtype=object)
+        clipped = np.empty(len(right), dtype=np.float64) if areas else None
+        for positions, part, part_areas in self.pool().map(_clip_task, self.tasks(area_geometry, left, right, areas)):
+            geometry[positions] = part
+            if areas:
+                clipped[positions] = part_areas
+        return geometry, clipped
+
+def layer_index(layer, max_workers: int = None):
+    '''LayerIndex for layer, clipping in a process pool when more than one worker is configured.'''
+    max_workers = max_workers or overlay_workers()
+    if max_workers > 1:
+        return ParallelLayerIndex(layer, max_workers=max_workers)
+    return LayerIndex(layer)
@@ -0,0 +1,76 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import mapping
+
+# Degrees per pixel at zoom 0 on 256px web map tiles
+DEGREES_PER_PIXEL = 360 / 256
+# Simplification tolerance in screen pixels; under a pixel the change isn't visible
+SIMPLIFY_PIXELS = 0.5
+MAX_DECIMALS = 7
+
+def feature_collection(gdf, id_field: str = None, properties=None):
+    '''GeoJSON FeatureCollection dict built column-wise: geometries, ids and property
+    records are converted once per column rather than row by row with iterrows.'''
+    geometries = [mapping(g) for g in gdf.geometry.values]
+    ids = gdf[id_field].tolist() if id_field else [None] * len(gdf)
+    records = gdf[list(properties)].to_dict('records') if properties else [{}] * len(gdf)
+    features = [{'type': 'Feature', 'id': i, 'geometry': g, 'properties': p}
+                for i, g, p in zip(ids, geometries, records)]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def to_native(value):
+    '''Python scalar for a numpy one, as older pandas to_dict returns; anything else as is.'''
+    return value.item() if isinstance(value, np.generic) else value
+
+def json_default(value):
+    native = to_native(value)
+    if native is value:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return native
+
+def dumps(collection: dict):
+    return json.dumps(collection, separators=(',', ':'), default=json_default)
+
+def zoom_tolerance(zoom: float, pixels: float = SIMPLIFY_PIXELS):
+    '''Distance in degrees covered by pixels at a map zoom level.'''
+    return pixels * DEGREES_PER_PIXEL / 2 ** zoom
+
+def zoom_decimals(zoom: float):
+    '''Coordinate decimals needed to stay within half a pixel at zoom.'''
+    return int(min(MAX_DECIMALS, max(0, math.ceil(-math.log10(zoom_tolerance(zoom))))))
+
+def simplify(geometry, zoom: float, pixels: float = SIMPLIFY_PIXELS):
+    '''Topology-preserving simplification of each geometry to what is visible at zoom.
+    Shapes keep their rings valid; edges shared by neighbours may part by under a pixel.'''
+    return shapely.simplify(np.asarray(geometry), zoom_tolerance(zoom, pixels), preserve_topology=True)
+
+def quantize(geometry, decimals: int):
+    '''Round every coordinate to decimals places in one vectorised pass.'''
+    return shapely.transform(np.asarray(geometry), lambda coords: np.round(coords, decimals))
+
+def geojson_text(gdf, id_field: str = None, properties=None, zoom: float = None, decimals: int = None):
+    '''Compact FeatureCollection text. Geometries are written by GEOS and properties by
+    pandas, one call per column. With zoom, geometries are simplified for that zoom and
+    coordinates trimmed to the precision it can show; decimals overrides the trimming.'''
+    geometry = np.asarray(gdf.geometry.values)
+    if zoom is not None:
+        geometry = simplify(geometry, zoom)
+        decimals = zoom_decimals(zoom) if decimals is None else decimals
+    if decimals is not None:
+        geometry = quantize(geometry, decimals)
+    geometries = shapely.to_geojson(geometry)
+    ids = [json.dumps(i, default=json_default) for i in gdf[id_field].tolist()] if id_field else ['null'] * len(gdf)
+    if properties:
+        records = pd.DataFrame(gdf[list(properties)]).to_json(orient='records', lines=True).splitlines()
+    else:
+        records = ['{}'] * len(gdf)
+    features = ','.join(f'{{"type":"Feature","id":{i},"geometry":{g},"properties":{p}}}'
+                        for i, g, p in zip(ids, geometries, records))
+    return f'{{"type":"FeatureCollection","features":[{features}]}}'
+
+def compact_feature_collection(gdf, id_field: str = None, properties=None, zoom: float = None, decimals: int = None):
+    '''geojson_text parsed back to a dict, for plotly, which only takes GeoJSON as a dict.'''
+    return json.loads(geojson_text(gdf, id_field=id_field, properties=properties, zoom=zoom, decimals=decimals))
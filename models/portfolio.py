@@ -0,0 +1,148 @@
+import argparse
+import os
+import pandas as pd
+import geopandas as gpd
+
+from .geocoding import Geocoder, PricesPaid
+from .parallel import layer_index
+from .wards import ward_store
+from .catchments import catchment_store, CATCHMENT_GENERALIZE
+from .hexindex import HexIndex, PRICE_LOOKUPS, price_lookup as price_lookup_name
+from .baselines import load_baselines, national_prices, aggregate_wards, aggregate_prices, diff_to_national
+
+SITE_COLUMNS = ['address', 'mode', 'minutes']
+
+class PortfolioAnalysis():
+    '''Catchment metrics for many sites in one pass.
+
+    Isochrones are fetched concurrently, then every catchment is joined against
+    the ward and price hex layers in a single bulk overlay rather than one
+    overlay per site.'''
+    def __init__(self,
+                 wards: gpd.GeoDataFrame = None,
+                 prices: gpd.GeoDataFrame = None,
+                 baselines: dict = None,
+                 weighted: bool = False,
+                 max_workers: int = 8,
+                 cache=None,
+                 overlay_workers: int = None,
+                 price_lookup: str = None):
+        '''max_workers bounds concurrent API requests; overlay_workers is the number of
+        processes clipping catchments (OVERLAY_WORKERS by default). price_lookup joins
+        catchments to price hexes on H3 ids ('h3') or by overlay (PRICE_LOOKUP by default).'''
+        if wards is None and overlay_workers is None:
+            self.ward_index = ward_store().index()
+        else:
+            self.ward_index = layer_index(wards if wards is not None else ward_store().load(), overlay_workers)
+        prices = prices if prices is not None else PricesPaid().to_h3()
+        self.price_lookup = price_lookup_name(price_lookup)
+        self.price_index = HexIndex(prices) if self.price_lookup == 'h3' else layer_index(prices, overlay_workers)
+        self.baselines = baselines if baselines is not None else load_baselines()
+        self.weighted = weighted
+        self.max_workers = max_workers
+        self.cache = cache
+
+    @staticmethod
+    def sites_frame(sites):
+        if isinstance(sites, pd.DataFrame):
+            df = sites[SITE_COLUMNS].copy()
+        else:
+            df = pd.DataFrame(list(sites), columns=SITE_COLUMNS)
+        df['minutes'] = df['minutes'].astype(int)
+        return df.reset_index(drop=True)
+
+    def catchments(self, sites: pd.DataFrame, denoise: float = 1, generalize: int = CATCHMENT_GENERALIZE):
+        '''Isochrone per site, from the catchment store where an origin is precomputed and
+        fetched otherwise. The tile column holds the store entry, or None.'''
+        store = catchment_store()
+        origins = Geocoder.geocode_many(sites['address'], max_workers=self.max_workers, cache=self.cache)
+        tiles = [store.lookup(lon, lat, mode, minutes, denoise, generalize) if pd.isna(error) else None
+                 for (lon, lat, error), mode, minutes in zip(origins[['lon', 'lat', 'error']].itertuples(index=False),
+                                                             sites['mode'], sites['minutes'])]
+        live = [i for i, tile in enumerate(tiles) if tile is None]
+        fetched = Geocoder.isochrone_many(sites['address'].iloc[live],
+                                          mode=sites['mode'].iloc[live].tolist(),
+                                          minutes=sites['minutes'].iloc[live].tolist(),
+                                          denoise=denoise,
+                                          generalize=generalize,
+                                          max_workers=self.max_workers,
+                                          cache=self.cache)
+        fetched.index = live
+        stored = [i for i, tile in enumerate(tiles) if tile is not None]
+        precomputed = gpd.GeoDataFrame({'address': sites['address'].iloc[stored].tolist(),
+                                        'mode': sites['mode'].iloc[stored].tolist(),
+                                        'minutes': sites['minutes'].iloc[stored].tolist(),
+                                        'lon': origins['lon'].iloc[stored].tolist(),
+                                        'lat': origins['lat'].iloc[stored].tolist(),
+                                        'error': [None] * len(stored)},
+                                       geometry=[tiles[i].isochrone().geometry.iloc[0] for i in stored],
+                                       index=stored, crs=4326)
+        isochrones = pd.concat([frame for frame in (fetched, precomputed) if len(frame)] or [fetched]).sort_index()
+        isochrones.insert(0, 'site_id', range(len(isochrones)))
+        isochrones['tile'] = tiles
+        return isochrones
+
+    @staticmethod
+    def members(areas: gpd.GeoDataFrame, index, layer: str):
+        '''Stored membership for precomputed catchments, or None when no site has one.'''
+        if areas['tile'].isna().all():
+            return None
+        return catchment_store().members(areas, areas['tile'], index, layer)
+
+    def ward_metrics(self, areas: gpd.GeoDataFrame):
+        # Unweighted metrics only read ward attributes, so members aren't clipped
+        wards = self.ward_index.overlay(areas.drop(columns='tile'), clip=self.weighted, fractions=self.weighted,
+                                        members=self.members(areas, self.ward_index, 'wards'))
+        metrics = aggregate_wards(wards, by='site_id', weighted=self.weighted)
+        metrics['wards'] = wards.groupby('site_id')['Ward Code'].nunique()
+        return metrics
+
+    def price_metrics(self, areas: gpd.GeoDataFrame):
+        if self.price_lookup == 'h3':
+            hexes = self.price_index.overlay(areas.drop(columns='tile'), fractions=self.weighted)
+        else:
+            hexes = self.price_index.overlay(areas.drop(columns='tile'), clip=self.weighted, fractions=self.weighted,
+                                             members=self.members(areas, self.price_index, 'hexes'))
+        metrics = aggregate_prices(hexes, by='site_id', weighted=self.weighted)
+        metrics['hexes'] = hexes.groupby('site_id')['H3_cell'].nunique()
+        national_median, national_mean = national_prices(self.baselines, weighted=self.weighted)
+        metrics['median_price_to_national'] = diff_to_national(metrics['median_price'], national_median)
+        metrics['mean_price_to_national'] = diff_to_national(metrics['mean_price'], national_mean)
+        return metrics
+
+    def run(self, sites, denoise: float = 1, generalize: int = CATCHMENT_GENERALIZE):
+        '''Sites are a DataFrame or iterable of (address, mode, minutes).
+        Returns one row per site, in input order.'''
+        sites = self.sites_frame(sites)
+        isochrones = self.catchments(sites, denoise=denoise, generalize=generalize)
+        areas = isochrones.loc[isochrones.geometry.notna(), ['site_id', 'tile', 'geometry']]
+        results = (isochrones.drop(columns='geometry')
+                             .join(self.ward_metrics(areas), on='site_id')
+                             .join(self.price_metrics(areas), on='site_id'))
+        return results[['site_id', 'address', 'mode', 'minutes', 'lon', 'lat',
+                        'population', 'median_age', 'wards',
+                        'median_price', 'median_price_to_national',
+                        'mean_price', 'mean_price_to_national', 'hexes', 'error']]
+
+    @staticmethod
+    def export(results: pd.DataFrame, path: str):
+        if os.path.splitext(path)[1].lower() == '.parquet':
+            results.to_parquet(path, index=False)
+        else:
+            results.to_csv(path, index=False)
+        return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Catchment metrics for a portfolio of sites.')
+    parser.add_argument('sites', help='CSV with address, mode and minutes columns')
+    parser.add_argument('--output', default='portfolio_results.csv', help='.csv or .parquet')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--overlay-workers', type=int, default=None, help='Processes clipping catchments')
+    parser.add_argument('--weighted', action='store_true', help='Apportion wards and hexes by overlap area')
+    parser.add_argument('--price-lookup', choices=PRICE_LOOKUPS, default=None,
+                        help='Join price hexes on H3 ids or by overlay (PRICE_LOOKUP, default h3)')
+    args = parser.parse_args()
+    analysis = PortfolioAnalysis(weighted=args.weighted, max_workers=args.workers,
+                                 overlay_workers=args.overlay_workers, price_lookup=args.price_lookup)
+    results = analysis.run(pd.read_csv(args.sites))
+    print(f'Wrote {len(results):,} sites to {analysis.export(results, args.output)}')
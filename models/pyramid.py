@@ -0,0 +1,139 @@
+import argparse
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+import plotly.express as px
+
+from .hexbin import HexBinner, cells_to_strings, strings_to_cells, cell_centres, cell_polygons, within_three_sigma
+from .datastore import HEX_DTYPES, load_sales
+from .payload import compact_feature_collection, zoom_decimals
+
+PYRAMID_PATH = 'data/prices-pyramid.parquet'
+PYRAMID_RESOLUTIONS = (4, 5, 6, 7, 8, 9)
+# Finer cells hold fewer sales, so they need a lower cutoff to show anything
+PYRAMID_CUTOFFS = {4: 10, 5: 10, 6: 5, 7: 3, 8: 2, 9: 2}
+VALUE_FIELDS = ['mean_price', 'median_price', 'total_paid', 'count']
+
+def build_pyramid(sales: pd.DataFrame,
+                  resolutions=PYRAMID_RESOLUTIONS,
+                  count_cutoff=PYRAMID_CUTOFFS):
+    '''Bin sales at every resolution in one indexing pass (coarser levels are parents of the
+    finest) and stack the levels into one frame with resolution and cell centre columns.
+    Polygons are not built here; HexPyramid creates them for the cells it serves.'''
+    levels = HexBinner(resolutions=resolutions, count_cutoff=count_cutoff, geometry=False).bin_frame(sales)
+    frames = []
+    for resolution, level in levels.items():
+        level.insert(0, 'resolution', np.int8(resolution))
+        frames.append(level)
+    pyramid = pd.concat(frames, ignore_index=True)
+    lat, lng = cell_centres(pyramid['H3_cell'])
+    pyramid['lat'] = lat.astype(np.float32)
+    pyramid['lng'] = lng.astype(np.float32)
+    return pyramid
+
+def write_pyramid(pyramid: pd.DataFrame, path: str = PYRAMID_PATH):
+    df = pyramid.copy()
+    df['H3_cell'] = strings_to_cells(df['H3_cell'])
+    for column, dtype in HEX_DTYPES.items():
+        df[column] = df[column].astype(dtype)
+    # Sorted by resolution so each level reads as contiguous row groups
+    df.sort_values(['resolution', 'H3_cell']).to_parquet(path, index=False)
+    return path
+
+class HexPyramid():
+    '''Zoom-aware access to a multi-resolution price hex pyramid.'''
+    def __init__(self, pyramid: pd.DataFrame = None, path: str = PYRAMID_PATH, crs: int = 4326):
+        self.path = path
+        self.crs = crs
+        self._pyramid = pyramid
+        self._levels = {}
+
+    @classmethod
+    def from_sales(cls, sales: pd.DataFrame, **kwargs):
+        return cls(pyramid=build_pyramid(sales, **kwargs))
+
+    def pyramid(self):
+        if self._pyramid is None:
+            pyramid = pd.read_parquet(self.path, memory_map=True)
+            pyramid['H3_cell'] = cells_to_strings(pyramid['H3_cell'].to_numpy())
+            self._pyramid = pyramid
+        return self._pyramid
+
+    @property
+    def resolutions(self):
+        return sorted(self.pyramid()['resolution'].unique().tolist())
+
+    def level(self, resolution: int):
+        if resolution not in self._levels:
+            pyramid = self.pyramid()
+            self._levels[resolution] = pyramid[pyramid['resolution'] == resolution].reset_index(drop=True)
+        return self._levels[resolution]
+
+    def resolution_for_zoom(self, zoom: float, latitude: float = 52.5, hex_pixels: float = 12):
+        '''Finest resolution whose hexes are still at least hex_pixels across at this map zoom.'''
+        metres_per_pixel = 156543.03 * math.cos(math.radians(latitude)) / 2 ** zoom
+        target = metres_per_pixel * hex_pixels
+        resolutions = self.resolutions
+        for resolution in reversed(resolutions):
+            if 2 * h3.edge_length(resolution, unit='m') >= target:
+                return resolution
+        return resolutions[0]
+
+    def cells(self, zoom: float = None, bbox=None, resolution: int = None):
+        '''Cells for a zoom level (or explicit resolution) as a GeoDataFrame, limited to a
+        (minx, miny, maxx, maxy) bounding box when one is given.'''
+        if resolution is None:
+            latitude = (bbox[1] + bbox[3]) / 2 if bbox is not None else 52.5
+            resolution = self.resolution_for_zoom(zoom if zoom is not None else 5, latitude=latitude)
+        level = self.level(resolution)
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            # Pad by a cell's circumradius so hexes straddling the edge are kept
+            pad_lat = h3.edge_length(resolution, unit='km') / 111
+            pad_lng = pad_lat / math.cos(math.radians((miny + maxy) / 2))
+            lat, lng = level['lat'].to_numpy(), level['lng'].to_numpy()
+            inside = ((lng >= minx - pad_lng) & (lng <= maxx + pad_lng) &
+                      (lat >= miny - pad_lat) & (lat <= maxy + pad_lat))
+            level = level[inside]
+        return gpd.GeoDataFrame(level.drop(columns=['lat', 'lng']),
+                                geometry=cell_polygons(level['H3_cell']),
+                                crs=self.crs)
+
+    def geojson(self, zoom: float = None, bbox=None, resolution: int = None):
+        cells = self.cells(zoom=zoom, bbox=bbox, resolution=resolution)
+        # Hexes are already sized for the zoom, so only the coordinate precision is trimmed
+        decimals = zoom_decimals(zoom) if zoom is not None else None
+        return cells, compact_feature_collection(cells, id_field='H3_cell', properties=VALUE_FIELDS, decimals=decimals)
+
+    def plotly_map(self,
+                   zoom: float = 5,
+                   center: dict = None,
+                   bbox=None,
+                   color: str = 'mean_price',
+                   map_style: str = 'carto-positron',
+                   opacity: float = 0.7):
+        center = center or {"lat": 51.5014, "lon": -0.1419}
+        cells, geojson = self.geojson(zoom=zoom, bbox=bbox)
+        fig = px.choropleth_mapbox(pd.DataFrame(cells.drop(columns='geometry')),
+                                   geojson=geojson,
+                                   locations='H3_cell',
+                                   color=color,
+                                   color_continuous_scale="reds",
+                                   range_color=(0, cells[color].max()),
+                                   mapbox_style=map_style,
+                                   zoom=zoom,
+                                   center=center,
+                                   opacity=opacity,
+                                   labels={'average':'RE prices paid'})
+        fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+        return fig
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the multi-resolution price hex pyramid.')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=list(PYRAMID_RESOLUTIONS))
+    args = parser.parse_args()
+    sales = load_sales()
+    pyramid = build_pyramid(sales[within_three_sigma(sales['AMOUNT'])], resolutions=args.resolutions)
+    print(f'Wrote {len(pyramid):,} cells to {write_pyramid(pyramid)}')
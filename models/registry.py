@@ -0,0 +1,105 @@
+import argparse
+import os
+import threading
+import time
+
+from .datastore import prepare, load_hex_layer
+from .baselines import load_baselines
+from .parallel import layer_index
+from .hexindex import HexIndex, price_lookup
+from .wards import ward_store, load_ward_population
+
+def resident_bytes():
+    '''Current RSS from /proc, or None where it isn't available.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+class DatasetRegistry():
+    '''Read-only datasets shared by every session in the server process.
+
+    Each dataset is built once, on first use or by warm(), and the same object
+    is handed to every caller. Callers must not mutate what they get back.
+    Build time and RSS growth are recorded per dataset for the startup report.'''
+    DATASETS = ('prices', 'price_index', 'baselines', 'ward_population', 'wards', 'ward_index')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._datasets = {}
+        self.stats = {}
+
+    def get(self, name: str, build):
+        if name in self._datasets:
+            return self._datasets[name]
+        with self._lock:
+            if name not in self._datasets:
+                rss = resident_bytes()
+                start = time.perf_counter()
+                self._datasets[name] = build()
+                self.stats[name] = {'seconds': time.perf_counter() - start,
+                                    'rss_mb': None if rss is None else (resident_bytes() - rss) / 2 ** 20}
+        return self._datasets[name]
+
+    def prices(self):
+        '''Price hex layer with the same columns as PricesPaid.to_h3.'''
+        def build():
+            prepare()
+            return load_hex_layer()
+        return self.get('prices', build)
+
+    def prices_index(self):
+        return self.get('prices_index', lambda: layer_index(self.prices()))
+
+    def hex_index(self):
+        return self.get('hex_index', lambda: HexIndex(self.prices()))
+
+    def price_index(self):
+        '''The index PRICE_LOOKUP joins catchments with: hex_index for h3, prices_index
+        for overlay. Only that one is built.'''
+        return self.hex_index() if price_lookup() == 'h3' else self.prices_index()
+
+    def baselines(self):
+        return self.get('baselines', load_baselines)
+
+    def ward_population(self):
+        return self.get('ward_population', load_ward_population)
+
+    def wards(self):
+        return self.get('wards', lambda: ward_store().load())
+
+    def ward_index(self):
+        return self.get('ward_index', lambda: ward_store().index())
+
+    def warm(self, names=DATASETS):
+        for name in names:
+            getattr(self, name)()
+        return self.report()
+
+    def report(self):
+        '''Startup time and memory per dataset built so far, plus the process RSS.'''
+        rss = resident_bytes()
+        return {'datasets': dict(self.stats),
+                'startup_seconds': sum(s['seconds'] for s in self.stats.values()),
+                'rss_mb': None if rss is None else rss / 2 ** 20}
+
+_default_registry = None
+_registry_lock = threading.Lock()
+
+def registry():
+    global _default_registry
+    with _registry_lock:
+        if _default_registry is None:
+            _default_registry = DatasetRegistry()
+    return _default_registry
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and load every shared dataset, e.g. during the image build.')
+    parser.add_argument('--datasets', nargs='+', default=list(DatasetRegistry.DATASETS))
+    args = parser.parse_args()
+    report = registry().warm(args.datasets)
+    for name, stats in report['datasets'].items():
+        rss = '' if stats['rss_mb'] is None else f', +{stats["rss_mb"]:.1f} MB'
+        print(f'{name}: {stats["seconds"]:.3f}s{rss}')
+    print(f'Startup: {report["startup_seconds"]:.3f}s, RSS {report["rss_mb"] or 0:.1f} MB')
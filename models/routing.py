@@ -0,0 +1,259 @@
+import argparse
+import os
+import re
+import xml.etree.ElementTree as ET
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy import ndimage
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from .spatial_index import AREA_CRS
+
+ROAD_GRAPH_PATH = 'data/roads.npz'
+HIGHWAY_CLASSES = ('motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+                   'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+                   'residential', 'living_street', 'service', 'road', 'track', 'cycleway',
+                   'footway', 'path', 'pedestrian', 'steps', 'bridleway')
+# km/h per highway class; classes a mode can't use are left out
+SPEED_PROFILES = {
+    'driving': {'motorway': 100, 'motorway_link': 60, 'trunk': 80, 'trunk_link': 50,
+                'primary': 60, 'primary_link': 45, 'secondary': 50, 'secondary_link': 40,
+                'tertiary': 40, 'tertiary_link': 35, 'unclassified': 30, 'residential': 25,
+                'living_street': 10, 'service': 15, 'road': 25},
+    'cycling': {'trunk': 18, 'trunk_link': 18, 'primary': 18, 'primary_link': 18, 'secondary': 18,
+                'secondary_link': 18, 'tertiary': 18, 'tertiary_link': 18, 'unclassified': 16,
+                'residential': 16, 'living_street': 12, 'service': 14, 'road': 16, 'track': 12,
+                'cycleway': 18, 'path': 12, 'bridleway': 10},
+    'walking': {name: 5 for name in HIGHWAY_CLASSES if name not in ('motorway', 'motorway_link')} | {'steps': 3},
+}
+# Modes that must follow one-way restrictions
+ONEWAY_MODES = ('driving', 'cycling')
+# Reached roads are buffered by this many metres to form the catchment
+CORRIDOR_METRES = {'driving': 200, 'cycling': 100, 'walking': 50}
+# Raster cells per corridor width when drawing catchments
+CORRIDOR_CELLS = 2
+# Sources are every graph node within this distance of the origin, plus the nearest
+SNAP_METRES = 30
+# Floor on edge cost; csgraph treats explicit zeros as missing edges
+MIN_EDGE_SECONDS = 0.01
+
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = (np.radians(a) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+def parse_maxspeed(value: str):
+    '''km/h from an OSM maxspeed tag ('30 mph', '50'), NaN when missing or symbolic.'''
+    match = re.match(r'\s*(\d+(?:\.\d+)?)\s*(mph)?', value or '')
+    if not match:
+        return np.nan
+    speed = float(match.group(1))
+    return speed * 1.609344 if match.group(2) else speed
+
+def oneway_direction(tags: dict):
+    value = tags.get('oneway', '')
+    if value in ('yes', 'true', '1') or tags.get('junction') == 'roundabout':
+        return 1
+    if value == '-1':
+        return -1
+    return 0
+
+def osm_elements(path: str, tag: str):
+    '''Top-level OSM XML elements named tag (node, way or relation). Every element is
+    cleared once handled and dropped from the root, so memory doesn't grow with the file.'''
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event == 'end' and element.tag in ('node', 'way', 'relation'):
+            if element.tag == tag:
+                yield element
+            element.clear()
+            root.clear()
+
+class ModeGraph():
+    '''CSR adjacency of travel seconds for one mode, with a KD-tree of its nodes.'''
+    def __init__(self, graph, mode: str):
+        speeds = np.full(len(HIGHWAY_CLASSES), np.nan)
+        for name, speed in SPEED_PROFILES[mode].items():
+            speeds[HIGHWAY_CLASSES.index(name)] = speed
+        kph = speeds[graph.highway]
+        if mode == 'driving':
+            kph = np.fmin(kph, graph.maxspeed)
+        usable = ~np.isnan(kph)
+        u, v = graph.u[usable], graph.v[usable]
+        seconds = np.maximum(graph.length[usable] / (kph[usable] / 3.6), MIN_EDGE_SECONDS)
+        oneway = graph.oneway[usable] if mode in ONEWAY_MODES else np.zeros(usable.sum(), dtype=np.int8)
+        forward, backward = oneway >= 0, oneway <= 0
+        sources = np.concatenate((u[forward], v[backward]))
+        targets = np.concatenate((v[forward], u[backward]))
+        seconds = np.concatenate((seconds[forward], seconds[backward]))
+        # Keep the fastest of any parallel edges rather than letting scipy sum them
+        order = np.lexsort((seconds, targets, sources))
+        sources, targets, seconds = sources[order], targets[order], seconds[order]
+        first = np.concatenate(([True], (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])))
+        sources, targets, seconds = sources[first], targets[first], seconds[first]
+
+        self.mode = mode
+        self.matrix = csr_matrix((seconds, (sources, targets)), shape=(graph.nodes, graph.nodes))
+        self.edge_sources = sources
+        self.edge_targets = targets
+        self.edge_seconds = seconds
+        self.node_ids = np.unique(np.concatenate((sources, targets)))
+        self.tree = cKDTree(np.column_stack((graph.x[self.node_ids], graph.y[self.node_ids])))
+
+    def sources(self, x: float, y: float, snap_metres: float = SNAP_METRES):
+        nearest = self.tree.query([x, y])[1]
+        nearby = self.tree.query_ball_point([x, y], snap_metres)
+        return self.node_ids[np.unique(np.append(nearby, nearest))]
+
+    def travel_times(self, sources, limit: float):
+        '''Seconds to every node from the nearest source, inf beyond limit.'''
+        return dijkstra(self.matrix, directed=True, indices=sources, limit=limit, min_only=True)
+
+class RoadGraph():
+    '''Road network as flat edge arrays: node coordinates (lon/lat and British National
+    Grid metres), and per edge its end nodes, length, highway class, one-way direction
+    and maxspeed. Per-mode CSR graphs are built on first use.'''
+    def __init__(self, lon, lat, u, v, highway, oneway=None, maxspeed=None, length=None):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.u = np.asarray(u, dtype=np.int32)
+        self.v = np.asarray(v, dtype=np.int32)
+        self.highway = np.asarray(highway, dtype=np.uint8)
+        self.oneway = np.zeros(len(self.u), dtype=np.int8) if oneway is None else np.asarray(oneway, dtype=np.int8)
+        self.maxspeed = np.full(len(self.u), np.nan, dtype=np.float32) if maxspeed is None else np.asarray(maxspeed, dtype=np.float32)
+        if length is None:
+            length = haversine(self.lon[self.u], self.lat[self.u], self.lon[self.v], self.lat[self.v])
+        self.length = np.asarray(length, dtype=np.float32)
+        projected = gpd.GeoSeries.from_xy(self.lon, self.lat, crs=4326).to_crs(AREA_CRS)
+        self.x, self.y = projected.x.to_numpy(), projected.y.to_numpy()
+        self._modes = {}
+
+    @property
+    def nodes(self):
+        return len(self.lon)
+
+    @property
+    def edges(self):
+        return len(self.u)
+
+    def mode(self, mode: str):
+        if mode not in self._modes:
+            self._modes[mode] = ModeGraph(self, mode)
+        return self._modes[mode]
+
+    def save(self, path: str = ROAD_GRAPH_PATH):
+        np.savez(path, lon=self.lon, lat=self.lat, u=self.u, v=self.v, highway=self.highway,
+                 oneway=self.oneway, maxspeed=self.maxspeed, length=self.length)
+        return path
+
+    @classmethod
+    def load(cls, path: str = ROAD_GRAPH_PATH):
+        '''Compact .npz graph, or an OSM XML extract parsed on the fly.'''
+        if os.path.splitext(path)[1] == '.npz':
+            with np.load(path) as data:
+                return cls(**{name: data[name] for name in data.files})
+        return cls.from_osm(path)
+
+    @classmethod
+    def from_osm(cls, path: str):
+        '''Parse the highways of an OSM XML extract. Convert .pbf files first, e.g.
+        osmium cat extract.osm.pbf -o extract.osm
+
+        Two passes, so only the coordinates of nodes on highways are kept: the ways
+        first, then the nodes they reference.'''
+        ways = []
+        for element in osm_elements(path, 'way'):
+            tags = {t.get('k'): t.get('v') for t in element.iter('tag')}
+            if tags.get('highway') in HIGHWAY_CLASSES:
+                ways.append(([int(n.get('ref')) for n in element.iter('nd')], tags))
+        needed = {ref for refs, _ in ways for ref in refs}
+        coords = {}
+        for element in osm_elements(path, 'node'):
+            node = int(element.get('id'))
+            if node in needed:
+                coords[node] = (float(element.get('lon')), float(element.get('lat')))
+
+        ids = {}
+        u, v, highway, oneway, maxspeed = [], [], [], [], []
+        for refs, tags in ways:
+            refs = [r for r in refs if r in coords]
+            for a, b in zip(refs[:-1], refs[1:]):
+                u.append(ids.setdefault(a, len(ids)))
+                v.append(ids.setdefault(b, len(ids)))
+            count = max(len(refs) - 1, 0)
+            highway.extend([HIGHWAY_CLASSES.index(tags['highway'])] * count)
+            oneway.extend([oneway_direction(tags)] * count)
+            maxspeed.extend([parse_maxspeed(tags.get('maxspeed'))] * count)
+        lon, lat = np.array([coords[i] for i in ids], dtype=np.float64).reshape(-1, 2).T
+        return cls(lon, lat, u, v, highway, oneway, maxspeed)
+
+    @staticmethod
+    def corridor(x0, y0, x1, y1, metres: float, denoise: float = 1):
+        '''Polygon within metres of the segments (x0, y0) -> (x1, y1), holes filled. Drawn
+        on a raster of CORRIDOR_CELLS cells per corridor width: GEOS buffering tens of
+        thousands of crossing street segments takes minutes, the raster milliseconds.'''
+        cell = metres / CORRIDOR_CELLS
+        left, bottom = min(x0.min(), x1.min()) - metres, min(y0.min(), y1.min()) - metres
+        x0, y0 = (x0 - left) / cell, (y0 - bottom) / cell
+        dx, dy = (x1 - left) / cell - x0, (y1 - bottom) / cell - y0
+        # Cells under points about a cell apart along each segment, its start and end included
+        steps = np.maximum(np.ceil(np.hypot(dx, dy) - 0.1), 1).astype(int)
+        segment = np.repeat(np.arange(len(steps)), steps)
+        t = (np.arange(1, steps.sum() + 1) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+        cols = np.concatenate((x0, x0[segment] + t * dx[segment])).astype(np.intp)
+        rows = np.concatenate((y0, y0[segment] + t * dy[segment])).astype(np.intp)
+        grid = np.zeros((rows.max() + CORRIDOR_CELLS + 1, cols.max() + CORRIDOR_CELLS + 1), dtype=bool)
+        grid[rows, cols] = True
+        offsets = np.mgrid[-CORRIDOR_CELLS:CORRIDOR_CELLS + 1, -CORRIDOR_CELLS:CORRIDOR_CELLS + 1]
+        grid = ndimage.binary_dilation(grid, structure=np.hypot(*offsets) <= CORRIDOR_CELLS)
+        labels, _ = ndimage.label(grid)
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        grid = ndimage.binary_fill_holes((sizes >= denoise * sizes.max())[labels] & grid)
+
+        # One rectangle per run of filled cells along each row
+        edges = np.diff(np.pad(grid, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        rows, first = np.nonzero(edges == 1)
+        _, last = np.nonzero(edges == -1)
+        boxes = shapely.box(left + first * cell, bottom + rows * cell,
+                            left + last * cell, bottom + (rows + 1) * cell)
+        return shapely.union_all(boxes)
+
+    def catchment(self, lon: float, lat: float, mode: str, minutes: float, generalize: float = 50, denoise: float = 1):
+        '''Area reachable within minutes as a lon/lat shapely geometry, or None.
+
+        Bounded multi-source Dijkstra from the nodes around the origin, then the reached
+        stretches of road widened into a corridor. generalize is a simplification
+        tolerance in metres and denoise drops parts smaller than that fraction of the
+        largest, as in the Mapbox API.'''
+        graph = self.mode(mode)
+        limit = minutes * 60
+        x, y = gpd.GeoSeries.from_xy([lon], [lat], crs=4326).to_crs(AREA_CRS).iloc[0].coords[0]
+        times = graph.travel_times(graph.sources(x, y), limit)
+
+        start = times[graph.edge_sources]
+        reached = start <= limit
+        if not reached.any():
+            return None
+        fraction = np.minimum(1, (limit - start[reached]) / graph.edge_seconds[reached])
+        a, b = graph.edge_sources[reached], graph.edge_targets[reached]
+        # Walk each reached edge as far as the remaining time allows
+        x0, y0 = self.x[a], self.y[a]
+        x1 = x0 + fraction * (self.x[b] - x0)
+        y1 = y0 + fraction * (self.y[b] - y0)
+        area = self.corridor(x0, y0, x1, y1, CORRIDOR_METRES[mode], denoise)
+        if generalize:
+            area = area.simplify(generalize, preserve_topology=True)
+        return gpd.GeoSeries([area], crs=AREA_CRS).to_crs(4326).iloc[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert an OSM XML extract to the compact road graph.')
+    parser.add_argument('path', help='OSM XML extract')
+    parser.add_argument('--output', default=ROAD_GRAPH_PATH)
+    args = parser.parse_args()
+    graph = RoadGraph.from_osm(args.path)
+    print(f'Wrote {graph.nodes:,} nodes and {graph.edges:,} edges to {graph.save(args.output)}')
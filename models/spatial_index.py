@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+POLYGON_TYPES = ('Polygon', 'MultiPolygon')
+# British National Grid, for areas in square metres
+AREA_CRS = 27700
+
+def clip_pairs(layer_geometry, area_geometry, crs, areas: bool = False):
+    '''Pairwise intersection of layer features with area geometries. With areas, also
+    returns the projected area of each clipped piece.'''
+    geometry = gpd.GeoSeries(layer_geometry, crs=crs).intersection(gpd.GeoSeries(area_geometry, crs=crs))
+    geometry = gpd.GeoSeries(polygon_parts(np.asarray(geometry.values)), crs=crs)
+    clipped = geometry.to_crs(AREA_CRS).area.to_numpy() if areas else None
+    return geometry.values, clipped
+
+def polygon_parts(geometry):
+    '''Polygons of any GeometryCollection among clipped geometries, merged, as gpd.overlay
+    keeps them. An edge shared with the area comes back as a line alongside the polygon.'''
+    geometry = np.array(geometry, dtype=object)
+    for i in np.flatnonzero(shapely.get_type_id(geometry) == 7):
+        parts = shapely.get_parts(geometry[i])
+        geometry[i] = shapely.union_all(parts[np.isin(shapely.get_type_id(parts), (3, 6))])
+    return geometry
+
+class LayerIndex():
+    '''Reusable spatial index over a polygon layer (wards, price hexes).
+
+    overlay() gives the same rows and columns as
+    gpd.overlay(area, layer, how='intersection') but only clips the features
+    whose bounding boxes the STRtree reports as intersecting.'''
+    def __init__(self, layer: gpd.GeoDataFrame):
+        self.layer = layer
+        self.crs = layer.crs
+        self.attributes = layer.drop(columns=layer.geometry.name)
+        # Build the tree up front so the first search doesn't pay for it
+        self.sindex = layer.sindex
+        self._areas = None
+
+    def areas(self):
+        '''Projected area of every layer feature, computed once.'''
+        if self._areas is None:
+            self._areas = self.layer.geometry.to_crs(AREA_CRS).area.to_numpy()
+        return self._areas
+
+    def candidates(self, geometry):
+        '''Positions of layer features sharing some interior with geometry. Features that
+        only touch it along an edge or at a corner aren't members, as in gpd.overlay.'''
+        hits = self.sindex.query(geometry, predicate='intersects')
+        shapely.prepare(geometry)
+        hits = hits[~shapely.touches(geometry, np.asarray(self.layer.geometry.values[hits]))]
+        return np.sort(hits)
+
+    def members(self, area: gpd.GeoDataFrame):
+        '''Positions of layer features overlapping each area row, as (area_pos, layer_pos) arrays.'''
+        if self.crs is not None and area.crs is not None and area.crs != self.crs:
+            area = area.to_crs(self.crs)
+        left, right = [], []
+        for i, geometry in enumerate(area.geometry):
+            if geometry is None or geometry.is_empty:
+                continue
+            hits = self.candidates(geometry)
+            left.append(np.full(len(hits), i))
+            right.append(hits)
+        if not left:
+            return np.array([], dtype=int), np.array([], dtype=int)
+        return np.concatenate(left), np.concatenate(right)
+
+    def intersect(self, area_geometry, left, right, areas: bool = False):
+        '''Clip the layer features at positions right by area_geometry[left].'''
+        return clip_pairs(self.layer.geometry.values[right], area_geometry[left], self.crs, areas=areas)
+
+    def clip_members(self, area_geometry, left, right, inside, areas: bool = False):
+        '''intersect() for pairs not flagged inside; features known to lie inside their
+        area are passed through whole.'''
+        geometry = np.empty(len(right), dtype=object)
+        clipped = np.empty(len(right), dtype=np.float64) if areas else None
+        edge = ~inside
+        geometry[edge], edge_areas = self.intersect(area_geometry, left[edge], right[edge], areas=areas)
+        geometry[inside] = np.asarray(self.layer.geometry.values[right[inside]])
+        if areas:
+            clipped[edge] = edge_areas
+            clipped[inside] = self.areas()[right[inside]]
+        return geometry, clipped
+
+    def overlay(self, area: gpd.GeoDataFrame, clip: bool = True, fractions: bool = False, members=None):
+        '''Intersect area with the layer. With clip=False whole layer features are returned
+        for every member, which is enough when only membership matters. fractions adds an
+        overlap_fraction column: the share of each layer feature's area inside the area,
+        measured on the intersection whether or not the features are clipped.
+        members is an optional precomputed (area_pos, layer_pos, inside) triple, as from
+        CatchmentStore.members, used instead of querying the tree.'''
+        if self.crs is not None and area.crs is not None and area.crs != self.crs:
+            area = area.to_crs(self.crs)
+        if members is None:
+            left, right = self.members(area)
+            inside = None
+        else:
+            left, right, inside = members
+        clipped = None
+        # Unclipped fractions still need the intersections, only to measure them
+        if (clip or fractions) and inside is not None and inside.any():
+            geometry, clipped = self.clip_members(area.geometry.values, left, right, inside, areas=fractions)
+        elif clip or fractions:
+            geometry, clipped = self.intersect(area.geometry.values, left, right, areas=fractions)
+        if not clip:
+            geometry = self.layer.geometry.values[right]
+        geometry = gpd.GeoSeries(geometry, crs=self.crs)
+
+        keep = (~geometry.is_empty & geometry.geom_type.isin(POLYGON_TYPES)).to_numpy()
+        area_attributes = area.drop(columns=area.geometry.name).iloc[left[keep]].reset_index(drop=True)
+        layer_attributes = self.attributes.iloc[right[keep]].reset_index(drop=True)
+        shared = area_attributes.columns.intersection(layer_attributes.columns)
+        area_attributes = area_attributes.rename(columns={c: f'{c}_1' for c in shared})
+        layer_attributes = layer_attributes.rename(columns={c: f'{c}_2' for c in shared})
+        result = pd.concat([area_attributes, layer_attributes], axis=1)
+        result['geometry'] = geometry.values[keep]
+        if fractions:
+            result['overlap_fraction'] = np.clip(clipped[keep] / self.areas()[right[keep]], 0, 1)
+        return gpd.GeoDataFrame(result, geometry='geometry', crs=self.crs)
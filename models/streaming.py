@@ -0,0 +1,164 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from .hexbin import HexBinner, DEFAULT_RESOLUTION, coords_to_cells
+from .datastore import write_hex_layer
+
+SALES_COLUMNS = ['latitude', 'longitude', 'AMOUNT']
+# Log-spaced price bins, ~1.2% wide, from £1k to £100M. Sales outside are clamped to the end bins.
+HISTOGRAM_EDGES = np.geomspace(1e3, 1e8, 1001)
+
+def iter_sales(path: str, chunksize: int = 1000000):
+    '''Yield sales in chunks from a price-paid CSV or the prepared parquet file.'''
+    if os.path.splitext(path)[1] == '.parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=SALES_COLUMNS):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=SALES_COLUMNS, chunksize=chunksize)
+
+class RunningMoments():
+    '''Count, mean and variance merged chunk by chunk (Chan et al. parallel update).'''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def three_sigma(self):
+        return self.mean + 3 * self.std
+
+class StreamingHexAggregator():
+    '''Per-cell aggregates built chunk by chunk, so memory grows with the number of
+    occupied cells rather than the number of sales.
+
+    Each cell keeps a sparse price histogram (count and sum per bin). Counts and totals
+    are exact; medians are interpolated within a ~1.2% wide bin. The mean + 3 sigma
+    outlier filter is exact when given a threshold from a first pass, otherwise it is
+    applied at bin granularity after the single pass.'''
+    def __init__(self,
+                 resolution: int = DEFAULT_RESOLUTION,
+                 count_cutoff: int = 10,
+                 threshold: float = None,
+                 edges: np.ndarray = HISTOGRAM_EDGES,
+                 crs: int = 4326):
+        self.resolution = resolution
+        self.count_cutoff = count_cutoff
+        self.threshold = threshold
+        self.edges = edges
+        self.crs = crs
+        self.moments = RunningMoments()
+        self.state = None
+
+    def update(self, chunk: pd.DataFrame):
+        amounts = chunk['AMOUNT'].to_numpy(dtype=np.float64)
+        self.moments.update(amounts)
+        keep = amounts < self.threshold if self.threshold is not None else np.ones(len(amounts), dtype=bool)
+        cells = coords_to_cells(chunk['latitude'].to_numpy()[keep], chunk['longitude'].to_numpy()[keep], self.resolution)
+        amounts = amounts[keep]
+        bins = np.clip(np.searchsorted(self.edges, amounts, side='right') - 1, 0, len(self.edges) - 2)
+        part = (pd.DataFrame({'cell': cells, 'bin': bins.astype(np.int16), 'count': 1, 'total': amounts})
+                  .groupby(['cell', 'bin'])[['count', 'total']].sum())
+        self.state = part if self.state is None else self.state.add(part, fill_value=0)
+        return self
+
+    def consume(self, chunks):
+        for chunk in chunks:
+            self.update(chunk)
+        return self
+
+    def histograms(self):
+        if self.state is None:
+            # Nothing consumed: an empty file or no chunks at all
+            return pd.DataFrame({'cell': np.array([], dtype=np.uint64), 'bin': np.array([], dtype=np.int16),
+                                 'count': np.array([], dtype=np.int64), 'total': np.array([], dtype=np.float64)})
+        state = self.state.reset_index()
+        if self.threshold is None:
+            # Single pass: drop whole bins above the global threshold
+            state = state[self.edges[state['bin'].to_numpy()] < self.moments.three_sigma()]
+        return state.sort_values(['cell', 'bin'], kind='mergesort').reset_index(drop=True)
+
+    def values_at_rank(self, state: pd.DataFrame, starts: np.ndarray, cumulative: np.ndarray, ranks: np.ndarray):
+        '''Estimate the sale at a 1-based rank within each cell from its histogram.'''
+        counts = state['count'].to_numpy(dtype=np.float64)
+        bins = state['bin'].to_numpy()
+        sizes = np.diff(np.append(starts, len(state)))
+        # First bin in each cell whose cumulative count reaches the rank
+        reached = np.flatnonzero(cumulative >= np.repeat(ranks, sizes))
+        first = reached[np.searchsorted(reached, starts)]
+        fraction = (ranks - (cumulative[first] - counts[first]) - 0.5) / counts[first]
+        lower = self.edges[bins[first]]
+        upper = self.edges[bins[first] + 1]
+        estimate = lower * (upper / lower) ** fraction
+        # A bin holding a single sale knows its exact amount
+        single = counts[first] == 1
+        estimate[single] = state['total'].to_numpy()[first][single]
+        return estimate
+
+    def medians(self, state: pd.DataFrame):
+        if not len(state):
+            return np.array([], dtype=np.float64)
+        cells = state['cell'].to_numpy()
+        counts = state['count'].to_numpy(dtype=np.float64)
+        starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+        totals = np.add.reduceat(counts, starts)
+        running = np.cumsum(counts)
+        offsets = running[starts] - counts[starts]
+        cumulative = running - np.repeat(offsets, np.diff(np.append(starts, len(cells))))
+        lower = self.values_at_rank(state, starts, cumulative, np.floor((totals + 1) / 2))
+        upper = self.values_at_rank(state, starts, cumulative, np.ceil((totals + 1) / 2))
+        return (lower + upper) / 2
+
+    def result(self, return_geo_df: bool = True):
+        state = self.histograms()
+        grouped = state.groupby('cell', sort=True)[['count', 'total']].sum()
+        cells = grouped.index.to_numpy(dtype=np.uint64)
+        counts = grouped['count'].to_numpy(dtype=np.int64)
+        totals = grouped['total'].to_numpy(dtype=np.float64)
+        binner = HexBinner(resolutions=self.resolution, count_cutoff=self.count_cutoff, crs=self.crs)
+        return binner.frame(cells, totals / counts, self.medians(state), totals, counts,
+                            return_geo_df=return_geo_df, resolution=self.resolution)
+
+def stream_h3(path: str,
+              resolution: int = DEFAULT_RESOLUTION,
+              count_cutoff: int = 10,
+              chunksize: int = 1000000,
+              two_pass: bool = True):
+    '''Bin a price-paid file of any length into H3 cells. two_pass reads the file twice so
+    the outlier filter matches PricesPaid exactly; otherwise it is approximate.'''
+    threshold = None
+    if two_pass:
+        moments = RunningMoments()
+        for chunk in iter_sales(path, chunksize):
+            moments.update(chunk['AMOUNT'].to_numpy())
+        threshold = moments.three_sigma()
+    aggregator = StreamingHexAggregator(resolution=resolution, count_cutoff=count_cutoff, threshold=threshold)
+    return aggregator.consume(iter_sales(path, chunksize)).result()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream a price-paid file into the compact hex layer.')
+    parser.add_argument('path', help='Price-paid CSV or parquet file')
+    parser.add_argument('--chunksize', type=int, default=1000000)
+    parser.add_argument('--resolution', type=int, default=DEFAULT_RESOLUTION)
+    parser.add_argument('--single-pass', action='store_true', help='Approximate the outlier filter in one pass')
+    args = parser.parse_args()
+    h3_df = stream_h3(args.path, resolution=args.resolution, chunksize=args.chunksize, two_pass=not args.single_pass)
+    print(f'Wrote {len(h3_df):,} hexes to {write_hex_layer(h3_df)}')
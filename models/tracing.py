@@ -0,0 +1,164 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('geocoder.tracing')
+if os.environ.get('TRACE_LOG') == '1':
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+# Upper bounds in seconds for the latency histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class Span():
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.bytes = 0
+        self.rows = None
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def add(self, bytes: int = 0, rows: int = None, **attributes):
+        self.bytes += bytes
+        if rows is not None:
+            self.rows = rows
+        self.attributes.update(attributes)
+        return self
+
+    def to_dict(self):
+        return {'span': self.name, 'seconds': round(self.seconds, 6), 'bytes': self.bytes,
+                'rows': self.rows, 'error': self.error, **self.attributes}
+
+class Trace():
+    '''Spans recorded while handling one request (a search, a restyle, a batch run).'''
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def to_records(self):
+        return [span.to_dict() for span in self.spans]
+
+class StageMetrics():
+    '''Per-stage counters and latency histograms, rendered in Prometheus text format.'''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, span: Span):
+        with self.lock:
+            stage = self.stages.setdefault(span.name, {'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0,
+                                                       'rows': 0, 'buckets': [0] * len(self.buckets)})
+            stage['count'] += 1
+            stage['errors'] += span.error is not None
+            stage['seconds'] += span.seconds
+            stage['bytes'] += span.bytes
+            stage['rows'] += span.rows or 0
+            for i, bound in enumerate(self.buckets):
+                if span.seconds <= bound:
+                    stage['buckets'][i] += 1
+
+    def render(self):
+        lines = ['# HELP geocoder_stage_seconds Wall time per pipeline stage.',
+                 '# TYPE geocoder_stage_seconds histogram']
+        with self.lock:
+            stages = {k: dict(v, buckets=list(v['buckets'])) for k, v in self.stages.items()}
+        for name, stage in sorted(stages.items()):
+            for bound, count in zip(self.buckets, stage['buckets']):
+                lines.append(f'geocoder_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'geocoder_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'geocoder_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f'geocoder_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        for metric, help_text in (('errors', 'Failed stage executions.'),
+                                  ('bytes', 'Bytes fetched per stage.'),
+                                  ('rows', 'Rows produced per stage.')):
+            lines.append(f'# HELP geocoder_stage_{metric}_total {help_text}')
+            lines.append(f'# TYPE geocoder_stage_{metric}_total counter')
+            for name, stage in sorted(stages.items()):
+                lines.append(f'geocoder_stage_{metric}_total{{stage="{name}"}} {stage[metric]}')
+        return '\n'.join(lines) + '\n'
+
+class Tracer():
+    def __init__(self):
+        self.metrics = StageMetrics()
+        self.metrics_path = os.environ.get('METRICS_PATH')
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        trace = Trace(name, **attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.seconds = time.perf_counter() - trace.start
+            _current_trace.reset(token)
+            logger.info(json.dumps({'trace': name, 'seconds': round(trace.seconds, 6),
+                                    **attributes, 'spans': trace.to_records()}, default=str))
+            if self.metrics_path:
+                self.write_metrics(self.metrics_path)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.seconds = time.perf_counter() - span.start
+            self.metrics.observe(span)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.spans.append(span)
+            logger.debug(json.dumps(span.to_dict(), default=str))
+
+    def current_trace(self):
+        return _current_trace.get()
+
+    def write_metrics(self, path: str):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.metrics.render())
+        os.replace(tmp, path)
+
+    def serve_metrics(self, port: int = 9100):
+        '''Serve /metrics in Prometheus text format from a background thread.'''
+        metrics = self.metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+tracer = Tracer()
+span = tracer.span
+
+def map_in_context(pool, func, items):
+    '''pool.map with each call run in a copy of the caller's context. Pool threads don't
+    inherit contextvars, so spans opened in them would otherwise miss the current trace.'''
+    futures = [pool.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]
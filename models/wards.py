@@ -0,0 +1,141 @@
+import json
+import os
+import argparse
+from datetime import datetime
+import pandas as pd
+import geopandas as gpd
+import requests
+
+from .parallel import layer_index
+from .tracing import span
+
+# 2020 BFE wards
+WARDS_URL = 'https://services1.arcgis.com/ESMARspQHYMw9BZ9/arcgis/rest/services/Wards_December_2020_UK_BFE_V2_2022/FeatureServer/0/query?outFields=*&where=1%3D1&f=geojson'
+WARD_POP_PATH = 'data/wards/ward_population_projections_full_2019.csv'
+WARD_STORE_PATH = 'data/wards/wards.parquet'
+# Bump when the stored layout changes so existing files are rebuilt
+WARD_LAYER_VERSION = 1
+
+def load_ward_population(path: str = WARD_POP_PATH):
+    ward_pop = pd.read_csv(path).iloc[:,1:]
+    return ward_pop.drop(columns=['wd20nm'])
+
+def fetch_ward_boundaries(source: str = WARDS_URL, crs: int = 4326):
+    '''Ward boundaries from the ArcGIS endpoint or a local GeoJSON file.'''
+    if os.path.exists(source):
+        with open(source) as f:
+            data = json.load(f)
+    else:
+        data = requests.get(source).json()
+    ward_shp = gpd.GeoDataFrame.from_features(data['features']).set_crs(epsg=crs)
+    ward_shp.rename(columns={'WD20CD':'wd20cd', 'WD20NM':'wd20nm'}, inplace=True)
+    return ward_shp.iloc[:, :4]
+
+def merge_wards(wards_shp: gpd.GeoDataFrame, wards_pop: pd.DataFrame):
+    gdf = wards_shp.merge(wards_pop, on='wd20cd', how='left')
+    gdf = gdf[(gdf.country == 'England') | (gdf.country == 'Wales')]
+    return gdf.rename(columns={'wd20cd':'Ward Code','wd20nm':'Ward Name'}).reset_index(drop=True)
+
+class WardStore():
+    '''England and Wales wards with population, persisted as GeoParquet.
+
+    The layer is fetched once and read back lazily; a sidecar JSON file records
+    the layer version, source and population file so stale copies are rebuilt.'''
+    def __init__(self,
+                 path: str = WARD_STORE_PATH,
+                 source: str = None,
+                 population_path: str = WARD_POP_PATH,
+                 version: int = WARD_LAYER_VERSION,
+                 crs: int = 4326):
+        self.path = path
+        self.meta_path = f'{os.path.splitext(path)[0]}.json'
+        self.source = source or os.environ.get('WARDS_SOURCE', WARDS_URL)
+        self.population_path = population_path
+        self.version = version
+        self.crs = crs
+        self._wards = None
+        self._index = None
+
+    def expected_meta(self):
+        return {'version': self.version,
+                'source': self.source,
+                'population_mtime': os.path.getmtime(self.population_path)}
+
+    def stored_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def is_current(self):
+        meta = self.stored_meta()
+        if meta is None or not os.path.exists(self.path):
+            return False
+        expected = self.expected_meta()
+        return all(meta.get(k) == v for k, v in expected.items())
+
+    def layer_id(self):
+        '''Layout version and build time of the stored layer, so data derived from it can
+        tell when it has been rebuilt.'''
+        meta = self.stored_meta() or {}
+        return f'{self.version}:{meta.get("built")}'
+
+    def build(self, wards_shp: gpd.GeoDataFrame = None):
+        if wards_shp is None:
+            wards_shp = fetch_ward_boundaries(self.source, crs=self.crs)
+        wards = merge_wards(wards_shp, load_ward_population(self.population_path))
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        wards.to_parquet(self.path, index=False)
+        meta = self.expected_meta()
+        meta['built'] = datetime.now().isoformat()
+        meta['rows'] = len(wards)
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f)
+        self._wards = wards
+        self._index = None
+        return wards
+
+    def load(self):
+        if self._wards is None:
+            with span('ward_load') as s:
+                if self.is_current():
+                    self._wards = gpd.read_parquet(self.path, memory_map=True)
+                    s.add(source='file')
+                else:
+                    self.build()
+                    s.add(source='download')
+                s.add(rows=len(self._wards))
+        return self._wards
+
+    def index(self):
+        if self._index is None:
+            self._index = layer_index(self.load())
+        return self._index
+
+    def invalidate(self):
+        self._wards = None
+        self._index = None
+        for path in (self.path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+_default_store = None
+
+def ward_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = WardStore()
+    return _default_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the cached ward boundary layer.')
+    parser.add_argument('--source', default=None, help='ArcGIS query URL or local GeoJSON file')
+    parser.add_argument('--path', default=WARD_STORE_PATH)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+    store = WardStore(path=args.path, source=args.source)
+    if args.force or not store.is_current():
+        wards = store.build()
+        print(f'Wrote {len(wards):,} wards to {store.path}')
+    else:
+        print(f'{store.path} is current')
@@ -0,0 +1,67 @@
+import time
+import pytest
+import requests
+
+from benchmarks.stub_server import StubServer, address_point
+from models.cache import LRUCache
+from models.geocoding import Geocoder
+from models.http import get_with_backoff
+from models.tracing import tracer
+
+ADDRESSES = ['1 High Street, Leeds', '2 Mill Lane, York', ' 1 high street,  leeds', '3 Station Road, Hull']
+
+@pytest.fixture
+def server(monkeypatch):
+    with StubServer() as server:
+        monkeypatch.setenv('MAPBOX_API_URL', server.url)
+        yield server
+
+def test_geocode_many_keeps_order_and_fetches_repeats_once(server):
+    result = Geocoder.geocode_many(ADDRESSES, max_workers=4, cache=LRUCache())
+    assert list(result['address']) == ADDRESSES
+    assert result['error'].isna().all()
+    for address, point in zip(ADDRESSES, result.geometry):
+        # The stub places an address by its text, so a repeat shows where its point came from
+        expected = address_point(ADDRESSES[0] if address == ADDRESSES[2] else address)
+        assert (point.x, point.y) == pytest.approx(expected)
+    assert len(server.calls) == 3
+
+def test_isochrone_many_reports_errors_per_row(server):
+    cache = LRUCache()
+    Geocoder(ADDRESSES[0], cache=cache).geocode_address()
+    server.error_status = 404
+    result = Geocoder.isochrone_many(ADDRESSES[:2], minutes=[10, 20], max_workers=2, cache=cache)
+    assert list(result['minutes']) == [10, 20]
+    # The first address geocodes from the cache and fails at the isochrone, the second at the geocode
+    assert result['error'].str.startswith('HTTPError: 404').all()
+    assert result.geometry.isna().all()
+    assert result['lon'].notna().tolist() == [True, False]
+
+def test_backoff_retries_rate_limited_requests(server):
+    url = f'{server.url}/geocoding/v5/mapbox.places/York.json'
+    server.rate_limit = 1
+    with pytest.raises(requests.HTTPError, match='429'):
+        get_with_backoff(url, retries=2)
+    assert len(server.calls) == 3
+
+    server.rate_limit = 0.1
+    addresses = [f'{n} Church Street, Bath' for n in range(40)]
+    result = Geocoder.geocode_many(addresses, max_workers=8, cache=LRUCache())
+    assert result['error'].isna().all()
+    assert len(server.calls) > 3 + len(addresses)
+
+def test_stalled_requests_time_out_into_the_error_column(monkeypatch):
+    with StubServer(latency=2) as server:
+        monkeypatch.setenv('MAPBOX_API_URL', server.url)
+        monkeypatch.setenv('HTTP_TIMEOUT', '0.1')
+        start = time.perf_counter()
+        result = Geocoder.geocode_many(ADDRESSES, max_workers=4, cache=LRUCache())
+        assert time.perf_counter() - start < 1
+    assert result['error'].str.contains('Timeout').all()
+    assert result.geometry.isna().all()
+
+def test_batch_spans_join_the_callers_trace(server):
+    with tracer.trace('portfolio') as trace:
+        Geocoder.isochrone_many(ADDRESSES, minutes=10, max_workers=4, cache=LRUCache())
+    names = [span.name for span in trace.spans]
+    assert names.count('geocode') == 3 and names.count('isochrone') == 3
@@ -0,0 +1,85 @@
+import pytest
+import requests
+
+from benchmarks.stub_server import StubServer
+from models.cache import LRUCache, SQLiteCache, TieredCache
+from models.geocoding import Geocoder
+from models.isochrones import MapboxIsochrones
+
+ADDRESS = '10 Downing Street, London'
+
+@pytest.fixture
+def server(monkeypatch):
+    with StubServer() as server:
+        monkeypatch.setenv('MAPBOX_API_URL', server.url)
+        yield server
+
+def search(address, cache):
+    '''A dashboard search: geocode the address, then the isochrone around it.'''
+    return Geocoder(address, cache=cache, provider=MapboxIsochrones()).isochrone('driving', 30)
+
+def test_repeat_and_restyle_searches_make_no_calls(server):
+    cache = LRUCache()
+    area, origin = search(ADDRESS, cache)
+    assert len(server.calls) == 2
+    # A restyle repeats the search as typed; a repeat may differ in case and spacing
+    for address in (ADDRESS, '  10 downing street ,london '):
+        again, again_origin = search(address, cache)
+        assert again_origin == origin
+        assert again.geometry.iloc[0].equals(area.geometry.iloc[0])
+    assert len(server.calls) == 2
+    assert cache.stats() == {'hits': 4, 'misses': 2, 'size': 2}
+
+def test_disk_cache_outlives_the_process_cache(server, tmp_path):
+    path = str(tmp_path / 'geocoder.db')
+    search(ADDRESS, TieredCache(disk=SQLiteCache(path)))
+    cache = TieredCache(disk=SQLiteCache(path))
+    search(ADDRESS, cache)
+    assert len(server.calls) == 2
+    assert cache.stats()['disk']['hits'] == 2
+
+def test_error_responses_are_not_cached(server):
+    cache = LRUCache()
+    server.error_status = 401
+    with pytest.raises(requests.HTTPError):
+        search(ADDRESS, cache)
+    assert len(cache) == 0
+
+    server.error_status = None
+    Geocoder(ADDRESS, cache=cache).geocode_address()
+    server.error_status = 422
+    with pytest.raises(requests.HTTPError):
+        search(ADDRESS, cache)
+    assert len(cache) == 1
+
+    server.error_status = None
+    search(ADDRESS, cache)
+    # Only the failed isochrone is fetched again, the geocode comes from the cache
+    assert len(server.calls) == 4
+    assert len(cache) == 2
+
+def test_unmatched_addresses_are_not_cached(server):
+    cache = LRUCache()
+    server.no_match = True
+    assert Geocoder(ADDRESS, cache=cache).geocode_json()['features'] == []
+    assert len(cache) == 0
+    server.no_match = False
+    Geocoder(ADDRESS, cache=cache).geocode_address()
+    assert len(server.calls) == 2 and len(cache) == 1
+
+def test_lru_eviction_and_expiry():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1
+    cache.set('d', 4, ttl=-1)
+    assert cache.get('d') is None
+
+def test_zero_ttl_expires_at_once(tmp_path):
+    for cache in (LRUCache(), SQLiteCache(str(tmp_path / 'cache.db')), LRUCache(ttl=60)):
+        cache.set('a', 1, ttl=0)
+        assert cache.get('a') is None
+        cache.set('b', 2)
+        assert cache.get('b') == 2
@@ -0,0 +1,140 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+import pytest
+
+from benchmarks.stub_server import StubServer, address_point
+from benchmarks.suite import REPO_ROOT, synthetic_ward_features
+from models.cache import LRUCache
+from models import mapping, portfolio
+from models.catchments import CatchmentStore, CATCHMENT_GENERALIZE, METRES_PER_DEGREE
+from models.hexbin import cell_polygons
+from models.spatial_index import LayerIndex
+from models.wards import WardStore, WARD_POP_PATH
+
+ADDRESS = '10 Downing Street, London'
+# Where the stub geocodes ADDRESS, so a Mapper search for it starts at the stored origin
+ORIGIN = address_point(ADDRESS)
+
+@pytest.fixture
+def server(monkeypatch):
+    with StubServer() as server:
+        monkeypatch.setenv('MAPBOX_API_URL', server.url)
+        monkeypatch.delenv('ISOCHRONE_PROVIDER', raising=False)
+        yield server
+
+@pytest.fixture
+def wards(tmp_path):
+    source = tmp_path / 'wards.geojson'
+    source.write_text(json.dumps(synthetic_ward_features(step=0.2)))
+    return WardStore(path=str(tmp_path / 'wards.parquet'), source=str(source),
+                     population_path=os.path.join(REPO_ROOT, WARD_POP_PATH))
+
+def hex_index(k: int):
+    '''Price hexes at resolution 7 within k rings of the origin.'''
+    cells = sorted(h3.k_ring(h3.geo_to_h3(ORIGIN[1], ORIGIN[0], 7), k))
+    layer = gpd.GeoDataFrame({'H3_cell': cells, 'mean_price': 300000.0, 'median_price': 250000.0,
+                              'total_paid': 6000000, 'count': 20}, geometry=cell_polygons(cells), crs=4326)
+    return LayerIndex(layer)
+
+@pytest.fixture
+def store(server, wards, tmp_path):
+    store = CatchmentStore(path=str(tmp_path / 'catchments'), wards=wards)
+    store.build(pd.DataFrame({'lon': [ORIGIN[0]], 'lat': [ORIGIN[1]]}), wards.index(), hex_index(5),
+                modes=['driving'], minutes=[20], cache=LRUCache())
+    return store
+
+def test_store_serves_default_searches_until_the_wards_change(store, wards):
+    # Built with the dashboard's default specificity, so a default search finds it
+    tile = store.lookup(*ORIGIN, 'driving', 20)
+    assert tile is not None and len(tile.members('wards')[0]) > 0
+    assert store.lookup(*ORIGIN, 'driving', 20, generalize=50) is None
+
+    wards.build()
+    assert store.lookup(*ORIGIN, 'driving', 20) is None
+
+def test_tiles_only_serve_searches_from_their_provider(store, monkeypatch):
+    assert store.lookup(*ORIGIN, 'driving', 20).provider == 'mapbox'
+    assert store.lookup(*ORIGIN, 'driving', 20, provider='local') is None
+    monkeypatch.setenv('ISOCHRONE_PROVIDER', 'local')
+    assert store.lookup(*ORIGIN, 'driving', 20) is None
+
+def test_hex_membership_is_only_used_with_the_layer_it_was_built_from(store):
+    tile = store.lookup(*ORIGIN, 'driving', 20)
+    area = tile.isochrone()
+    same = hex_index(5)
+    left, right, inside = store.members(area, [tile], same, 'hexes')
+    assert inside.any() and np.array_equal(right, same.members(area)[1])
+
+    # A rebuilt price layer with newly populated hexes around the old ones
+    rebuilt = hex_index(12)
+    left, right, inside = store.members(area, [tile], rebuilt, 'hexes')
+    assert not inside.any() and np.array_equal(right, rebuilt.members(area)[1])
+    assert len(right) > len(same.members(area)[1])
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_stored_tiles_give_the_live_overlay(store, wards, tmp_path, monkeypatch, weighted):
+    monkeypatch.setattr(mapping, 'ward_store', lambda: wards)
+    # Mapper.overlay only asks the store for members when a tile was found
+    served, members = [], store.members
+    monkeypatch.setattr(store, 'members', lambda *args: served.append(args) or members(*args))
+    overlays = []
+    for search_store in (CatchmentStore(path=str(tmp_path / 'empty'), wards=wards), store):
+        monkeypatch.setattr(mapping, 'catchment_store', lambda: search_store)
+        overlays.append(mapping.Mapper(ADDRESS).overlay('driving', 20, 1, CATCHMENT_GENERALIZE, weighted=weighted)[0])
+    live, stored = overlays
+    assert len(served) == 1 and len(live) > 0
+    # Whole interior wards use their stored area rather than a clipped copy's, so
+    # fractions can differ in the last bits
+    exact = live.columns.drop(['geometry', 'overlap_fraction'], errors='ignore')
+    assert stored[exact].equals(live[exact])
+    assert stored.geometry.geom_equals(live.geometry).all()
+    if weighted:
+        assert np.allclose(stored['overlap_fraction'], live['overlap_fraction'])
+
+    hexes = hex_index(5)
+    tile = store.lookup(*ORIGIN, 'driving', 20)
+    area = tile.isochrone()
+    stored = hexes.overlay(area, members=store.members(area, [tile], hexes, 'hexes'))
+    live = hexes.overlay(area)
+    assert stored.drop(columns='geometry').equals(live.drop(columns='geometry'))
+    assert stored.geometry.geom_equals(live.geometry).all()
+
+def test_searches_snap_to_stored_origins_within_snap_metres(store, wards):
+    lon, lat = ORIGIN
+    def north(metres):
+        return lon, lat + metres / METRES_PER_DEGREE
+    # The default only accepts the stored origin, to the isochrone cache's ~1m precision
+    assert store.lookup(*north(0.5), 'driving', 20) is not None
+    assert store.lookup(*north(50), 'driving', 20) is None
+
+    snapping = CatchmentStore(path=store.path, snap_metres=100, wards=wards)
+    assert snapping.lookup(*north(50), 'driving', 20).tile_id == 0
+    assert snapping.lookup(*north(150), 'driving', 20) is None
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_portfolio_metrics_match_the_live_path(store, wards, tmp_path, monkeypatch, weighted):
+    baselines = {'median_price': 250000, 'mean_price': 300000,
+                 'weighted_median_price': 250000, 'weighted_mean_price': 300000}
+    # One site starts at the stored origin, the other is fetched live
+    sites = [(ADDRESS, 'driving', 20), ('1 High Street, Leeds', 'driving', 20)]
+    served, members = [], store.members
+    monkeypatch.setattr(store, 'members', lambda *args: served.append(args[-1]) or members(*args))
+    clipped, intersect = [], LayerIndex.intersect
+    monkeypatch.setattr(LayerIndex, 'intersect', lambda *args, **kwargs: clipped.append(1) or intersect(*args, **kwargs))
+    results = []
+    for search_store in (CatchmentStore(path=str(tmp_path / 'empty'), wards=wards), store):
+        monkeypatch.setattr(portfolio, 'catchment_store', lambda: search_store)
+        analysis = portfolio.PortfolioAnalysis(wards=wards.load(), prices=hex_index(5).layer, baselines=baselines,
+                                               weighted=weighted, cache=LRUCache(), price_lookup='overlay')
+        results.append(analysis.run(sites))
+    live, stored = results
+    assert served == ['wards', 'hexes'] and live.loc[0, 'wards'] > 0 and live.loc[0, 'hexes'] > 0
+    # Unweighted metrics only need membership, so nothing is clipped
+    assert bool(clipped) == weighted
+    numeric = live.select_dtypes('number').columns
+    assert stored.drop(columns=numeric).equals(live.drop(columns=numeric))
+    assert np.allclose(stored[numeric], live[numeric], equal_nan=True)
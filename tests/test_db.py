@@ -0,0 +1,29 @@
+import pytest
+
+from benchmarks.stub_server import StubServer, PostgrestHandler
+from models.db import Supabase
+
+USERS = [{'email': 'user@example.com', 'password': 'secret', 'name': 'User'}]
+
+@pytest.fixture
+def server(monkeypatch):
+    with StubServer(handler=PostgrestHandler, tables={'users': list(USERS)}) as server:
+        monkeypatch.setenv('SUPABASE_URL', server.url)
+        yield server
+
+def test_check_user_caches_lookups(server):
+    db = Supabase()
+    assert db.check_user('user@example.com') == {'email': 'user@example.com', 'password': 'secret'}
+    assert db.check_user('nobody@example.com') is False
+    db.check_user('user@example.com')
+    db.check_user('nobody@example.com')
+    assert len(server.calls) == 2
+
+def test_check_user_does_not_cache_errors(server):
+    db = Supabase()
+    server.error_status = 503
+    with pytest.raises(ValueError, match='User lookup failed'):
+        db.check_user('user@example.com')
+    assert len(db.user_cache) == 0
+    server.error_status = None
+    assert db.check_user('user@example.com')['email'] == 'user@example.com'
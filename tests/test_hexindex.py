@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+import pytest
+import shapely
+from shapely.geometry import Polygon
+
+from benchmarks.stub_server import circle
+from models.hexbin import H3_COLUMNS, HexBinner, cell_polygons
+from models.hexindex import HexIndex
+from models.registry import DatasetRegistry
+from models.spatial_index import LayerIndex
+
+LAT, LON = 51.5, -0.14
+
+@pytest.fixture(scope='module')
+def levels():
+    '''Sales around central London binned at resolutions 6 and 8.'''
+    rng = np.random.default_rng(0)
+    sales = pd.DataFrame({'latitude': rng.uniform(LAT - 0.1, LAT + 0.1, 20000),
+                          'longitude': rng.uniform(LON - 0.15, LON + 0.15, 20000),
+                          'AMOUNT': rng.lognormal(12.5, 0.6, 20000).round()})
+    return HexBinner(resolutions=[6, 8], count_cutoff=0).bin_frame(sales)
+
+@pytest.fixture(scope='module')
+def index(levels):
+    return HexIndex(levels[8])
+
+def hex_layer(cells):
+    count = np.arange(1, len(cells) + 1, dtype=float)
+    return gpd.GeoDataFrame({'H3_cell': cells, 'mean_price': 250000.0, 'median_price': 240000.0,
+                             'total_paid': count * 250000, 'count': count},
+                            geometry=cell_polygons(cells), crs=4326)[H3_COLUMNS]
+
+def test_an_empty_layer_is_rejected():
+    with pytest.raises(ValueError, match='non-empty'):
+        HexIndex(hex_layer([]))
+
+@pytest.mark.parametrize('lookup, built', [('h3', 'hex_index'), ('overlay', 'prices_index')])
+def test_warm_builds_only_the_selected_price_index(monkeypatch, lookup, built):
+    monkeypatch.setenv('PRICE_LOOKUP', lookup)
+    monkeypatch.setenv('OVERLAY_WORKERS', '1')
+    data = DatasetRegistry()
+    layer = hex_layer(sorted(h3.k_ring(h3.geo_to_h3(51.5, -0.14, 7), 2)))
+    monkeypatch.setattr(data, 'prices', lambda: layer)
+    data.warm(['price_index'])
+    assert list(data.stats) == [built]
+
+def test_rollup_matches_binning_at_the_parent_resolution(index, levels):
+    rollup = index.rollup(6).set_index('H3_cell')
+    binned = levels[6].set_index('H3_cell')
+    assert sorted(rollup.index) == sorted(binned.index)
+    rollup = rollup.loc[binned.index]
+    assert np.array_equal(rollup['count'], binned['count'])
+    assert np.allclose(rollup['total_paid'], binned['total_paid'])
+    assert np.allclose(rollup['mean_price'], binned['mean_price'])
+    children = levels[8]['H3_cell'].map(lambda c: h3.h3_to_parent(c, 6)).value_counts()
+    assert np.array_equal(rollup['hexes'], children.loc[binned.index])
+
+def test_point_and_stats_at_any_resolution(index, levels):
+    layer = levels[8].set_index('H3_cell')
+    cell = h3.geo_to_h3(LAT, LON, 8)
+    point = index.point(LAT, LON)
+    assert point['H3_cell'] == cell and point['count'] == layer.loc[cell, 'count']
+    assert point['median_price'] == pytest.approx(layer.loc[cell, 'median_price'])
+
+    # A coarser cell rolls up its hexes, a finer one looks up the hex holding it
+    coarse = index.point(LAT, LON, 6)
+    expected = levels[6].set_index('H3_cell').loc[h3.geo_to_h3(LAT, LON, 6)]
+    assert coarse['count'] == expected['count'] and coarse['total_paid'] == pytest.approx(expected['total_paid'])
+    fine = index.point(LAT, LON, 10)
+    assert fine['H3_cell'] == h3.geo_to_h3(LAT, LON, 10)
+    assert {k: fine[k] for k in ('count', 'total_paid', 'hexes')} == {k: point[k] for k in ('count', 'total_paid', 'hexes')}
+
+    stats = index.stats([int(h3.geo_to_h3(LAT, LON, r), 16) for r in (6, 8, 10)])
+    assert stats['count'].tolist() == [coarse['count'], point['count'], point['count']]
+
+def test_ring_combines_the_hexes_around_a_point(index, levels):
+    layer = levels[8].set_index('H3_cell')
+    ring = layer.loc[layer.index.intersection(list(h3.k_ring(h3.geo_to_h3(LAT, LON, 8), 2)))]
+    combined = index.ring(LAT, LON, 2)
+    assert combined['hexes'] == len(ring) and combined['count'] == ring['count'].sum()
+    assert combined['total_paid'] == pytest.approx(ring['total_paid'].sum())
+
+def test_overlay_membership_matches_the_unclipped_layer_overlay(index, levels):
+    # A catchment-like circle, and a patch of whole hexes whose neighbours only touch it
+    patch = [Polygon(h3.h3_to_geo_boundary(c, True)) for c in h3.k_ring(h3.geo_to_h3(LAT, LON, 8), 1)]
+    areas = gpd.GeoDataFrame({'site_id': [0, 1]},
+                             geometry=[Polygon(circle(LON, LAT, 0.03)), shapely.union_all(patch)], crs=4326)
+    expected = LayerIndex(levels[8]).overlay(areas, clip=False)
+    result = index.overlay(areas)
+    for site in (0, 1):
+        assert (sorted(result.loc[result['site_id'] == site, 'H3_cell']) ==
+                sorted(expected.loc[expected['site_id'] == site, 'H3_cell']))
+    assert (result['site_id'] == 1).sum() == 7
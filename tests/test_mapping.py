@@ -0,0 +1,23 @@
+import geopandas as gpd
+from shapely.geometry import box
+
+from models.mapping import CatchmentAnalysis
+
+def test_analysis_frames_are_copies():
+    area = gpd.GeoDataFrame({'Ward Code': ['E1', 'E2'], 'Ward Name': ['One', 'Two'], 'total_population': [100, 200]},
+                            geometry=[box(0, 51, 0.01, 51.01), box(0.01, 51, 0.02, 51.01)], crs=4326)
+    prices = gpd.GeoDataFrame({'H3_cell': ['87195da49ffffff'], 'count': [3]}, geometry=[box(0, 51, 0.01, 51.01)], crs=4326)
+    analysis = CatchmentAnalysis('key', area, (0.01, 51.005), prices)
+
+    # What a session does to its results, as the dashboard's data download does
+    stats = analysis.stats
+    stats.columns = ['Ward', 'Name', 'Population']
+    stats['extra'] = 1
+    area = analysis.area
+    area.loc[0, 'total_population'] = 0
+    analysis.prices.drop(columns='count', inplace=True)
+
+    assert list(analysis.stats.columns) == ['Ward Code', 'Ward Name', 'total_population']
+    assert list(analysis.area['total_population']) == [100, 200]
+    assert 'count' in analysis.prices.columns
+    assert [f['properties'] for f in analysis.geojson(10)['features']] == [{'Ward Code': 'E1'}, {'Ward Code': 'E2'}]
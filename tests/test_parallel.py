@@ -0,0 +1,33 @@
+import threading
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+from models.parallel import ParallelLayerIndex, start_method
+from models.spatial_index import LayerIndex
+
+def grid(step: float = 0.002):
+    cells = [box(x, y, x + step, y + step)
+             for x in np.arange(-0.2, -0.1, step) for y in np.arange(51.45, 51.55, step)]
+    return gpd.GeoDataFrame({'Ward Code': [f'W{i:04d}' for i in range(len(cells))]}, geometry=cells, crs=4326)
+
+def test_threaded_process_does_not_fork_and_matches_in_process_overlay():
+    layer = grid()
+    area = gpd.GeoDataFrame({'contour': [30, 60]},
+                            geometry=[box(-0.19, 51.46, -0.13, 51.52), box(-0.15, 51.48, -0.11, 51.54)], crs=4326)
+    expected = LayerIndex(layer).overlay(area, fractions=True)
+
+    # Stands in for the dashboard's Supabase writer and metrics server threads
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, daemon=True)
+    thread.start()
+    index = ParallelLayerIndex(layer, max_workers=2, min_pairs=0)
+    try:
+        assert start_method() != 'fork'
+        result = index.overlay(area, fractions=True)
+    finally:
+        index.close()
+        stop.set()
+    assert list(result['Ward Code']) == list(expected['Ward Code'])
+    assert result.geometry.geom_equals(expected.geometry).all()
+    assert np.allclose(result['overlap_fraction'], expected['overlap_fraction'])
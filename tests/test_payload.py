@@ -0,0 +1,15 @@
+from decimal import Decimal
+import numpy as np
+import pytest
+
+from models.payload import dumps, to_native
+
+def test_numpy_scalars_are_written_as_python_values():
+    assert dumps({'count': np.int32(3), 'price': np.float32(2.5), 'cell': np.str_('85194ad3fffffff')}) == \
+        '{"count":3,"price":2.5,"cell":"85194ad3fffffff"}'
+
+def test_other_values_are_left_alone():
+    value = Decimal('1.5')
+    assert to_native(value) is value
+    with pytest.raises(TypeError, match='Decimal is not JSON serializable'):
+        dumps({'price': value})
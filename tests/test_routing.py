@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+
+from benchmarks.bench_isochrones import grid_coordinates, SPACING_METRES
+from models.cache import LRUCache
+from models.geocoding import Geocoder
+from models.isochrones import IsochroneProvider, LocalIsochrones
+from models.routing import RoadGraph, SPEED_PROFILES
+
+# A 20x20 street grid from bench_isochrones.grid_coordinates: residential streets, a primary
+# road every fifth line, row 1 one-way eastbound, plus a river and a tree off the road network
+GRID_OSM = os.path.join(os.path.dirname(__file__), 'data', 'grid.osm')
+SIZE = 20
+
+@pytest.fixture(scope='module')
+def graph():
+    return RoadGraph.from_osm(GRID_OSM)
+
+@pytest.fixture(scope='module')
+def order(graph):
+    '''Node ids follow first appearance in the ways; order maps grid position to node id.'''
+    return np.lexsort((np.round(graph.lon, 7), np.round(graph.lat, 7)))
+
+def test_extract_keeps_only_highway_nodes(graph, order, tmp_path):
+    assert graph.nodes == SIZE * SIZE and graph.edges == 2 * SIZE * (SIZE - 1)
+    lon, lat = grid_coordinates(SIZE)
+    assert np.allclose(graph.lon[order], lon) and np.allclose(graph.lat[order], lat)
+    loaded = RoadGraph.load(graph.save(str(tmp_path / 'grid.npz')))
+    assert np.array_equal(loaded.u, graph.u) and np.array_equal(loaded.oneway, graph.oneway)
+
+def test_travel_times_follow_the_streets(graph, order):
+    centre = (SIZE // 2) * SIZE + SIZE // 2
+    times = graph.mode('walking').travel_times([order[centre]], limit=np.inf)[order]
+    rows, cols = np.divmod(np.arange(SIZE * SIZE), SIZE)
+    manhattan = (np.abs(rows - SIZE // 2) + np.abs(cols - SIZE // 2)) * SPACING_METRES
+    assert np.allclose(times, manhattan / (SPEED_PROFILES['walking']['residential'] / 3.6), rtol=0.01)
+
+    # The one-way street forces a detour westbound
+    driving = graph.mode('driving')
+    a, b = order[SIZE], order[SIZE + 1]
+    assert driving.travel_times([b], limit=np.inf)[a] > driving.travel_times([a], limit=np.inf)[b] * 1.5
+
+def test_local_isochrones_grow_with_time_and_cache(graph, order):
+    provider = LocalIsochrones(graph=graph)
+    centre = order[(SIZE // 2) * SIZE + SIZE // 2]
+    origin = Point(graph.lon[centre], graph.lat[centre])
+    areas = []
+    for minutes in (2, 5, 10):
+        geojson = provider.isochrone_json(origin.x, origin.y, 'walking', minutes)
+        area = gpd.GeoDataFrame.from_features(geojson['features']).set_crs(epsg=4326)
+        assert geojson['features'][0]['properties']['contour'] == minutes
+        assert area.geometry.iloc[0].contains(origin)
+        areas.append(area.to_crs(27700).area.iloc[0])
+    assert areas[0] < areas[1] < areas[2]
+    # A 5 minute walk covers ~417m of Manhattan distance, a diamond of ~0.35 km2 plus the corridor
+    assert 0.25e6 < areas[1] < 0.7e6
+
+    geocoder = Geocoder(None, cache=LRUCache(), provider=provider)
+    assert geocoder.isochrone_json(origin.x, origin.y, 'walking', 5) == provider.isochrone_json(origin.x, origin.y, 'walking', 5)
+    assert len(geocoder.cache) == 1
+
+def test_providers_must_implement_isochrone_json():
+    with pytest.raises(TypeError):
+        IsochroneProvider()
@@ -0,0 +1,39 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+from models.spatial_index import LayerIndex
+
+def grid(step: float = 0.01):
+    cells = [box(x, y, x + step, y + step)
+             for x in np.arange(-0.2, -0.1, step) for y in np.arange(51.45, 51.55, step)]
+    return gpd.GeoDataFrame({'Ward Code': [f'W{i:03d}' for i in range(len(cells))]}, geometry=cells, crs=4326)
+
+def test_unclipped_fractions_measure_the_overlap():
+    index = LayerIndex(grid())
+    # Edges run through the middle of grid cells, so the ring of cells around it is half inside
+    area = gpd.GeoDataFrame({'contour': [30]}, geometry=[box(-0.175, 51.475, -0.125, 51.525)], crs=4326)
+    clipped = index.overlay(area, fractions=True)
+    whole = index.overlay(area, clip=False, fractions=True)
+    assert list(whole['Ward Code']) == list(clipped['Ward Code'])
+    assert whole.to_crs(27700).area.sum() > clipped.to_crs(27700).area.sum()
+    assert np.allclose(whole['overlap_fraction'], clipped['overlap_fraction'])
+    assert whole['overlap_fraction'].min() < 0.3
+
+def unit_grid(size: int = 4):
+    cells = [box(x, y, x + 1, y + 1) for x in range(size) for y in range(size)]
+    return gpd.GeoDataFrame({'Ward Code': [f'W{i:02d}' for i in range(len(cells))]}, geometry=cells, crs=27700)
+
+def test_clipped_pieces_match_gpd_overlay_when_edges_are_shared():
+    layer = unit_grid()
+    # The notch cuts into the cell above the strip, whose bottom edge the strip also runs along
+    area = gpd.GeoDataFrame({'contour': [30]}, geometry=[box(0, 0, 3, 1).union(box(1.2, 1, 1.4, 1.5))], crs=27700)
+    result = LayerIndex(layer).overlay(area)
+    expected = gpd.overlay(area, layer, how='intersection', keep_geom_type=True)
+    assert list(result['Ward Code']) == list(expected['Ward Code'])
+    assert all(a.equals(b) for a, b in zip(result.geometry, expected.geometry))
+
+def test_features_only_touching_the_area_are_not_members():
+    index = LayerIndex(unit_grid())
+    area = gpd.GeoDataFrame({'contour': [30]}, geometry=[box(1, 1, 3, 3)], crs=27700)
+    assert len(index.overlay(area, clip=False)) == len(index.overlay(area)) == 4
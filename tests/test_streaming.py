@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from models.hexbin import HexBinner, within_three_sigma
+from models.streaming import HISTOGRAM_EDGES, StreamingHexAggregator, stream_h3
+
+LAYER_COLUMNS = ['H3_cell', 'mean_price', 'median_price', 'total_paid', 'count', 'geometry']
+
+def test_empty_csv_gives_an_empty_layer(tmp_path):
+    path = tmp_path / 'sales.csv'
+    path.write_text('latitude,longitude,AMOUNT\n')
+    for two_pass in (True, False):
+        layer = stream_h3(str(path), two_pass=two_pass)
+        assert len(layer) == 0 and list(layer.columns) == LAYER_COLUMNS
+
+def test_no_chunks_or_every_sale_filtered_gives_an_empty_layer():
+    sales = pd.DataFrame({'latitude': [51.5, 51.6], 'longitude': [-0.1, -0.2], 'AMOUNT': [250000.0, 300000.0]})
+    for aggregator in (StreamingHexAggregator(), StreamingHexAggregator(threshold=1).consume([sales])):
+        assert list(aggregator.histograms().columns) == ['cell', 'bin', 'count', 'total']
+        layer = aggregator.result()
+        assert len(layer) == 0 and list(layer.columns) == LAYER_COLUMNS
+
+def test_chunked_histograms_match_binning_in_memory(tmp_path):
+    rng = np.random.default_rng(0)
+    sales = pd.DataFrame({'latitude': rng.uniform(51.4, 51.6, 5000),
+                          'longitude': rng.uniform(-0.3, 0.0, 5000),
+                          'AMOUNT': rng.lognormal(12.5, 0.6, 5000).round()})
+    path = tmp_path / 'sales.csv'
+    sales.to_csv(path, index=False)
+    streamed = stream_h3(str(path), resolution=7, chunksize=700).set_index('H3_cell')
+    expected = (HexBinner(resolutions=7).bin_frame(sales[within_three_sigma(sales['AMOUNT'])])[7]
+                .set_index('H3_cell'))
+    assert len(expected) > 20 and sorted(streamed.index) == sorted(expected.index)
+    streamed = streamed.loc[expected.index]
+    assert np.array_equal(streamed['count'], expected['count'])
+    assert np.allclose(streamed['total_paid'], expected['total_paid'])
+    # Medians are interpolated within a price bin
+    bin_width = HISTOGRAM_EDGES[1] / HISTOGRAM_EDGES[0] - 1
+    assert np.allclose(streamed['median_price'], expected['median_price'], rtol=bin_width)